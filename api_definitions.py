@@ -14,12 +14,16 @@ from flask import Blueprint, request, jsonify, session
 from flask_login import login_required, current_user
 from app import db
 from models import User, WasteItem, UserPlasticFootprintMonthly, PlasticFootprintScan
-from models import InfrastructureProject, WasteBatch, ProjectContributor, ProjectLedger
+from models import InfrastructureProject, WasteBatch, ProjectContributor, ProjectLedger, BatchMembership
 from models import LocalizationString
+from top_contributors import get_project_contributors, record_batch_link
+from ledger_append import get_project_tip
+from api_paging import (
+    encode_cursor, decode_cursor, page_limit, invalid_cursor_response,
+    project_validators, not_modified, with_validators
+)
 from datetime import datetime, date
-from sqlalchemy import func, desc
-import hashlib
-import json
+from sqlalchemy import func, desc, or_, and_
 import logging
 
 # Create blueprints for each feature
@@ -27,6 +31,9 @@ footprint_bp = Blueprint('footprint', __name__, url_prefix='/api/footprint')
 i18n_bp = Blueprint('i18n', __name__, url_prefix='/api/i18n')
 projects_bp = Blueprint('projects', __name__, url_prefix='/api/projects')
 
+# Projects without a created_at are listed as the oldest
+PROJECT_CREATED_FALLBACK = datetime(1970, 1, 1)
+
 # ============================================================================
 # FEATURE 1: PLASTIC FOOTPRINT TRACKER API
 # ============================================================================
@@ -479,8 +486,9 @@ def list_projects():
     Query Parameters:
     - status: Filter by status (planned, in_progress, completed)
     - user_id: Filter projects where user contributed (requires auth)
-    - limit: Number of results (default: 20)
-    - offset: Pagination offset (default: 0)
+    - limit: Number of results (default: 20, max: 100)
+    - cursor: next_cursor from the previous page (omit for the first page)
+    - include_total: 1 to also count all matching projects
     
     Response:
     {
@@ -505,24 +513,55 @@ def list_projects():
             },
             ...
         ],
-        "total": 15,
         "limit": 20,
-        "offset": 0
+        "next_cursor": "WyIyMDI0LTAxLTE1VDEwOjMwOjAwIiwgMTJd",  // null on the last page
+        "has_more": true,
+        "total": 15  // only with include_total=1
     }
     """
     try:
         status = request.args.get('status')
         user_id = request.args.get('user_id')
-        limit = int(request.args.get('limit', 20))
-        offset = int(request.args.get('offset', 0))
+        limit = page_limit()
+        try:
+            after = decode_cursor(request.args.get('cursor'), 2)
+            if after:
+                after = (datetime.fromisoformat(after[0]), int(after[1]))
+        except (TypeError, ValueError):
+            return invalid_cursor_response()
         
         query = InfrastructureProject.query
         
         if status:
             query = query.filter_by(status=status)
         
-        total = query.count()
-        projects = query.order_by(desc(InfrastructureProject.created_at)).limit(limit).offset(offset).all()
+        # Counting every match is opt-in; paging itself doesn't need it
+        total = query.count() if request.args.get('include_total') == '1' else None
+        
+        # Newest first; continue strictly after the last (created_at, id) seen.
+        # created_at is nullable, so NULL sorts as PROJECT_CREATED_FALLBACK
+        created_at = func.coalesce(InfrastructureProject.created_at, PROJECT_CREATED_FALLBACK)
+        if after:
+            query = query.filter(or_(
+                created_at < after[0],
+                and_(created_at == after[0], InfrastructureProject.id < after[1])
+            ))
+        projects = query.order_by(desc(created_at), desc(InfrastructureProject.id)).limit(limit + 1).all()
+        
+        # The extra row only tells whether another page follows
+        has_more = len(projects) > limit
+        projects = projects[:limit]
+        next_cursor = None
+        if has_more:
+            last_created = projects[-1].created_at or PROJECT_CREATED_FALLBACK
+            next_cursor = encode_cursor(last_created.isoformat(), projects[-1].id)
+        
+        # User contributions for the whole page in one grouped query
+        include_user = bool(user_id and current_user.is_authenticated and int(user_id) == current_user.id)
+        summaries = {}
+        if include_user:
+            from project_contributions import get_project_contributions
+            summaries = get_project_contributions([project.id for project in projects], current_user.id)
         
         result_projects = []
         for project in projects:
@@ -543,32 +582,23 @@ def list_projects():
             }
             
             # Add user contribution if user_id provided
-            if user_id and current_user.is_authenticated and int(user_id) == current_user.id:
-                user_contrib = db.session.query(
-                    func.sum(ProjectContributor.contribution_weight_grams)
-                ).join(WasteBatch).filter(
-                    WasteBatch.linked_project_id == project.id,
-                    ProjectContributor.user_id == current_user.id
-                ).scalar() or 0.0
-                
-                is_top = ProjectContributor.query.join(WasteBatch).filter(
-                    WasteBatch.linked_project_id == project.id,
-                    ProjectContributor.user_id == current_user.id,
-                    ProjectContributor.is_top_contributor == True
-                ).first() is not None
-                
-                project_data['user_contribution_grams'] = float(user_contrib)
-                project_data['is_top_contributor'] = is_top
+            if include_user:
+                project_data['user_contribution_grams'] = summaries[project.id]['weight']
+                project_data['is_top_contributor'] = summaries[project.id]['is_top']
             
             result_projects.append(project_data)
         
-        return jsonify({
+        response = {
             'success': True,
             'projects': result_projects,
-            'total': total,
             'limit': limit,
-            'offset': offset
-        }), 200
+            'next_cursor': next_cursor,
+            'has_more': has_more
+        }
+        if total is not None:
+            response['total'] = total
+        
+        return jsonify(response), 200
         
     except Exception as e:
         logging.error(f"Error listing projects: {e}")
@@ -583,7 +613,16 @@ def get_project(project_id):
     """
     GET /api/projects/{project_id}
     
-    Get detailed information about a specific project.
+    Get detailed information about a specific project, with the first page of
+    its contributors (in rank order) and of its ledger (in chain order). Further
+    pages come from /contributors and /ledger with the returned cursors.
+    
+    Query Parameters:
+    - limit: Contributors and ledger entries to include (default: 20, max: 100)
+    
+    Sends ETag and Last-Modified (from the project's updated_at and its ledger
+    tip); a request with a matching If-None-Match or If-Modified-Since gets an
+    empty 304.
     
     Response:
     {
@@ -612,8 +651,10 @@ def get_project(project_id):
                 },
                 ...
             ],
+            "contributors_next_cursor": "WzUwMDAuMCwgMV0",  // null if that was all
             "ledger_entries": [
                 {
+                    "seq": 1,
                     "timestamp": "2024-01-15T10:30:00Z",
                     "status": "in_progress",
                     "verified_by": "system",
@@ -621,44 +662,34 @@ def get_project(project_id):
                     "block_hash": "abc123..."
                 },
                 ...
-            ]
+            ],
+            "ledger_next_cursor": null
         }
     }
     """
     try:
-        project = InfrastructureProject.query.filter_by(project_id=project_id).first_or_404()
-        
-        # Get contributors
-        contributors = db.session.query(
-            User.id,
-            User.username,
-            func.sum(ProjectContributor.contribution_weight_grams).label('total_contribution')
-        ).join(ProjectContributor).join(WasteBatch).filter(
-            WasteBatch.linked_project_id == project.id
-        ).group_by(User.id, User.username).order_by(desc('total_contribution')).all()
-        
-        # Get top contributor status
-        top_contributors = set()
-        if contributors:
-            total_contrib = sum(c.total_contribution for c in contributors)
-            top_10_percent_threshold = total_contrib * 0.1
-            cumulative = 0
-            for contrib in contributors:
-                cumulative += contrib.total_contribution
-                if cumulative <= top_10_percent_threshold:
-                    top_contributors.add(contrib.id)
-        
-        # Get ledger entries
-        ledger_entries = ProjectLedger.query.filter_by(
-            project_id=project_id
-        ).order_by(ProjectLedger.timestamp).all()
+        project = InfrastructureProject.query.filter_by(project_id=project_id).first()
+        if not project:
+            return jsonify({
+                'success': False,
+                'error': 'Project not found'
+            }), 404
+        limit = page_limit()
+        
+        etag, last_modified = project_validators(project, get_project_tip(project_id), 'detail', limit)
+        cached = not_modified(etag, last_modified)
+        if cached:
+            return cached
+        
+        contributors, contributors_next = _contributor_page(project, limit)
+        ledger_entries, ledger_next = _ledger_page(project_id, limit)
         
         # Calculate progress
         progress = 0.0
         if project.total_plastic_required_grams and project.total_plastic_required_grams > 0:
-            progress = (project.total_plastic_allocated_grams / project.total_plastic_required_grams) * 100.0
+            progress = (float(project.total_plastic_allocated_grams or 0) / float(project.total_plastic_required_grams)) * 100.0
         
-        return jsonify({
+        response = jsonify({
             'success': True,
             'project': {
                 'project_id': project.project_id,
@@ -675,27 +706,13 @@ def get_project(project_id):
                 'total_plastic_allocated_grams': float(project.total_plastic_allocated_grams) if project.total_plastic_allocated_grams else 0.0,
                 'project_type': project.project_type,
                 'progress_percentage': round(progress, 2),
-                'contributors': [
-                    {
-                        'user_id': c.id,
-                        'username': c.username,
-                        'contribution_grams': float(c.total_contribution),
-                        'is_top_contributor': c.id in top_contributors
-                    }
-                    for c in contributors
-                ],
-                'ledger_entries': [
-                    {
-                        'timestamp': le.timestamp.isoformat(),
-                        'status': le.status,
-                        'verified_by': le.verified_by,
-                        'batch_reference': le.batch_reference,
-                        'block_hash': le.block_hash
-                    }
-                    for le in ledger_entries
-                ]
+                'contributors': contributors,
+                'contributors_next_cursor': contributors_next,
+                'ledger_entries': ledger_entries,
+                'ledger_next_cursor': ledger_next
             }
-        }), 200
+        })
+        return with_validators(response, etag, last_modified), 200
         
     except Exception as e:
         logging.error(f"Error getting project: {e}")
@@ -705,6 +722,197 @@ def get_project(project_id):
         }), 500
 
 
+def _contributor_page(project, limit, after=None):
+    """A page of a project's contributors in rank order, and the cursor for the next one"""
+    contributors = get_project_contributors(project.id, limit=limit + 1, after=after)
+    if len(contributors) <= limit:
+        return contributors, None
+    contributors = contributors[:limit]
+    last = contributors[-1]
+    return contributors, encode_cursor(last['contribution_grams'], last['user_id'])
+
+
+def _ledger_page(project_id, limit, after_seq=None):
+    """A page of a project's ledger in chain order, and the cursor for the next one"""
+    query = ProjectLedger.query.filter(ProjectLedger.project_id == project_id)
+    if after_seq is not None:
+        query = query.filter(ProjectLedger.seq > after_seq)
+    entries = query.order_by(ProjectLedger.seq, ProjectLedger.id).limit(limit + 1).all()
+    
+    next_cursor = None
+    if len(entries) > limit:
+        entries = entries[:limit]
+        next_cursor = encode_cursor(entries[-1].seq)
+    
+    return [
+        {
+            'seq': le.seq,
+            'timestamp': le.timestamp.isoformat(),
+            'status': le.status,
+            'verified_by': le.verified_by,
+            'batch_reference': le.batch_reference,
+            'block_hash': le.block_hash
+        }
+        for le in entries
+    ], next_cursor
+
+
+@projects_bp.route('/<project_id>/contributors', methods=['GET'])
+def get_project_contributor_page(project_id):
+    """
+    GET /api/projects/{project_id}/contributors
+    
+    Page through a project's contributors in rank order.
+    
+    Query Parameters:
+    - limit: Number of results (default: 20, max: 100)
+    - cursor: next_cursor from the previous page (omit for the first page)
+    
+    Response (with ETag / Last-Modified, 304 if unchanged):
+    {
+        "success": true,
+        "contributors": [{"user_id": 1, "username": "user1", "contribution_grams": 5000.0, "is_top_contributor": true}, ...],
+        "next_cursor": "WzEyNTAuMCwgN10"
+    }
+    """
+    try:
+        project = InfrastructureProject.query.filter_by(project_id=project_id).first()
+        if not project:
+            return jsonify({
+                'success': False,
+                'error': 'Project not found'
+            }), 404
+        limit = page_limit()
+        cursor = request.args.get('cursor')
+        try:
+            after = decode_cursor(cursor, 2)
+            if after:
+                after = (float(after[0]), int(after[1]))
+        except (TypeError, ValueError):
+            return invalid_cursor_response()
+        
+        etag, last_modified = project_validators(project, get_project_tip(project_id), 'contributors', limit, cursor)
+        cached = not_modified(etag, last_modified)
+        if cached:
+            return cached
+        
+        contributors, next_cursor = _contributor_page(project, limit, after)
+        response = jsonify({
+            'success': True,
+            'contributors': contributors,
+            'next_cursor': next_cursor
+        })
+        return with_validators(response, etag, last_modified), 200
+        
+    except Exception as e:
+        logging.error(f"Error getting project contributors: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@projects_bp.route('/<project_id>/ledger', methods=['GET'])
+def get_project_ledger_page(project_id):
+    """
+    GET /api/projects/{project_id}/ledger
+    
+    Page through a project's ledger entries in chain order.
+    
+    Query Parameters:
+    - limit: Number of results (default: 20, max: 100)
+    - cursor: next_cursor from the previous page (omit for the first page)
+    
+    Response (with ETag / Last-Modified, 304 if unchanged):
+    {
+        "success": true,
+        "ledger_entries": [{"seq": 21, "timestamp": "...", "status": "allocated", ...}, ...],
+        "next_cursor": null
+    }
+    """
+    try:
+        project = InfrastructureProject.query.filter_by(project_id=project_id).first()
+        if not project:
+            return jsonify({
+                'success': False,
+                'error': 'Project not found'
+            }), 404
+        limit = page_limit()
+        cursor = request.args.get('cursor')
+        try:
+            after = decode_cursor(cursor, 1)
+            after_seq = int(after[0]) if after else None
+        except (TypeError, ValueError):
+            return invalid_cursor_response()
+        
+        etag, last_modified = project_validators(project, get_project_tip(project_id), 'ledger', limit, cursor)
+        cached = not_modified(etag, last_modified)
+        if cached:
+            return cached
+        
+        ledger_entries, next_cursor = _ledger_page(project_id, limit, after_seq)
+        response = jsonify({
+            'success': True,
+            'ledger_entries': ledger_entries,
+            'next_cursor': next_cursor
+        })
+        return with_validators(response, etag, last_modified), 200
+        
+    except Exception as e:
+        logging.error(f"Error getting project ledger: {e}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@projects_bp.route('/<project_id>/proofs/<batch_reference>', methods=['GET'])
+def get_batch_inclusion_proofs(project_id, batch_reference):
+    """
+    GET /api/projects/{project_id}/proofs/{batch_reference}
+    
+    Get Merkle inclusion proofs showing a batch was recorded in the project
+    ledger. Each proof is checked by hashing up from the entry's block_hash
+    (O(log n) hashes) and comparing with the anchor block's merkle_root.
+    Entries appended since the last anchor run are returned with anchored=false.
+    
+    Response:
+    {
+        "success": true,
+        "project_id": "proj_001",
+        "batch_reference": "batch_001",
+        "proofs": [
+            {
+                "ledger_id": 42,
+                "status": "allocated",
+                "block_hash": "abc123...",
+                "anchored": true,
+                "leaf_index": 5,
+                "proof": [{"hash": "def456...", "side": "left"}, ...],
+                "merkle_root": "789abc...",
+                "verified": true,
+                "anchor": {"ledger_id": 50, "block_hash": "...", "is_valid": true, ...}
+            }
+        ]
+    }
+    """
+    from blockchain_tracker import get_inclusion_proofs
+    
+    proofs = get_inclusion_proofs(project_id, batch_reference)
+    if not proofs:
+        return jsonify({
+            'success': False,
+            'error': 'No ledger entries found for this batch'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'project_id': project_id,
+        'batch_reference': batch_reference,
+        'proofs': proofs
+    }), 200
+
+
 @projects_bp.route('/batch/create', methods=['POST'])
 @login_required
 def create_batch():
@@ -774,14 +982,23 @@ def create_batch():
                         contribution_weight_grams=float(weight)
                     )
                     db.session.add(contributor)
+                    
+                    if not BatchMembership.query.filter_by(waste_item_id=item_id).first():
+                        db.session.add(BatchMembership(
+                            waste_item_id=item_id,
+                            batch_id=batch.id,
+                            weight_grams=float(weight),
+                            source='manual'
+                        ))
         
         # Update project allocated weight
         if linked_project_id:
             project = InfrastructureProject.query.get(linked_project_id)
             if project:
                 project.total_plastic_allocated_grams = (
-                    (project.total_plastic_allocated_grams or 0) + float(total_weight_grams)
+                    float(project.total_plastic_allocated_grams or 0) + float(total_weight_grams)
                 )
+                record_batch_link(project.id, batch.id)
         
         db.session.commit()
         
@@ -807,7 +1024,7 @@ def update_ledger():
     POST /api/projects/ledger/update
     
     Add a ledger entry for project update (blockchain-like).
-    Also syncs to Firebase Firestore.
+    The entry is synced to Firebase Firestore in the background.
     
     Request Body:
     {
@@ -842,59 +1059,34 @@ def update_ledger():
                 'error': 'project_id and status are required'
             }), 400
         
-        # Get previous hash
-        previous_entry = ProjectLedger.query.filter_by(
-            project_id=project_id
-        ).order_by(desc(ProjectLedger.timestamp)).first()
-        
-        previous_hash = previous_entry.block_hash if previous_entry else None
+        # Append to the project chain (sequence-numbered, never forks)
+        from ledger_append import append_project_entry
         
-        # Calculate block hash
-        import json as json_lib
-        
-        block_hash = calculate_ledger_hash(
-            project_id,
-            datetime.utcnow(),
-            status,
-            verified_by,
-            batch_reference,
-            previous_hash,
-            json_lib.dumps(extra_data)
-        )
-        
-        # Create ledger entry
-        ledger = ProjectLedger(
+        ledger = append_project_entry(
             project_id=project_id,
             status=status,
             verified_by=verified_by,
             batch_reference=batch_reference,
-            previous_hash=previous_hash,
-            block_hash=block_hash,
-            data=json_lib.dumps(extra_data)
+            block_data={
+                'batch_id': batch_reference,
+                'project_id': project_id,
+                'action': status,
+                'verified_by': verified_by,
+                'metadata': extra_data
+            }
         )
-        db.session.add(ledger)
+        block_hash = ledger.block_hash
         db.session.commit()
         
-        # Sync to Firebase Firestore
-        from firestore_sync import write_ledger_entry
-        firestore_synced = write_ledger_entry(
-            project_id=project_id,
-            batch_id=batch_reference or '',
-            weight=0,  # Weight will be in extra_data if provided
-            verified_by=verified_by,
-            status=status
-        )
-        
-        # Update ledger sync status
-        if firestore_synced:
-            ledger.firestore_synced = True
-            db.session.commit()
+        # Copied to Firebase Firestore by the outbox worker
+        from firestore_sync import request_sync
+        request_sync()
         
         return jsonify({
             'success': True,
             'ledger_id': ledger.id,
             'block_hash': block_hash,
-            'firestore_synced': firestore_synced
+            'firestore_synced': bool(ledger.firestore_synced)
         }), 200
         
     except Exception as e:
@@ -906,12 +1098,6 @@ def update_ledger():
         }), 500
 
 
-def calculate_ledger_hash(project_id, timestamp, status, verified_by, batch_reference, previous_hash, data):
-    """Calculate SHA256 hash for ledger entry"""
-    hash_input = f"{project_id}|{timestamp}|{status}|{verified_by}|{batch_reference}|{previous_hash}|{data}"
-    return hashlib.sha256(hash_input.encode()).hexdigest()
-
-
 # ============================================================================
 # REGISTER BLUEPRINTS
 # ============================================================================
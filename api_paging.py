@@ -0,0 +1,117 @@
+"""
+Keyset pagination and conditional GET helpers for the ReGenWorks JSON APIs.
+
+List endpoints page with opaque cursors that carry the sort key of the last
+row returned, so each page is an index range scan instead of an OFFSET that
+reads and discards every earlier row. Project endpoints send ETag and
+Last-Modified validators computed from a couple of cheap lookups, and answer
+a matching If-None-Match / If-Modified-Since with 304 before building the
+response body.
+"""
+
+import json
+import base64
+import hashlib
+from datetime import timezone
+from flask import request, jsonify, Response
+
+
+class InvalidCursor(ValueError):
+    """A cursor that was not issued by encode_cursor"""
+
+
+def encode_cursor(*values):
+    """Opaque cursor for the sort key of the last row of a page"""
+    raw = json.dumps(list(values), separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, length):
+    """
+    Sort key carried by a cursor.
+
+    Args:
+        cursor: Value from encode_cursor (None or empty for the first page)
+        length: Number of values the cursor must carry
+
+    Returns:
+        List of values, or None for the first page
+
+    Raises:
+        InvalidCursor: If the cursor is malformed
+    """
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list) or len(values) != length:
+        raise InvalidCursor(cursor)
+    return values
+
+
+def page_limit(default=20, maximum=100):
+    """The request's limit argument, clamped to 1..maximum"""
+    try:
+        limit = int(request.args.get('limit', default))
+    except ValueError:
+        limit = default
+    return max(1, min(limit, maximum))
+
+
+def invalid_cursor_response():
+    return jsonify({
+        'success': False,
+        'error': 'Invalid cursor'
+    }), 400
+
+
+def project_validators(project, tip, *extra):
+    """
+    ETag and Last-Modified for a response built from a project row and its
+    ledger.
+
+    Args:
+        project: InfrastructureProject (its updated_at moves whenever a batch is linked)
+        tip: The project's latest ProjectLedger entry (ledger_append.get_project_tip), or None
+        extra: Anything else the response depends on (page arguments)
+
+    Returns:
+        Tuple of (etag, last_modified)
+    """
+    parts = [project.project_id, project.updated_at.isoformat() if project.updated_at else '',
+             tip.block_hash if tip else '']
+    parts.extend(str(value) for value in extra)
+    etag = hashlib.sha256('|'.join(parts).encode()).hexdigest()[:32]
+
+    times = [t for t in (project.updated_at, tip.timestamp if tip else None) if t is not None]
+    last_modified = max(times).replace(tzinfo=timezone.utc) if times else None
+    return etag, last_modified
+
+
+def not_modified(etag, last_modified):
+    """
+    304 response if the client's cached copy is current, else None.
+    If-None-Match takes precedence over If-Modified-Since.
+    """
+    if request.if_none_match:
+        fresh = request.if_none_match.contains(etag)
+    elif request.if_modified_since and last_modified:
+        # HTTP dates have one-second resolution
+        fresh = last_modified.replace(microsecond=0) <= request.if_modified_since
+    else:
+        fresh = False
+
+    if not fresh:
+        return None
+    return with_validators(Response(status=304), etag, last_modified)
+
+
+def with_validators(response, etag, last_modified):
+    """Attach validators and require revalidation on every use"""
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
@@ -7,9 +7,9 @@ import uuid
 import logging
 from datetime import datetime
 from sqlalchemy import func
-from models import db, WasteItem, WasteBatch, InfrastructureProject, ProjectContributor, ProjectLedger
+from models import db, WasteItem, WasteBatch, InfrastructureProject, ProjectContributor, BatchMembership
 from blockchain_tracker import create_material_journey_block
-from firestore_sync import write_ledger_entry
+from firestore_sync import request_sync
 
 def auto_create_batch_from_waste_item(waste_item_id: int):
     """
@@ -32,6 +32,11 @@ def auto_create_batch_from_waste_item(waste_item_id: int):
             logging.info(f"Waste item {waste_item_id} is not recyclable, skipping batch creation")
             return False
         
+        # Each item goes into exactly one batch
+        if BatchMembership.query.filter_by(waste_item_id=waste_item_id).first():
+            logging.info(f"Waste item {waste_item_id} is already in a batch")
+            return True
+        
         # Get material type
         material_type = waste_item.material_type or waste_item.material or 'Plastic'
         
@@ -69,6 +74,14 @@ def auto_create_batch_from_waste_item(waste_item_id: int):
         
         db.session.flush()  # Get batch.id
         
+        # Record which batch the item went into
+        db.session.add(BatchMembership(
+            waste_item_id=waste_item.id,
+            batch_id=batch.id,
+            weight_grams=weight,
+            source='auto'
+        ))
+        
         # Create contributor entry if user is logged in
         if waste_item.user_id:
             # Check if contributor entry already exists
@@ -92,12 +105,16 @@ def auto_create_batch_from_waste_item(waste_item_id: int):
                 logging.info(f"Created contributor entry for user {waste_item.user_id}")
         
         # Auto-link batch to a project if batch reaches threshold (e.g., 1000g or more)
+        linked = False
         if float(batch.total_weight_grams) >= 1000.0 and not batch.linked_project_id:
             project = find_suitable_project(material_type)
             if project:
-                link_batch_to_project_auto(batch, project, waste_item.user_id)
+                linked = link_batch_to_project_auto(batch, project, waste_item.user_id)
         
         db.session.commit()
+        
+        if linked:
+            request_sync()
         return True
         
     except Exception as e:
@@ -166,7 +183,7 @@ def link_batch_to_project_auto(batch: WasteBatch, project: InfrastructureProject
         )
         
         # Update project status if needed
-        if project.status == 'planned' and project.total_plastic_allocated_grams >= (project.total_plastic_required_grams or 0) * 0.1:
+        if project.status == 'planned' and project.total_plastic_allocated_grams >= float(project.total_plastic_required_grams or 0) * 0.1:
             project.status = 'in_progress'
             if project.date_started is None:
                 project.date_started = datetime.utcnow().date()
@@ -175,15 +192,7 @@ def link_batch_to_project_auto(batch: WasteBatch, project: InfrastructureProject
         verified_by = f'user_{user_id}' if user_id else 'system'
         
         # Create ledger entry for blockchain
-        from blockchain_tracker import calculate_block_hash
-        import json as json_lib
-        
-        # Get previous hash
-        previous_entry = ProjectLedger.query.filter_by(
-            project_id=project.project_id
-        ).order_by(ProjectLedger.timestamp.desc()).first()
-        
-        previous_hash = previous_entry.block_hash if previous_entry else None
+        from ledger_append import append_project_entry
         
         # Create block data
         block_data = {
@@ -199,35 +208,19 @@ def link_batch_to_project_auto(batch: WasteBatch, project: InfrastructureProject
             }
         }
         
-        # Calculate block hash
-        block_hash = calculate_block_hash(block_data, previous_hash)
-        
-        # Create ledger entry
-        ledger_entry = ProjectLedger(
+        # Append to the project chain (sequence-numbered, never forks);
+        # the caller's commit puts it in the Firestore outbox
+        append_project_entry(
             project_id=project.project_id,
-            batch_reference=batch.batch_id,
             status='allocated',
             verified_by=verified_by,
-            previous_hash=previous_hash,
-            block_hash=block_hash,
-            data=json_lib.dumps(block_data),
-            timestamp=datetime.utcnow()
-        )
-        
-        db.session.add(ledger_entry)
-        
-        # Write to Firestore ledger
-        write_ledger_entry(
-            project_id=project.project_id,
-            batch_id=batch.batch_id,
-            weight=int(batch.total_weight_grams),
-            verified_by=verified_by,
-            status='allocated'
+            batch_reference=batch.batch_id,
+            block_data=block_data
         )
         
         # Update top contributors
-        from infrastructure_projects import update_top_contributors
-        update_top_contributors(project.id)
+        from top_contributors import record_batch_link
+        record_batch_link(project.id, batch.id)
         
         logging.info(f"Auto-linked batch {batch.batch_id} to project {project.project_name}")
         return True
@@ -260,6 +253,7 @@ def process_pending_batches():
         
         if linked_count > 0:
             db.session.commit()
+            request_sync()
             logging.info(f"Auto-linked {linked_count} batches to projects")
         
         return linked_count
@@ -269,3 +263,70 @@ def process_pending_batches():
         db.session.rollback()
         return 0
 
+def backfill_batch_memberships():
+    """
+    One-off migration: reconstruct batch membership for items batched before
+    memberships were recorded.
+    
+    Mirrors how auto_create_batch_from_waste_item picks a batch, restricted to
+    batches the item's user contributed to with the item's material: the most
+    recent batch collected in the 7 days before the scan that was still open
+    (not yet allocated) at scan time; failing that, the batch the item itself
+    created moments after the scan. Items that match nothing are left alone.
+    
+    Returns:
+        Dictionary with matched, ambiguous and unmatched counts
+    """
+    from datetime import timedelta
+    
+    window_before = timedelta(days=7)
+    created_within = timedelta(minutes=1)
+    
+    items = WasteItem.query.outerjoin(
+        BatchMembership, BatchMembership.waste_item_id == WasteItem.id
+    ).filter(
+        BatchMembership.id.is_(None),
+        WasteItem.is_recyclable == True,
+        WasteItem.user_id.isnot(None)
+    ).all()
+    
+    # Batches each user contributed to, loaded once
+    user_batches = {}
+    for user_id, batch_id, material_type, collection_date, processing_date in db.session.query(
+        ProjectContributor.user_id, WasteBatch.id, WasteBatch.material_type,
+        WasteBatch.collection_date, WasteBatch.processing_date
+    ).join(WasteBatch, ProjectContributor.batch_id == WasteBatch.id).all():
+        if collection_date:
+            user_batches.setdefault(user_id, []).append((batch_id, material_type, collection_date, processing_date))
+    
+    counts = {'matched': 0, 'ambiguous': 0, 'unmatched': 0}
+    for item in items:
+        material_type = item.material_type or item.material or 'Plastic'
+        scanned_at = item.created_at
+        batches = [b for b in user_batches.get(item.user_id, []) if b[1] == material_type] if scanned_at else []
+        
+        open_before = [
+            b for b in batches
+            if scanned_at - window_before <= b[2] <= scanned_at and (b[3] is None or b[3] > scanned_at)
+        ]
+        created_after = [b for b in batches if scanned_at < b[2] <= scanned_at + created_within]
+        
+        if open_before:
+            batch_id = max(open_before, key=lambda b: b[2])[0]
+        elif len(created_after) == 1:
+            batch_id = created_after[0][0]
+        else:
+            counts['ambiguous' if created_after else 'unmatched'] += 1
+            continue
+        
+        db.session.add(BatchMembership(
+            waste_item_id=item.id,
+            batch_id=batch_id,
+            weight_grams=float(item.estimated_weight_grams) if item.estimated_weight_grams else 25.0,
+            source='backfill'
+        ))
+        counts['matched'] += 1
+    
+    db.session.commit()
+    logging.info(f"Batch membership backfill: {counts}")
+    return counts
@@ -1,11 +1,29 @@
 """
 Blockchain-like waste tracking system service for ReGenWorks.
 This module manages the creation and validation of waste journey blocks.
+
+Integrity mode (BLOCKCHAIN_INTEGRITY_MODE):
+    none  - plain hash chain, no proof of work
+    async - plain hash chain on the request path; a background sealer adds a
+            proof of work over each block afterwards (default)
+    pow   - proof of work mined synchronously inside the block hash
+BLOCKCHAIN_POW_DIFFICULTY sets the leading zeros required by async and pow.
 """
 
-from models import WasteJourneyBlock, WasteItem
-from app import db
+import os
+import sys
+import time
+import queue
+import logging
+import threading
 from datetime import datetime
+from sqlalchemy import update, or_
+from app import db
+from models import WasteJourneyBlock, WasteItem
+
+INTEGRITY_MODES = ('none', 'async', 'pow')
+INTEGRITY_MODE = os.environ.get('BLOCKCHAIN_INTEGRITY_MODE', 'async')
+POW_DIFFICULTY = int(os.environ.get('BLOCKCHAIN_POW_DIFFICULTY', 2))
 
 # Define the journey stages and their descriptions
 JOURNEY_STAGES = {
@@ -50,7 +68,7 @@ def get_journey_stages():
     """
     return JOURNEY_STAGES
 
-def create_journey_block(waste_item_id, stage, location, details, verified_by):
+def create_journey_block(waste_item_id, stage, location, details, verified_by, mode=None):
     """
     Create a new block in the waste item's journey.
     
@@ -60,34 +78,32 @@ def create_journey_block(waste_item_id, stage, location, details, verified_by):
         location: Location where this stage occurred
         details: Additional details about this stage
         verified_by: Name or ID of entity verifying this stage
+        mode: Integrity mode override (defaults to INTEGRITY_MODE)
         
     Returns:
         Newly created WasteJourneyBlock
     """
-    # Get the previous block for this waste item, if any
-    previous_block = WasteJourneyBlock.query.filter_by(
-        waste_item_id=waste_item_id
-    ).order_by(WasteJourneyBlock.timestamp.desc()).first()
+    mode = mode or INTEGRITY_MODE
+    if mode not in INTEGRITY_MODES:
+        raise ValueError(f"Unknown blockchain integrity mode: {mode}")
     
-    previous_hash = previous_block.block_hash if previous_block else None
-    
-    # Create the new block
-    new_block = WasteJourneyBlock(
+    # Append to the item's chain (sequence-numbered, never forks)
+    from ledger_append import append_journey_block
+    new_block = append_journey_block(
         waste_item_id=waste_item_id,
         stage=stage,
         location=location,
         details=details,
         verified_by=verified_by,
-        previous_hash=previous_hash
+        prepare=lambda block: _prepare_block(block, mode)
     )
     
-    # Mine the block (simulate proof of work)
-    new_block.mine_block(difficulty=2)
-    
     # Save to database
-    db.session.add(new_block)
     db.session.commit()
     
+    if mode == 'async':
+        _sealer.submit(new_block.id)
+    
     # Update the waste item status if this is the final stage
     if stage == 'completed':
         waste_item = WasteItem.query.get(waste_item_id)
@@ -98,6 +114,100 @@ def create_journey_block(waste_item_id, stage, location, details, verified_by):
     
     return new_block
 
+def _prepare_block(block, mode, difficulty=None):
+    """Do the request-path integrity work for a block in the given mode"""
+    if mode not in INTEGRITY_MODES:
+        raise ValueError(f"Unknown blockchain integrity mode: {mode}")
+    
+    if mode == 'pow':
+        block.mine_block(difficulty=POW_DIFFICULTY if difficulty is None else difficulty)
+
+def seal_block(block_id, difficulty=None):
+    """
+    Add the proof of work to a stored block.
+    The seal is written with a conditional UPDATE, so a block is sealed once
+    even if several sealers pick it up.
+    
+    Args:
+        block_id: ID of the WasteJourneyBlock
+        difficulty: Leading zeros required (defaults to POW_DIFFICULTY)
+        
+    Returns:
+        True if this call sealed the block
+    """
+    block = WasteJourneyBlock.query.get(block_id)
+    if not block or block.seal_nonce is not None:
+        return False
+    
+    difficulty = POW_DIFFICULTY if difficulty is None else difficulty
+    nonce = block.seal(difficulty)
+    db.session.expire(block, ['seal_nonce', 'seal_difficulty'])
+    
+    table = WasteJourneyBlock.__table__
+    result = db.session.execute(
+        update(table).where(
+            table.c.id == block_id,
+            table.c.seal_nonce.is_(None)
+        ).values(seal_nonce=nonce, seal_difficulty=difficulty, sealed_at=datetime.utcnow())
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+def seal_pending_blocks(limit=None):
+    """
+    Seal blocks that were stored without any proof of work (e.g. after a
+    restart dropped the sealer's queue). Blocks mined in 'pow' mode are skipped.
+    
+    Returns:
+        Number of blocks sealed
+    """
+    query = db.session.query(WasteJourneyBlock.id).filter(
+        WasteJourneyBlock.seal_nonce.is_(None),
+        or_(WasteJourneyBlock.nonce == 0, WasteJourneyBlock.nonce.is_(None))
+    ).order_by(WasteJourneyBlock.id)
+    if limit:
+        query = query.limit(limit)
+    
+    sealed = 0
+    for (block_id,) in query.all():
+        if seal_block(block_id):
+            sealed += 1
+    return sealed
+
+class _Sealer:
+    """Background thread that seals newly stored blocks off the request path"""
+    
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+    
+    def submit(self, block_id):
+        self._queue.put(block_id)
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='journey-block-sealer', daemon=True)
+                self._thread.start()
+    
+    def join(self):
+        """Wait until every submitted block has been processed"""
+        self._queue.join()
+    
+    def _run(self):
+        from app import app
+        
+        while True:
+            block_id = self._queue.get()
+            try:
+                with app.app_context():
+                    seal_block(block_id)
+            except Exception as e:
+                logging.error(f"Error sealing journey block {block_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+_sealer = _Sealer()
+
 def get_waste_journey(waste_item_id):
     """
     Get the complete journey of a waste item.
@@ -110,40 +220,46 @@ def get_waste_journey(waste_item_id):
     """
     blocks = WasteJourneyBlock.query.filter_by(
         waste_item_id=waste_item_id
-    ).order_by(WasteJourneyBlock.timestamp).all()
+    ).order_by(WasteJourneyBlock.seq, WasteJourneyBlock.id).all()
     
     return blocks
 
-def verify_journey_integrity(waste_item_id):
+def verify_journey_integrity(waste_item_id, require_sealed=False):
     """
     Verify the integrity of the waste journey blockchain.
+    Blocks covered by the journey's verification checkpoint aren't re-hashed.
     
     Args:
         waste_item_id: ID of the waste item
+        require_sealed: Also fail if a block hasn't received its proof of work yet
         
     Returns:
         True if all blocks are valid and linked correctly, False otherwise
     """
+    import chain_checkpoints
+    
     blocks = get_waste_journey(waste_item_id)
     
     if not blocks:
         return True  # No blocks yet, so integrity is intact
     
-    # Check each block
-    for i in range(len(blocks)):
-        current_block = blocks[i]
-        
-        # Verify the block's hash
-        if not current_block.is_valid():
+    if require_sealed:
+        if any(block.seal_nonce is None and not block.nonce for block in blocks):
             return False
-        
-        # Check link to previous block
-        if i > 0:
-            previous_block = blocks[i-1]
-            if current_block.previous_hash != previous_block.block_hash:
-                return False
+        # Seals can be added after a block was checkpointed, so check every block
+        return all(chain_checkpoints.verify_entries(
+            chain_checkpoints.WASTE_JOURNEY, waste_item_id, blocks, _validate_journey_block, full=True
+        ))
     
-    return True
+    return all(chain_checkpoints.verify_entries(
+        chain_checkpoints.WASTE_JOURNEY, waste_item_id, blocks, _validate_journey_block
+    ))
+
+def _validate_journey_block(block, previous_block):
+    """Check a block's hash (and seal) and its link to the previous block"""
+    if not block.is_valid():
+        return False
+    return previous_block is None or block.previous_hash == previous_block.block_hash
 
 def generate_qr_code_data(waste_item_id):
     """
@@ -161,9 +277,8 @@ def generate_qr_code_data(waste_item_id):
         return None
     
     # Get the latest block
-    latest_block = WasteJourneyBlock.query.filter_by(
-        waste_item_id=waste_item_id
-    ).order_by(WasteJourneyBlock.timestamp.desc()).first()
+    from ledger_append import get_journey_tip
+    latest_block = get_journey_tip(waste_item_id)
     
     # Prepare data for QR code
     qr_data = {
@@ -203,4 +318,56 @@ def get_journey_progress(waste_item_id):
         'total_stages': total_stages,
         'progress_pct': progress_pct,
         'blocks': blocks
-    }
\ No newline at end of file
+    }
+
+def benchmark(n_blocks=200, difficulties=(2, 3)):
+    """
+    Benchmark the request-path cost of appending a block in each integrity mode
+    (block construction and hashing; the database insert is the same in every mode).
+    
+    Args:
+        n_blocks: Number of blocks to append per mode
+        difficulties: Proof-of-work difficulties to measure
+    """
+    def make_block(previous_hash):
+        return WasteJourneyBlock(
+            waste_item_id=1,
+            stage='collection',
+            location='Benchmark drop point',
+            details='Benchmark block',
+            verified_by='benchmark',
+            previous_hash=previous_hash
+        )
+    
+    def run(label, mode, difficulty=None, seal=False):
+        previous_hash = None
+        blocks = []
+        started = time.perf_counter()
+        for _ in range(n_blocks):
+            block = make_block(previous_hash)
+            _prepare_block(block, mode, difficulty)
+            previous_hash = block.block_hash
+            blocks.append(block)
+        elapsed = time.perf_counter() - started
+        print(f"{label:<22} {elapsed / n_blocks * 1e3:8.3f} ms/append")
+        
+        if seal:
+            started = time.perf_counter()
+            for block in blocks:
+                block.seal(difficulty)
+            elapsed = time.perf_counter() - started
+            print(f"{'  background seal':<22} {elapsed / n_blocks * 1e3:8.3f} ms/block (off the request path)")
+    
+    run('none', 'none')
+    for difficulty in difficulties:
+        run(f'async (difficulty {difficulty})', 'async', difficulty, seal=True)
+    for difficulty in difficulties:
+        run(f'pow (difficulty {difficulty})', 'pow', difficulty)
+
+if __name__ == '__main__':
+    if '--seal-pending' in sys.argv:
+        from app import app
+        with app.app_context():
+            print(f"Sealed {seal_pending_blocks()} journey blocks")
+    else:
+        benchmark()
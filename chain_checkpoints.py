@@ -0,0 +1,228 @@
+"""
+Verification checkpoints for ReGenWorks hash chains.
+
+A checkpoint records that a chain (a project ledger or a waste item's journey)
+was verified up to entry N with hash H. Reads only re-hash the entries after
+the checkpoint, so page latency doesn't grow with the length of the chain;
+paged reads (verify_window) only load and re-hash the entries on the page.
+Entries inside the checkpoint are re-checked by the periodic full pass:
+
+    python chain_checkpoints.py
+
+Checkpoints are written on their own connection, so verifying a chain from a
+request never commits (or expires) the request's session. A move is skipped
+while that session holds uncommitted writes (on SQLite the checkpoint write
+would wait on them); the next read or the full pass moves it instead.
+"""
+
+import sys
+import logging
+from datetime import datetime
+from sqlalchemy import update, insert, event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app import db
+from models import ChainCheckpoint, ProjectLedger, WasteJourneyBlock
+
+PROJECT_LEDGER = 'project_ledger'
+WASTE_JOURNEY = 'waste_journey'
+
+
+def verify_entries(chain_type, chain_id, entries, validate, full=False):
+    """
+    Verify a chain's entries, re-hashing only those after its checkpoint.
+
+    The checkpoint is trusted only if the entry it ends on is still in the
+    same position with the same hash; otherwise the whole chain is verified.
+    The checkpoint is then moved to the end of the longest valid prefix.
+
+    Args:
+        chain_type: PROJECT_LEDGER or WASTE_JOURNEY
+        chain_id: Project ID or waste item ID
+        entries: All entries of the chain in chain order
+        validate: Callable(entry, previous_entry) -> bool
+        full: Ignore the checkpoint and verify every entry
+
+    Returns:
+        List of per-entry validity flags, in the same order as entries
+    """
+    chain_id = str(chain_id)
+    checkpoint = ChainCheckpoint.query.filter_by(chain_type=chain_type, chain_id=chain_id).first()
+
+    start = 0
+    if checkpoint and not full and 0 < checkpoint.entry_count <= len(entries):
+        boundary = entries[checkpoint.entry_count - 1]
+        if boundary.id == checkpoint.last_entry_id and boundary.block_hash == checkpoint.last_hash:
+            start = checkpoint.entry_count
+
+    results = [True] * start
+    valid_prefix = start
+    for i in range(start, len(entries)):
+        is_valid = validate(entries[i], entries[i - 1] if i > 0 else None)
+        results.append(is_valid)
+        if is_valid and valid_prefix == i:
+            valid_prefix = i + 1
+
+    previous_count = checkpoint.entry_count if checkpoint else 0
+    if full or valid_prefix != previous_count:
+        last_entry = entries[valid_prefix - 1] if valid_prefix else None
+        _save_checkpoint(chain_type, chain_id, valid_prefix, last_entry, full)
+
+    if valid_prefix < len(entries):
+        logging.warning(f"{chain_type} chain {chain_id} fails verification at entry {valid_prefix + 1} of {len(entries)}")
+
+    return results
+
+
+def verify_window(chain_type, chain_id, entries, position, previous_entry, validate, entry_at):
+    """
+    Verify one page of a chain without loading the rest of it.
+
+    Entries inside a trusted checkpoint are valid; the others are re-hashed
+    against their predecessor. If the page continues the checkpoint's valid
+    prefix, the checkpoint is moved to the end of it.
+
+    Args:
+        chain_type: PROJECT_LEDGER or WASTE_JOURNEY
+        chain_id: Project ID or waste item ID
+        entries: The page's entries in chain order
+        position: Index of entries[0] in the chain
+        previous_entry: The entry at position - 1 (None at the start of the chain)
+        validate: Callable(entry, previous_entry) -> bool
+        entry_at: Callable(index) -> the chain's entry at index, or None
+
+    Returns:
+        List of per-entry validity flags, in the same order as entries
+    """
+    chain_id = str(chain_id)
+    checkpoint = ChainCheckpoint.query.filter_by(chain_type=chain_type, chain_id=chain_id).first()
+
+    trusted = 0
+    if checkpoint and checkpoint.entry_count > 0:
+        index = checkpoint.entry_count - 1
+        if position <= index < position + len(entries):
+            boundary = entries[index - position]
+        else:
+            boundary = entry_at(index)
+        if boundary is not None and boundary.id == checkpoint.last_entry_id and boundary.block_hash == checkpoint.last_hash:
+            trusted = checkpoint.entry_count
+
+    results = []
+    valid_prefix = trusted
+    for i, entry in enumerate(entries):
+        index = position + i
+        if index < trusted:
+            results.append(True)
+            continue
+        is_valid = validate(entry, entries[i - 1] if i > 0 else previous_entry)
+        results.append(is_valid)
+        if is_valid and valid_prefix == index:
+            valid_prefix = index + 1
+
+    if valid_prefix > trusted:
+        _save_checkpoint(chain_type, chain_id, valid_prefix, entries[valid_prefix - 1 - position], False)
+
+    return results
+
+
+def _save_checkpoint(chain_type, chain_id, entry_count, last_entry, full):
+    """
+    Insert or move a checkpoint on a separate connection; concurrent readers
+    racing to save it is harmless
+    """
+    now = datetime.utcnow()
+    values = {
+        'entry_count': entry_count,
+        'last_entry_id': last_entry.id if last_entry else None,
+        'last_hash': last_entry.block_hash if last_entry else None,
+        'verified_at': now
+    }
+    if full:
+        values['full_verified_at'] = now
+
+    if db.session.info.get('chain_checkpoint_pending_writes'):
+        return
+
+    table = ChainCheckpoint.__table__
+    try:
+        with db.engine.begin() as conn:
+            result = conn.execute(
+                update(table).where(
+                    table.c.chain_type == chain_type,
+                    table.c.chain_id == chain_id
+                ).values(**values)
+            )
+            if result.rowcount == 0:
+                conn.execute(insert(table).values(chain_type=chain_type, chain_id=chain_id, **values))
+    except IntegrityError:
+        pass  # Another request created it first
+    except Exception as e:
+        logging.error(f"Error saving {chain_type} checkpoint for {chain_id}: {e}")
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_pending_writes(session, flush_context):
+    session.info['chain_checkpoint_pending_writes'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _clear_pending_writes(session):
+    session.info.pop('chain_checkpoint_pending_writes', None)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_pending_writes(session):
+    session.info.pop('chain_checkpoint_pending_writes', None)
+
+
+def invalidate(chain_type=None, chain_id=None):
+    """Drop checkpoints so the next read verifies the whole chain"""
+    query = ChainCheckpoint.query
+    if chain_type:
+        query = query.filter_by(chain_type=chain_type)
+    if chain_id is not None:
+        query = query.filter_by(chain_id=str(chain_id))
+    deleted = query.delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+def reverify_all_chains():
+    """
+    Full re-verification of every chain, resetting checkpoints to the valid prefix.
+    Catches tampering inside already-checkpointed ranges.
+
+    Returns:
+        Dictionary of chain_type -> list of chain IDs that failed verification
+    """
+    from blockchain_service import get_waste_journey, _validate_journey_block
+    from blockchain_tracker import _validate_block, get_project_ledger_entries
+
+    failures = {PROJECT_LEDGER: [], WASTE_JOURNEY: []}
+
+    project_ids = [project_id for (project_id,) in db.session.query(ProjectLedger.project_id).distinct().all()]
+    for project_id in project_ids:
+        results = verify_entries(PROJECT_LEDGER, project_id, get_project_ledger_entries(project_id),
+                                 _validate_block, full=True)
+        if not all(results):
+            failures[PROJECT_LEDGER].append(project_id)
+
+    waste_item_ids = [item_id for (item_id,) in db.session.query(WasteJourneyBlock.waste_item_id).distinct().all()]
+    for waste_item_id in waste_item_ids:
+        results = verify_entries(WASTE_JOURNEY, waste_item_id, get_waste_journey(waste_item_id),
+                                 _validate_journey_block, full=True)
+        if not all(results):
+            failures[WASTE_JOURNEY].append(waste_item_id)
+
+    logging.info(f"Re-verified {len(project_ids)} project ledgers and {len(waste_item_ids)} waste journeys")
+    return failures
+
+
+if __name__ == '__main__':
+    from app import app
+    with app.app_context():
+        failures = reverify_all_chains()
+        for chain_type, chain_ids in failures.items():
+            for chain_id in chain_ids:
+                print(f"FAILED {chain_type} {chain_id}")
+        sys.exit(1 if any(failures.values()) else 0)
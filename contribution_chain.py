@@ -0,0 +1,224 @@
+"""
+User contribution chains for ReGenWorks.
+Shows where each of a user's contributions went: batch, project and the
+project's ledger.
+
+Contributions, their batches and projects are read with one joined query and
+unbatched items with a second; each distinct project's ledger is fetched and
+verified once and shared by every contribution to that project. Pages are
+ordered by date, newest first.
+"""
+
+import sys
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import event
+from app import db
+from models import WasteItem, WasteBatch, InfrastructureProject, ProjectContributor, BatchMembership
+from blockchain_tracker import get_project_blockchain
+
+# Blocks of each project's ledger shown with a contribution
+CHAIN_PREVIEW_BLOCKS = 3
+
+
+def get_user_contribution_chain(user_id: int, offset: int = 0, limit: int = 20):
+    """
+    Get a page of the contribution chain for a user showing their materials' journey
+
+    Args:
+        user_id: User ID
+        offset: Number of (newest) entries to skip
+        limit: Maximum number of entries to return
+
+    Returns:
+        List of contribution chains, newest first
+    """
+    try:
+        offset = max(0, offset)
+        # Both sources are date-ordered, so the first offset + limit rows of
+        # each are enough to build the merged page
+        window = offset + limit
+
+        contributions = db.session.query(
+            ProjectContributor, WasteBatch, InfrastructureProject
+        ).join(
+            WasteBatch, ProjectContributor.batch_id == WasteBatch.id
+        ).outerjoin(
+            InfrastructureProject, WasteBatch.linked_project_id == InfrastructureProject.id
+        ).filter(
+            ProjectContributor.user_id == user_id
+        ).order_by(
+            ProjectContributor.contribution_date.desc(), ProjectContributor.id.desc()
+        ).limit(window).all()
+
+        unbatched = WasteItem.query.outerjoin(
+            BatchMembership, BatchMembership.waste_item_id == WasteItem.id
+        ).filter(
+            WasteItem.user_id == user_id,
+            WasteItem.is_recyclable == True,
+            BatchMembership.id.is_(None)
+        ).order_by(WasteItem.created_at.desc(), WasteItem.id.desc()).limit(window).all()
+
+        entries = [(contrib.contribution_date, 'contribution', (contrib, batch, project))
+                   for contrib, batch, project in contributions]
+        entries += [(item.created_at, 'item', item) for item in unbatched]
+        entries.sort(key=lambda entry: entry[0] or datetime.min, reverse=True)
+
+        project_chains = {}
+        chains = []
+        for _, kind, row in entries[offset:window]:
+            if kind == 'item':
+                chains.append({
+                    'waste_item_id': row.id,
+                    'weight': float(row.estimated_weight_grams) if row.estimated_weight_grams else 0,
+                    'date': row.created_at.isoformat() if row.created_at else None,
+                    'material': row.material_type or row.material or 'Unknown',
+                    'status': 'collected',
+                    'batch': None,
+                    'project': None
+                })
+                continue
+
+            contrib, batch, project = row
+            chain = {
+                'contribution_id': contrib.id,
+                'weight': float(contrib.contribution_weight_grams),
+                'date': contrib.contribution_date.isoformat() if contrib.contribution_date else None,
+                'batch': {
+                    'batch_id': batch.batch_id,
+                    'material': batch.material_type,
+                    'total_weight': float(batch.total_weight_grams),
+                    'status': batch.status
+                }
+            }
+
+            if project:
+                chain['project'] = {
+                    'project_id': project.project_id,
+                    'project_name': project.project_name,
+                    'status': project.status
+                }
+
+                project_chains.setdefault(project.project_id, []).append(chain)
+
+            chains.append(chain)
+
+        # The first blocks of each project's ledger are fetched and verified
+        # once and shared by its contributions
+        for project_id, project_entries in project_chains.items():
+            blockchain = get_project_blockchain(project_id, limit=CHAIN_PREVIEW_BLOCKS)
+            for chain in project_entries:
+                chain['blockchain'] = blockchain
+                chain['blockchain_total'] = blockchain[0]['chain_length'] if blockchain else 0
+
+        return chains
+
+    except Exception as e:
+        logging.error(f"Error getting user contribution chain: {e}")
+        return []
+
+
+@contextmanager
+def count_queries():
+    """Count the SQL statements executed inside the block (yields a one-item list)"""
+    counter = [0]
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter[0] += 1
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def query_count_test(n_contributions=200, n_projects=3, per_page=50):
+    """
+    Check that building a page costs a fixed number of queries per distinct
+    project, however many contributions the user has.
+
+    Uses the configured database; creates its own user, batches and projects
+    and deletes them afterwards.
+    """
+    from app import app
+    from models import User, ProjectLedger, ChainCheckpoint
+    from ledger_append import append_project_entry
+
+    stamp = datetime.utcnow().strftime('%Y%m%d%H%M%S%f')
+    prefix = f'chaintest_{stamp}'
+    try:
+        with app.app_context():
+            user = User(username=prefix, email=f'{prefix}@example.com')
+            db.session.add(user)
+            projects = [
+                InfrastructureProject(
+                    project_id=f'{prefix}_{i}',
+                    project_name=f'Chain test project {i}',
+                    project_type='bench',
+                    location_lat=12.97,
+                    location_lng=77.59,
+                    status='in_progress',
+                    total_plastic_required_grams=100000
+                )
+                for i in range(n_projects)
+            ]
+            db.session.add_all(projects)
+            db.session.flush()
+
+            for n in range(n_contributions):
+                project = projects[n % n_projects]
+                batch = WasteBatch(
+                    batch_id=f'{prefix}_{n}',
+                    material_type='Plastic',
+                    total_weight_grams=1000,
+                    status='allocated',
+                    linked_project_id=project.id
+                )
+                db.session.add(batch)
+                db.session.flush()
+                db.session.add(ProjectContributor(user_id=user.id, batch_id=batch.id, contribution_weight_grams=100))
+                append_project_entry(project.project_id, 'allocated', 'system', batch.batch_id,
+                                     {'batch_id': batch.batch_id, 'project_id': project.project_id})
+            db.session.commit()
+            user_id = user.id
+
+        results = []
+        for page in (1, 2):
+            with app.app_context():
+                with count_queries() as counter:
+                    chains = get_user_contribution_chain(user_id, offset=(page - 1) * per_page, limit=per_page)
+                distinct = len({c['project']['project_id'] for c in chains if c.get('project')})
+                results.append((page, len(chains), counter[0], distinct))
+    finally:
+        # Remove the test user, projects, batches and ledger from the store
+        with app.app_context():
+            db.session.rollback()
+            project_ids = [project_id for (project_id,) in db.session.query(InfrastructureProject.id).filter(
+                InfrastructureProject.project_id.like(f'{prefix}_%')
+            ).all()]
+            ProjectContributor.query.filter(ProjectContributor.user_id.in_(
+                db.session.query(User.id).filter(User.username == prefix)
+            )).delete(synchronize_session=False)
+            ProjectLedger.query.filter(ProjectLedger.project_id.like(f'{prefix}_%')).delete(synchronize_session=False)
+            ChainCheckpoint.query.filter(ChainCheckpoint.chain_id.like(f'{prefix}_%')).delete(synchronize_session=False)
+            WasteBatch.query.filter(WasteBatch.linked_project_id.in_(project_ids)).delete(synchronize_session=False)
+            InfrastructureProject.query.filter(InfrastructureProject.id.in_(project_ids)).delete(synchronize_session=False)
+            User.query.filter(User.username == prefix).delete(synchronize_session=False)
+            db.session.commit()
+
+    ok = True
+    for page, entries, queries, distinct in results:
+        # Two listing queries, then per project: project, ledger, checkpoint
+        # and (on first verification) the checkpoint update and insert
+        budget = 2 + 5 * distinct
+        print(f"page {page}: {entries} entries, {distinct} projects, {queries} queries (budget {budget})")
+        ok = ok and entries == per_page and queries <= budget
+
+    print("OK: query count independent of contributions" if ok else "FAIL")
+    return ok
+
+
+if __name__ == '__main__':
+    sys.exit(0 if query_count_test() else 1)
@@ -212,6 +212,7 @@ CREATE INDEX IF NOT EXISTS idx_contributors_top ON project_contributors(is_top_c
 CREATE TABLE IF NOT EXISTS project_ledger (
     id SERIAL PRIMARY KEY,
     project_id VARCHAR(50) NOT NULL,
+    seq INTEGER, -- Position in the project's chain, from 1
     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     status VARCHAR(20) NOT NULL,
     verified_by VARCHAR(100), -- User ID or system identifier
@@ -224,6 +225,7 @@ CREATE TABLE IF NOT EXISTS project_ledger (
 );
 
 CREATE INDEX IF NOT EXISTS idx_ledger_project ON project_ledger(project_id, timestamp);
+CREATE UNIQUE INDEX IF NOT EXISTS unique_project_ledger_seq ON project_ledger(project_id, seq);
 CREATE INDEX IF NOT EXISTS idx_ledger_hash ON project_ledger(block_hash);
 CREATE INDEX IF NOT EXISTS idx_ledger_synced ON project_ledger(firestore_synced) WHERE firestore_synced = FALSE;
 
@@ -0,0 +1,487 @@
+"""
+Nearest drop point search for ReGenWorks.
+
+Drop points are served from the DropLocation table through an in-memory
+snapshot:
+
+- Grid buckets of GRID_DEGREES cells. A k-nearest query searches rings of
+  cells outwards from the query point. It stops once the k-th best distance
+  is no further than the edge of the searched square.
+- Each drop point's accepted_materials_mask (see materials.py). The boolean
+  filter for a material combination is computed once per snapshot with a
+  vectorised AND, and reused.
+
+Answers are cached per geohash cell (GEOHASH_PRECISION characters, about
+1.2 x 0.6 km). The cache holds every drop point that could be among the k
+nearest from anywhere in the cell: those within d_k + 2h of the cell centre,
+where d_k is the centre's k-th distance and h the cell's half-diagonal.
+Each request then re-ranks that short list from its exact position, so
+cached answers are exact.
+
+The snapshot and cache are rebuilt after a commit that touches a drop point
+in this process. Other processes notice the change within
+INDEX_CHECK_SECONDS, through a fingerprint of the table.
+"""
+
+import os
+import sys
+import math
+import time
+import threading
+import itertools
+from collections import OrderedDict
+import numpy as np
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+from app import db
+from models import DropLocation
+from geo import EARTH_RADIUS_KM, haversine_km, bounding_box
+from materials import material_mask, split_materials, matches, ANY
+
+# Grid cell size in degrees (about 5.5 km of latitude)
+GRID_DEGREES = 0.05
+
+# Kilometres per degree of latitude
+KM_PER_DEGREE = EARTH_RADIUS_KM * math.pi / 180
+
+GEOHASH_PRECISION = 6
+
+CACHE_SIZE = int(os.environ.get('DROP_POINT_CACHE_SIZE', '4096'))
+
+INDEX_CHECK_SECONDS = int(os.environ.get('DROP_POINT_INDEX_CHECK_SECONDS', '30'))
+
+# Drop points the check-in form has always offered (ids 1-5 on a fresh database)
+DEFAULT_DROP_LOCATIONS = [
+    {
+        'name': 'Dry Waste Collection Center - Koramangala',
+        'latitude': 12.9352, 'longitude': 77.6245,
+        'address': 'Koramangala 3rd Block, Bengaluru',
+        'accepted_materials': 'Plastic,Paper,Glass'
+    },
+    {
+        'name': 'E-Waste Collection Center - Indiranagar',
+        'latitude': 12.9784, 'longitude': 77.6408,
+        'address': '100 Feet Road, Indiranagar, Bengaluru',
+        'accepted_materials': 'E-Waste,Batteries'
+    },
+    {
+        'name': 'Saahas Zero Waste - HSR Layout',
+        'latitude': 12.9116, 'longitude': 77.6473,
+        'address': 'HSR Layout, Bengaluru',
+        'accepted_materials': 'Plastic,Paper,Organic'
+    },
+    {
+        'name': 'ITC WOW Collection Point - Whitefield',
+        'latitude': 12.9698, 'longitude': 77.7500,
+        'address': 'Whitefield, Bengaluru',
+        'accepted_materials': 'Paper,Cardboard'
+    },
+    {
+        'name': 'BBMP Recycling Center - Jayanagar',
+        'latitude': 12.9250, 'longitude': 77.5938,
+        'address': 'Jayanagar 4th Block, Bengaluru',
+        'accepted_materials': 'Plastic,Metal,Glass,Paper'
+    }
+]
+
+_GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def geohash_encode(lat, lng, precision=GEOHASH_PRECISION):
+    """Geohash of a point"""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, coordinate = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        value <<= 1
+        if coordinate >= mid:
+            value |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_GEOHASH_ALPHABET[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def geohash_bounds(geohash):
+    """(south, north, west, east) of a geohash cell"""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = _GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            rng = lng_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if value >> shift & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return lat_range[0], lat_range[1], lng_range[0], lng_range[1]
+
+
+# Identifies each snapshot, so cached candidates are never used with another
+_snapshot_ids = itertools.count(1)
+
+
+def _cell(value):
+    return math.floor(value / GRID_DEGREES)
+
+
+class DropPointIndex:
+    """Immutable snapshot of the drop points, queried by location and material"""
+
+    def __init__(self, points):
+        """
+        Args:
+            points: Iterable of dictionaries with id, name, address, lat, lng,
+                    materials (list of accepted material names) and mask
+                    (accepted material bits)
+        """
+        self.snapshot_id = next(_snapshot_ids)
+        self.points = list(points)
+        self.lats = np.array([p['lat'] for p in self.points], dtype=np.float64)
+        self.lngs = np.array([p['lng'] for p in self.points], dtype=np.float64)
+
+        self.masks = np.array([p['mask'] for p in self.points], dtype=np.int64)
+        self._filters = {}
+
+        cells = {}
+        for i, point in enumerate(self.points):
+            cells.setdefault((_cell(point['lat']), _cell(point['lng'])), []).append(i)
+        self.cells = {key: np.array(members, dtype=np.int64) for key, members in cells.items()}
+        if cells:
+            ys, xs = zip(*cells)
+            self.extent = (min(ys), max(ys), min(xs), max(xs))
+
+    def __len__(self):
+        return len(self.points)
+
+    def _mask(self, material, match=ANY):
+        """Boolean filter for a material combination, True for no filter, or None if nothing can match"""
+        if not material:
+            return True
+        bits = material_mask(material)
+        if not bits:
+            return None
+        key = (bits, match)
+        if key not in self._filters:
+            self._filters[key] = matches(self.masks, bits, match)
+        return self._filters[key]
+
+    def _ranked(self, lat, lng, candidates, limit=None):
+        distances = haversine_km(lat, lng, self.lats[candidates], self.lngs[candidates])
+        order = np.lexsort((candidates, distances))
+        if limit is not None:
+            order = order[:limit]
+        return candidates[order], distances[order]
+
+    def nearest(self, lat, lng, material=None, limit=5, match=ANY):
+        """
+        The nearest drop points accepting a material, or any / all of several
+        (comma-separated or a list).
+
+        Returns:
+            Tuple of NumPy arrays (indices into points, distances_km), nearest first
+        """
+        mask = self._mask(material, match)
+        empty = np.empty(0, dtype=np.int64), np.empty(0)
+        if mask is None or not self.points:
+            return empty
+
+        cy, cx = _cell(lat), _cell(lng)
+        ymin, ymax, xmin, xmax = self.extent
+        rings_to_cover = max(cy - ymin, ymax - cy, cx - xmin, xmax - cx)
+        found = []
+        r = 0
+        while r <= rings_to_cover:
+            # A search square larger than the populated cells is a full scan
+            if (2 * r + 1) ** 2 > len(self.cells):
+                candidates = np.arange(len(self.points)) if mask is True else np.flatnonzero(mask)
+                return self._ranked(lat, lng, candidates, limit)
+
+            for y in range(cy - r, cy + r + 1):
+                step = 1 if y in (cy - r, cy + r) else 2 * r
+                for x in range(cx - r, cx + r + 1, max(step, 1)):
+                    members = self.cells.get((y, x))
+                    if members is not None:
+                        found.append(members if mask is True else members[mask[members]])
+
+            if found:
+                candidates = np.concatenate(found)
+                if len(candidates) >= limit:
+                    ranked = self._ranked(lat, lng, candidates, limit)
+                    if ranked[1][-1] <= self._square_clearance(lat, lng, cy, cx, r):
+                        return ranked
+            r += 1
+
+        if not found:
+            return empty
+        return self._ranked(lat, lng, np.concatenate(found), limit)
+
+    @staticmethod
+    def _square_clearance(lat, lng, cy, cx, r):
+        """Lower bound on the distance from a point to anything outside the searched square"""
+        south, north = (cy - r) * GRID_DEGREES, (cy + r + 1) * GRID_DEGREES
+        west, east = (cx - r) * GRID_DEGREES, (cx + r + 1) * GRID_DEGREES
+        along_meridian = min(lat - south, north - lat) * KM_PER_DEGREE
+        # Distance to the nearer bounding meridian's great circle
+        dlng = math.radians(min(lng - west, east - lng, 90.0))
+        across = EARTH_RADIUS_KM * math.asin(min(1.0, math.cos(math.radians(lat)) * math.sin(dlng)))
+        return min(along_meridian, across)
+
+    def within(self, lat, lng, radius_km, material=None, match=ANY):
+        """Indices of the drop points accepting a material within radius_km"""
+        mask = self._mask(material, match)
+        if mask is None or not self.points:
+            return np.empty(0, dtype=np.int64)
+
+        south, north, ranges = bounding_box(lat, lng, radius_km)
+        ys = range(_cell(south), _cell(north) + 1)
+        xs = [x for west, east in ranges for x in range(_cell(west), _cell(east) + 1)]
+        if len(ys) * len(xs) > len(self.cells):
+            keys = [key for key in self.cells if _cell(south) <= key[0] <= _cell(north)]
+        else:
+            keys = [(y, x) for y in ys for x in xs]
+
+        found = [self.cells[key] for key in keys if key in self.cells]
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        candidates = np.concatenate(found)
+        if mask is not True:
+            candidates = candidates[mask[candidates]]
+        distances = haversine_km(lat, lng, self.lats[candidates], self.lngs[candidates])
+        return candidates[distances <= radius_km]
+
+    def cell_candidates(self, geohash, material=None, limit=5, match=ANY):
+        """Indices of every drop point that can be among the `limit` nearest from inside a geohash cell"""
+        south, north, west, east = geohash_bounds(geohash)
+        center_lat, center_lng = (south + north) / 2, (west + east) / 2
+        half_diagonal = float(haversine_km(center_lat, center_lng, np.array([south, north]), np.array([west, east])).max())
+
+        indices, distances = self.nearest(center_lat, center_lng, material, limit, match)
+        if len(indices) < limit:
+            return indices
+        return self.within(center_lat, center_lng, float(distances[-1]) + 2 * half_diagonal, material, match)
+
+
+# ============================================================================
+# SHARED INDEX AND CELL CACHE
+# ============================================================================
+
+_index = None
+_fingerprint = None
+_checked_at = 0.0
+_stale = True
+_index_lock = threading.Lock()
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _load_drop_points():
+    rows = db.session.query(
+        DropLocation.id, DropLocation.name, DropLocation.address, DropLocation.latitude,
+        DropLocation.longitude, DropLocation.accepted_materials, DropLocation.accepted_materials_mask
+    ).order_by(DropLocation.id).all()
+    return [
+        {
+            'id': point_id,
+            'name': name,
+            'address': address,
+            'lat': float(lat),
+            'lng': float(lng),
+            'materials': split_materials(accepted_materials),
+            'mask': mask or 0
+        }
+        for point_id, name, address, lat, lng, accepted_materials, mask in rows
+    ]
+
+
+def _drop_point_fingerprint():
+    # The table has no updated_at; sums catch edits made by other processes
+    return tuple(db.session.query(
+        func.count(DropLocation.id), func.max(DropLocation.id), func.sum(DropLocation.latitude),
+        func.sum(DropLocation.longitude), func.sum(func.length(DropLocation.accepted_materials)),
+        func.sum(func.length(DropLocation.name) + func.length(DropLocation.address))
+    ).one())
+
+
+def get_drop_point_index():
+    """
+    The current drop point index, rebuilding it if drop points changed.
+
+    Returns:
+        DropPointIndex
+    """
+    global _index, _fingerprint, _checked_at, _stale
+
+    if _index is not None and not _stale and time.monotonic() - _checked_at < INDEX_CHECK_SECONDS:
+        return _index
+
+    with _index_lock:
+        if _index is not None and not _stale and time.monotonic() - _checked_at < INDEX_CHECK_SECONDS:
+            return _index
+
+        fingerprint = _drop_point_fingerprint()
+        if _index is None or _stale or fingerprint != _fingerprint:
+            _stale = False
+            _index = DropPointIndex(_load_drop_points())
+            _fingerprint = fingerprint
+            with _cache_lock:
+                _cache.clear()
+        _checked_at = time.monotonic()
+        return _index
+
+
+def invalidate_drop_point_index():
+    """Rebuild the index and drop the cell cache on next use"""
+    global _stale
+    _stale = True
+
+
+def find_nearest_drop_points(lat, lng, material=None, limit=5, match=ANY):
+    """
+    The nearest drop points accepting a material.
+
+    Args:
+        lat, lng: Location in degrees
+        material: Material the drop point must accept, or several (None for any)
+        limit: Maximum number of drop points
+        match: materials.ANY or materials.ALL when several materials are given
+
+    Returns:
+        List of (drop point dictionary, distance_km), nearest first; the
+        dictionary has id, name, address, lat, lng and materials
+    """
+    lat, lng = float(lat), float(lng)
+    index = get_drop_point_index()
+    # Candidates are positions in one snapshot; spellings of the same
+    # materials share cache entries
+    geohash = geohash_encode(lat, lng)
+    key = (index.snapshot_id, geohash, material_mask(material) if material else None, match, limit)
+
+    with _cache_lock:
+        candidates = _cache.get(key)
+        if candidates is not None:
+            _cache.move_to_end(key)
+    if candidates is None:
+        candidates = index.cell_candidates(geohash, material, limit, match)
+        with _cache_lock:
+            # Skip the insert if the index was rebuilt meanwhile
+            if index is _index:
+                _cache[key] = candidates
+                while len(_cache) > CACHE_SIZE:
+                    _cache.popitem(last=False)
+
+    if len(candidates) == 0:
+        return []
+    indices, distances = index._ranked(lat, lng, candidates, limit)
+    return [(index.points[i], float(d)) for i, d in zip(indices.tolist(), distances)]
+
+
+def seed_default_drop_locations():
+    """Insert DEFAULT_DROP_LOCATIONS into an empty DropLocation table"""
+    if DropLocation.query.count():
+        return 0
+    for point in DEFAULT_DROP_LOCATIONS:
+        db.session.add(DropLocation(**point))
+    db.session.commit()
+    return len(DEFAULT_DROP_LOCATIONS)
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_drop_point_changes(session, flush_context):
+    if any(isinstance(obj, DropLocation) for obj in list(session.new) + list(session.dirty) + list(session.deleted)):
+        session.info['drop_points_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _refresh_after_commit(session):
+    if session.info.pop('drop_points_changed', False):
+        invalidate_drop_point_index()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_drop_point_changes(session):
+    session.info.pop('drop_points_changed', None)
+
+
+# ============================================================================
+# BENCHMARK
+# ============================================================================
+
+def benchmark(n_points=20000, n_requests=2000):
+    """
+    Query n_requests random locations against n_points synthetic drop points
+    around Bangalore, with a full scan, the grid index and the cell cache.
+    """
+    import random
+
+    rng = random.Random(47)
+    materials = ['Plastic', 'Paper', 'Glass', 'Metal', 'E-Waste', 'Organic']
+    points = [
+        {
+            'id': i + 1, 'name': f'Drop point {i}', 'address': '',
+            'lat': 12.97 + rng.uniform(-0.4, 0.4), 'lng': 77.59 + rng.uniform(-0.4, 0.4),
+            'materials': rng.sample(materials, rng.randint(1, 3))
+        }
+        for i in range(n_points)
+    ]
+    for point in points:
+        point['mask'] = material_mask(point['materials'])
+    # Requests cluster in the city centre, as real users do
+    requests = [
+        (12.97 + rng.gauss(0, 0.03), 77.59 + rng.gauss(0, 0.03), rng.choice(materials + [None]))
+        for _ in range(n_requests)
+    ]
+
+    lats = np.array([p['lat'] for p in points])
+    lngs = np.array([p['lng'] for p in points])
+    accepts = {m.lower(): np.array([m in p['materials'] for p in points]) for m in materials}
+
+    def scan(lat, lng, material):
+        distances = haversine_km(lat, lng, lats, lngs)
+        candidates = np.arange(n_points) if material is None else np.flatnonzero(accepts[material.lower()])
+        order = np.lexsort((candidates, distances[candidates]))[:5]
+        return candidates[order].tolist()
+
+    global _index, _stale, _checked_at
+    index = DropPointIndex(points)
+
+    started = time.perf_counter()
+    expected = [scan(*r) for r in requests]
+    scan_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    found = [index.nearest(*r)[0].tolist() for r in requests]
+    index_time = time.perf_counter() - started
+
+    # Serve through the cache with this snapshot in place of the table
+    _index, _stale, _checked_at = index, False, float('inf')
+    _cache.clear()
+    started = time.perf_counter()
+    cached = [[p['id'] - 1 for p, _ in find_nearest_drop_points(*r)] for r in requests]
+    cache_time = time.perf_counter() - started
+    started = time.perf_counter()
+    warm = [[p['id'] - 1 for p, _ in find_nearest_drop_points(*r)] for r in requests]
+    warm_time = time.perf_counter() - started
+    cells = len(_cache)
+    _index, _stale, _checked_at = None, True, 0.0
+    _cache.clear()
+
+    print(f"{n_points} drop points, {n_requests} requests ({cells} geohash cells)")
+    for name, elapsed in (('full scan', scan_time), ('grid index', index_time),
+                          ('cell cache, cold', cache_time), ('cell cache, warm', warm_time)):
+        print(f"{name:<17} {n_requests / elapsed:>9,.0f} req/s ({elapsed / n_requests * 1e3:.3f} ms each)")
+    ok = found == expected and cached == expected and warm == expected
+    print("OK: same drop points in the same order" if ok else "FAIL: results differ")
+    return ok
+
+
+if __name__ == '__main__':
+    sys.exit(0 if benchmark() else 1)
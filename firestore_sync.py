@@ -1,12 +1,21 @@
 """
 Firebase Firestore integration for Infrastructure Project Ledger
 Provides immutable blockchain-like ledger entries in Firestore
+
+ProjectLedger is the outbox: entries are written to SQL first with
+firestore_synced = False, and a background worker copies unsynced entries to
+Firestore in batched writes, marking them synced in bulk once a batch commits.
+Document IDs are derived from the entry, so re-sending a batch is harmless.
 """
 
 import os
+import sys
+import time
 import logging
+import threading
+from types import SimpleNamespace
 from datetime import datetime
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 
 try:
     import firebase_admin
@@ -32,6 +41,15 @@ def initialize_firestore():
         if _firestore_client is not None:
             return True
         
+        # Local Firestore emulator (no credentials needed)
+        if os.environ.get('FIRESTORE_EMULATOR_HOST'):
+            from google.cloud import firestore as cloud_firestore
+            _firestore_client = cloud_firestore.Client(
+                project=os.environ.get('FIREBASE_PROJECT_ID', 'demo-regenworks')
+            )
+            logging.info(f"Firestore emulator at {os.environ['FIRESTORE_EMULATOR_HOST']}")
+            return True
+        
         # Check for JSON environment variable first (for Railway/cloud deployments)
         service_account_json = os.environ.get('FIREBASE_SERVICE_ACCOUNT_JSON')
         
@@ -68,84 +86,586 @@ def initialize_firestore():
         logging.error(f"Error initializing Firestore: {e}")
         return False
 
-def write_ledger_entry(project_id: str, batch_id: str, weight: int, 
-                      verified_by: str, status: str, timestamp: Optional[datetime] = None) -> bool:
+def get_ledger_entries(project_id: str, limit: int = 100, client=None) -> list:
     """
-    Write an immutable ledger entry to Firestore
+    Get ledger entries for a project from Firestore, newest first.
+    Served from a per-project read-through cache (see LEDGER READ CACHE below).
     
     Args:
         project_id: Project UUID/ID
-        batch_id: Batch UUID/ID
-        weight: Weight in grams
-        verified_by: User/system that verified the entry
-        status: Status of the batch/project
-        timestamp: Optional timestamp (defaults to now)
+        limit: Maximum number of entries to retrieve
+        client: Firestore client (defaults to the configured one)
         
     Returns:
-        True if successful, False otherwise
+        List of ledger entries
     """
-    if not initialize_firestore():
-        return False
-    
-    if _firestore_client is None:
-        return False
+    if client is None:
+        if not initialize_firestore() or _firestore_client is None:
+            return []
+        client = _firestore_client
     
     try:
-        if timestamp is None:
-            timestamp = datetime.utcnow()
-        
-        # Create ledger entry
-        ledger_data = {
-            'batch_id': batch_id,
-            'weight': weight,
-            'verified_by': verified_by,
-            'status': status,
-            'timestamp': timestamp,
-            'created_at': firestore.SERVER_TIMESTAMP
-        }
-        
-        # Write to Firestore: ledger/<project_id>/<timestamp>
-        doc_id = timestamp.strftime('%Y%m%d%H%M%S%f')
-        doc_ref = _firestore_client.collection('ledger').document(project_id).collection('entries').document(doc_id)
-        doc_ref.set(ledger_data)
-        
-        logging.info(f"Ledger entry written to Firestore: ledger/{project_id}/{doc_id}")
-        return True
+        now = time.monotonic()
+        with _ledger_cache_lock:
+            cached = _ledger_cache.get(project_id)
+        
+        if cached is not None and (cached.complete or len(cached.entries) >= limit) \
+                and now - cached.loaded_at < LEDGER_CACHE_MAX_AGE_SECONDS:
+            if now - cached.checked_at >= LEDGER_CACHE_TTL_SECONDS:
+                cached = _top_up_cache(client, project_id, cached, limit, now)
+            if cached is not None:
+                return [dict(entry) for entry in cached.entries[:limit]]
+        
+        entries = _read_entries(_entries_query(client, project_id).limit(limit))
+        _store_cache(project_id, _CachedLedger(entries, len(entries) < limit, now))
+        return [dict(entry) for entry in entries]
         
     except Exception as e:
-        logging.error(f"Error writing ledger entry to Firestore: {e}")
-        return False
+        logging.error(f"Error reading ledger entries from Firestore: {e}")
+        return []
+
 
-def get_ledger_entries(project_id: str, limit: int = 100) -> list:
+# ============================================================================
+# LEDGER READ CACHE
+# ============================================================================
+
+# A cached page is served as-is for this long, then topped up with one query
+# for entries newer than its tip
+LEDGER_CACHE_TTL_SECONDS = float(os.environ.get('LEDGER_CACHE_TTL_SECONDS', 30))
+
+# A cached page is re-read in full after this long, picking up changes the
+# top-ups can't see (e.g. older entries repaired from another process)
+LEDGER_CACHE_MAX_AGE_SECONDS = float(os.environ.get('LEDGER_CACHE_MAX_AGE_SECONDS', 600))
+
+
+class _CachedLedger:
+    """Newest-first page of a project's ledger documents"""
+    
+    def __init__(self, entries, complete, loaded_at):
+        self.entries = entries
+        self.complete = complete  # True if the project has no older entries
+        self.loaded_at = loaded_at
+        self.checked_at = loaded_at
+
+_ledger_cache = {}
+_ledger_cache_lock = threading.Lock()
+
+
+def _entries_query(client, project_id):
+    # 'DESCENDING' is firestore.Query.DESCENDING
+    return client.collection('ledger').document(project_id).collection('entries').order_by(
+        'timestamp', direction='DESCENDING'
+    )
+
+
+def _read_entries(query) -> list:
+    result = []
+    for entry in query.stream():
+        data = entry.to_dict()
+        data['id'] = entry.id
+        result.append(data)
+    return result
+
+
+def _store_cache(project_id, cached):
+    with _ledger_cache_lock:
+        _ledger_cache[project_id] = cached
+
+
+def _top_up_cache(client, project_id, cached, limit, now):
     """
-    Get ledger entries for a project from Firestore
+    Prepend entries newer than the cached tip, with one query.
+    
+    Returns:
+        The updated cache entry, or None if a full re-read is needed
+    """
+    if not cached.entries:
+        return None
+    
+    newer = _read_entries(
+        _entries_query(client, project_id).where('timestamp', '>', cached.entries[0]['timestamp']).limit(limit)
+    )
+    if len(newer) >= limit:
+        return None  # More new entries than fit on the page; re-read it
+    
+    known = {entry['id'] for entry in cached.entries}
+    entries = [entry for entry in newer if entry['id'] not in known] + cached.entries
+    keep = max(limit, len(cached.entries))
+    
+    updated = _CachedLedger(entries[:keep], cached.complete and len(entries) <= keep, cached.loaded_at)
+    updated.checked_at = now
+    _store_cache(project_id, updated)
+    return updated
+
+
+def invalidate_ledger_cache(project_id: Optional[str] = None, full: bool = False):
+    """
+    Expire cached ledger pages after a write.
     
     Args:
-        project_id: Project UUID/ID
-        limit: Maximum number of entries to retrieve
+        project_id: Project to expire (default: all projects)
+        full: Drop the page instead of topping it up on the next read; use
+            when entries older than the cached tip may have changed
+    """
+    with _ledger_cache_lock:
+        project_ids = [project_id] if project_id is not None else list(_ledger_cache)
+        for key in project_ids:
+            if full:
+                _ledger_cache.pop(key, None)
+            elif key in _ledger_cache:
+                _ledger_cache[key].checked_at = float('-inf')
+
+
+# ============================================================================
+# LEDGER OUTBOX SYNC
+# ============================================================================
+
+# Firestore accepts at most 500 writes per batch
+MAX_BATCH_WRITES = 500
+
+# Attempts per batch commit before it is left for the next sync run
+SYNC_MAX_ATTEMPTS = int(os.environ.get('FIRESTORE_SYNC_MAX_ATTEMPTS', 5))
+SYNC_BACKOFF_SECONDS = float(os.environ.get('FIRESTORE_SYNC_BACKOFF_SECONDS', 0.5))
+
+# The background worker also drains the outbox on this interval, picking up
+# entries whose sync was never requested or failed earlier
+SYNC_INTERVAL_SECONDS = int(os.environ.get('FIRESTORE_SYNC_INTERVAL_SECONDS', 60))
+
+
+def ledger_document(entry) -> tuple:
+    """
+    Build the Firestore document for a ledger entry.
+    
+    Returns:
+        (project_id, document_id, data); documents live at
+        ledger/<project_id>/entries/<document_id>
+    """
+    import json
+    
+    raw_data = entry.data if isinstance(entry.data, str) or entry.data is None else json.dumps(entry.data)
+    try:
+        block_data = json.loads(raw_data) if raw_data else {}
+    except ValueError:
+        block_data = {}
+    metadata = block_data.get('metadata') or {}
+    
+    timestamp = entry.timestamp or entry.created_at or datetime.utcnow()
+    document_id = f"{timestamp.strftime('%Y%m%d%H%M%S%f')}_{entry.id}"
+    
+    data = {
+        'ledger_id': entry.id,
+        'seq': entry.seq,
+        'batch_id': entry.batch_reference or '',
+        'weight': int(float(metadata.get('weight') or 0)),
+        'verified_by': entry.verified_by,
+        'status': entry.status,
+        'block_hash': entry.block_hash,
+        'previous_hash': entry.previous_hash,
+        'data': raw_data,  # Hashed payload, so the entry can be rebuilt from Firestore
+        'timestamp': timestamp,
+        'created_at': firestore.SERVER_TIMESTAMP if FIREBASE_AVAILABLE else datetime.utcnow()
+    }
+    return entry.project_id, document_id, data
+
+
+def ledger_entry_ref(client, project_id: str, document_id: str):
+    """Reference to ledger/<project_id>/entries/<document_id>"""
+    return client.collection('ledger').document(project_id).collection('entries').document(document_id)
+
+
+def commit_writes(client, writes: List[tuple]) -> bool:
+    """
+    Apply (document reference, data) writes in batched commits of up to 500,
+    retrying each commit with exponential backoff. data=None deletes the document.
+    
+    Returns:
+        True if every batch committed
+    """
+    for start in range(0, len(writes), MAX_BATCH_WRITES):
+        chunk = writes[start:start + MAX_BATCH_WRITES]
+        for attempt in range(1, SYNC_MAX_ATTEMPTS + 1):
+            try:
+                batch = client.batch()
+                for ref, data in chunk:
+                    if data is None:
+                        batch.delete(ref)
+                    else:
+                        batch.set(ref, data)
+                batch.commit()
+                break
+            except Exception as e:
+                if attempt == SYNC_MAX_ATTEMPTS:
+                    logging.error(f"Firestore batch of {len(chunk)} writes failed after {attempt} attempts: {e}")
+                    return False
+                delay = SYNC_BACKOFF_SECONDS * 2 ** (attempt - 1)
+                logging.warning(f"Firestore batch commit failed ({e}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+    return True
+
+
+def sync_pending_entries(client=None, batch_size: int = MAX_BATCH_WRITES, max_batches: Optional[int] = None,
+                         project_id: Optional[str] = None) -> Dict[str, int]:
+    """
+    Copy unsynced ProjectLedger entries to Firestore.
+    
+    Args:
+        client: Firestore client (defaults to the configured one); any object
+            with collection() and batch() works, e.g. InMemoryFirestore
+        batch_size: Entries per batched write (capped at 500)
+        max_batches: Stop after this many batches (default: drain the outbox)
+        project_id: Only sync this project's entries
         
     Returns:
-        List of ledger entries
+        Dictionary with synced, batches and failed_batches counts
     """
-    if not initialize_firestore():
-        return []
+    from sqlalchemy import update, or_
+    from app import db
+    from models import ProjectLedger
     
-    if _firestore_client is None:
-        return []
+    stats = {'synced': 0, 'batches': 0, 'failed_batches': 0}
+    
+    if client is None:
+        if not initialize_firestore() or _firestore_client is None:
+            return stats
+        client = _firestore_client
+    
+    batch_size = max(1, min(batch_size, MAX_BATCH_WRITES))
+    after_id = 0
+    
+    while max_batches is None or stats['batches'] < max_batches:
+        query = ProjectLedger.query.filter(
+            or_(ProjectLedger.firestore_synced == False, ProjectLedger.firestore_synced.is_(None)),
+            ProjectLedger.id > after_id
+        )
+        if project_id is not None:
+            query = query.filter(ProjectLedger.project_id == project_id)
+        entries = query.order_by(ProjectLedger.id).limit(batch_size).all()
+        
+        if not entries:
+            break
+        
+        after_id = entries[-1].id
+        entry_ids = [entry.id for entry in entries]
+        documents = [ledger_document(entry) for entry in entries]
+        db.session.rollback()  # Don't hold a read transaction open across the network call
+        
+        stats['batches'] += 1
+        if not commit_writes(client, [(ledger_entry_ref(client, p, d), data) for p, d, data in documents]):
+            stats['failed_batches'] += 1
+            break  # Firestore is unavailable; the entries stay in the outbox
+        
+        for synced_project_id in {document[0] for document in documents}:
+            invalidate_ledger_cache(synced_project_id)
+        
+        try:
+            db.session.execute(
+                update(ProjectLedger.__table__).where(
+                    ProjectLedger.__table__.c.id.in_(entry_ids)
+                ).values(firestore_synced=True)
+            )
+            db.session.commit()
+            stats['synced'] += len(entry_ids)
+        except Exception as e:
+            # Entries are re-sent next run; their document IDs make that harmless
+            logging.error(f"Error marking ledger entries as synced: {e}")
+            db.session.rollback()
+    
+    if stats['batches']:
+        logging.info(f"Firestore ledger sync: {stats}")
+    return stats
+
+
+class _SyncWorker:
+    """Background thread that drains the ledger outbox off the request path"""
+    
+    def __init__(self):
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+    
+    def request(self):
+        self._wake.set()
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='firestore-ledger-sync', daemon=True)
+                self._thread.start()
+    
+    def _run(self):
+        from app import app, db
+        
+        while True:
+            self._wake.wait(SYNC_INTERVAL_SECONDS)
+            self._wake.clear()
+            try:
+                with app.app_context():
+                    sync_pending_entries()
+                    db.session.remove()
+            except Exception as e:
+                logging.error(f"Error syncing ledger outbox to Firestore: {e}")
+
+_sync_worker = _SyncWorker()
+
+
+def request_sync():
+    """
+    Ask the background worker to push unsynced ledger entries to Firestore.
+    Call after committing new ProjectLedger rows; it never blocks on the network.
+    """
+    if FIREBASE_AVAILABLE or os.environ.get('FIRESTORE_EMULATOR_HOST'):
+        _sync_worker.request()
+
+
+class InMemoryFirestore:
+    """
+    In-process stand-in for a Firestore client, covering what the outbox sync
+    and ledger reconciliation use: collection/document paths, get/set/delete,
+    simple where() queries and batched writes. Document reads are counted in
+    reads. Set fail_commits to make that many upcoming batch commits raise.
+    """
+    
+    def __init__(self, fail_commits: int = 0):
+        self.documents = {}
+        self.fail_commits = fail_commits
+        self.commits = 0
+        self.reads = 0
+    
+    def collection(self, name):
+        return _InMemoryPath(self, (name,))
+    
+    def batch(self):
+        return _InMemoryBatch(self)
+
+
+class _InMemorySnapshot:
+    def __init__(self, ref, data):
+        self.reference = ref
+        self.id = ref.id
+        self.exists = data is not None
+        self._data = data
+    
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class _InMemoryPath:
+    _OPERATORS = {
+        '==': lambda a, b: a == b,
+        '<': lambda a, b: a is not None and a < b,
+        '<=': lambda a, b: a is not None and a <= b,
+        '>': lambda a, b: a is not None and a > b,
+        '>=': lambda a, b: a is not None and a >= b,
+    }
+    
+    def __init__(self, store, path, filters=(), order=None, limit_to=None):
+        self._store = store
+        self.path = path
+        self.id = path[-1]
+        self._filters = filters
+        self._order = order
+        self._limit = limit_to
+    
+    def collection(self, name):
+        return _InMemoryPath(self._store, self.path + (name,))
+    
+    def document(self, name):
+        return _InMemoryPath(self._store, self.path + (name,))
+    
+    def where(self, field, op, value):
+        return _InMemoryPath(self._store, self.path, self._filters + ((field, self._OPERATORS[op], value),),
+                             self._order, self._limit)
+    
+    def order_by(self, field, direction='ASCENDING'):
+        return _InMemoryPath(self._store, self.path, self._filters, (field, direction == 'DESCENDING'), self._limit)
+    
+    def limit(self, count):
+        return _InMemoryPath(self._store, self.path, self._filters, self._order, count)
+    
+    def count(self):
+        return _InMemoryCount(self)
+    
+    def get(self):
+        self._store.reads += 1
+        return _InMemorySnapshot(self, self._store.documents.get('/'.join(self.path)))
+    
+    def set(self, data):
+        self._store.documents['/'.join(self.path)] = dict(data)
+    
+    def delete(self):
+        self._store.documents.pop('/'.join(self.path), None)
+    
+    def _matches(self):
+        prefix = '/'.join(self.path) + '/'
+        matches = []
+        for key, data in self._store.documents.items():
+            name = key[len(prefix):]
+            if key.startswith(prefix) and '/' not in name and \
+                    all(test(data.get(field), value) for field, test, value in self._filters):
+                matches.append((name, data))
+        if self._order:
+            field, descending = self._order
+            matches = [m for m in matches if m[1].get(field) is not None]
+            matches.sort(key=lambda m: m[1][field], reverse=descending)
+        else:
+            matches.sort()
+        return matches[:self._limit] if self._limit is not None else matches
+    
+    def stream(self):
+        """Documents directly in this collection that match the query"""
+        for name, data in self._matches():
+            self._store.reads += 1
+            yield _InMemorySnapshot(self.document(name), dict(data))
+
+
+class _InMemoryCount:
+    """Count aggregation; Firestore bills one read per 1000 index entries"""
+    
+    def __init__(self, query):
+        self._query = query
+    
+    def get(self):
+        value = len(self._query._matches())
+        self._query._store.reads += max(1, -(-value // 1000))
+        return [[SimpleNamespace(value=value)]]
+
+
+class _InMemoryBatch:
+    def __init__(self, store):
+        self._store = store
+        self._writes = []
+    
+    def _add(self, path, data):
+        if len(self._writes) >= MAX_BATCH_WRITES:
+            raise ValueError(f"A batch may contain at most {MAX_BATCH_WRITES} writes")
+        self._writes.append((path, data))
+    
+    def set(self, ref, data):
+        self._add(ref.path, dict(data))
+    
+    def delete(self, ref):
+        self._add(ref.path, None)
+    
+    def commit(self):
+        if self._store.fail_commits > 0:
+            self._store.fail_commits -= 1
+            raise ConnectionError("simulated Firestore outage")
+        for path, data in self._writes:
+            if data is None:
+                self._store.documents.pop('/'.join(path), None)
+            else:
+                self._store.documents['/'.join(path)] = data
+        self._store.commits += 1
+
+
+def self_test(n_entries: int = 1200, fail_commits: int = 2) -> bool:
+    """
+    Drain a generated outbox into an InMemoryFirestore that fails its first
+    commits, and check every entry arrives exactly once and is marked synced.
+    Uses the configured database; the generated entries are deleted afterwards.
+    """
+    global SYNC_BACKOFF_SECONDS
+    from app import app, db
+    from models import ProjectLedger, ChainCheckpoint
+    from ledger_append import append_project_entry
+    
+    project_id = f"outbox_{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}"
+    saved_backoff, SYNC_BACKOFF_SECONDS = SYNC_BACKOFF_SECONDS, 0.01
+    
+    try:
+        with app.app_context():
+            for n in range(n_entries):
+                append_project_entry(project_id, 'allocated', 'system', f'batch_{n}',
+                                     {'project_id': project_id, 'metadata': {'weight': n}})
+            db.session.commit()
+            
+            fake = InMemoryFirestore(fail_commits=fail_commits)
+            started = time.perf_counter()
+            stats = sync_pending_entries(client=fake, project_id=project_id)
+            elapsed = time.perf_counter() - started
+            
+            pending = ProjectLedger.query.filter_by(project_id=project_id, firestore_synced=False).count()
+            stored = [d for path, d in fake.documents.items() if path.startswith(f'ledger/{project_id}/')]
+            
+            # A second run finds nothing to send
+            again = sync_pending_entries(client=fake, project_id=project_id)
+    finally:
+        SYNC_BACKOFF_SECONDS = saved_backoff
+        # The rows were synced only to the fake; reconcile_all would push them to Firestore
+        with app.app_context():
+            db.session.rollback()
+            ProjectLedger.query.filter_by(project_id=project_id).delete(synchronize_session=False)
+            ChainCheckpoint.query.filter_by(chain_id=project_id).delete(synchronize_session=False)
+            db.session.commit()
+        invalidate_ledger_cache(project_id, full=True)
+    
+    print(f"{n_entries} entries in {stats['batches']} batches ({fake.commits} commits, "
+          f"{fail_commits} simulated failures) in {elapsed:.2f}s")
+    print(f"synced={stats['synced']} documents={len(stored)} still pending={pending} resync={again['synced']}")
+    
+    ok = (stats['synced'] == n_entries and len(stored) == n_entries and pending == 0
+          and again['synced'] == 0 and sorted(d['seq'] for d in stored) == list(range(1, n_entries + 1)))
+    print("OK" if ok else "FAIL")
+    return ok
+
+
+def cache_self_test(n_entries: int = 300, views: int = 50) -> bool:
+    """
+    Count Firestore reads for repeated ledger views through the read cache,
+    using an InMemoryFirestore (no database needed).
+    """
+    global LEDGER_CACHE_TTL_SECONDS
+    from datetime import timedelta
+    
+    fake = InMemoryFirestore()
+    project_id = 'cache_test'
+    base = datetime(2025, 1, 1)
+    
+    def add(n):
+        ledger_entry_ref(fake, project_id, f'entry_{n:06d}').set({'seq': n, 'timestamp': base + timedelta(seconds=n)})
     
     try:
-        entries_ref = _firestore_client.collection('ledger').document(project_id).collection('entries')
-        entries = entries_ref.order_by('timestamp', direction=firestore.Query.DESCENDING).limit(limit).stream()
+        for n in range(1, n_entries + 1):
+            add(n)
+        invalidate_ledger_cache(project_id, full=True)
         
-        result = []
-        for entry in entries:
-            data = entry.to_dict()
-            data['id'] = entry.id
-            result.append(data)
+        first = get_ledger_entries(project_id, client=fake)
+        cold_reads = fake.reads
         
-        return result
+        fake.reads = 0
+        for _ in range(views):
+            cached = get_ledger_entries(project_id, client=fake)
+        warm_reads = fake.reads
         
-    except Exception as e:
-        logging.error(f"Error reading ledger entries from Firestore: {e}")
-        return []
+        # After the TTL, new entries cost one small query
+        saved_ttl, LEDGER_CACHE_TTL_SECONDS = LEDGER_CACHE_TTL_SECONDS, 0
+        try:
+            add(n_entries + 1)
+            add(n_entries + 2)
+            fake.reads = 0
+            topped_up = get_ledger_entries(project_id, client=fake)
+            top_up_reads = fake.reads
+        finally:
+            LEDGER_CACHE_TTL_SECONDS = saved_ttl
+    finally:
+        # Don't leave the fake project's entries in the shared read cache
+        invalidate_ledger_cache(project_id, full=True)
+    
+    print(f"cold view: {cold_reads} reads; {views} cached views: {warm_reads} reads; "
+          f"top-up with 2 new entries: {top_up_reads} reads")
+    
+    ok = (len(first) == 100 and cached == first and warm_reads == 0 and top_up_reads == 2
+          and [e['seq'] for e in topped_up[:3]] == [n_entries + 2, n_entries + 1, n_entries]
+          and len(topped_up) == 100)
+    print("OK" if ok else "FAIL")
+    return ok
 
+
+if __name__ == '__main__':
+    if '--self-test' in sys.argv:
+        sys.exit(0 if cache_self_test() and self_test() else 1)
+    
+    from app import app
+    with app.app_context():
+        stats = sync_pending_entries()
+    print(f"Synced {stats['synced']} ledger entries in {stats['batches']} batches "
+          f"({stats['failed_batches']} failed)")
+    sys.exit(1 if stats['failed_batches'] else 0)
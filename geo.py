@@ -0,0 +1,86 @@
+"""
+Geographic helpers for ReGenWorks proximity searches.
+
+Searches narrow with an indexed latitude/longitude bounding box in SQL and
+then refine the candidates with an exact, vectorised haversine. The box is
+exact for a sphere: it contains every point within the radius, including
+near the poles and across the antimeridian.
+"""
+
+import math
+import numpy as np
+from sqlalchemy import and_, or_
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_km(lat, lng, lats, lngs):
+    """
+    Great-circle distances from one point to arrays of points.
+
+    Args:
+        lat, lng: Origin in degrees
+        lats, lngs: NumPy arrays of destinations in degrees
+
+    Returns:
+        NumPy array of distances in kilometres
+    """
+    lat1 = np.radians(lat)
+    lat2 = np.radians(lats)
+    a = (np.sin((lat2 - lat1) / 2) ** 2 +
+         np.cos(lat1) * np.cos(lat2) * np.sin(np.radians(lngs - lng) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def bounding_box(lat, lng, radius_km):
+    """
+    Latitude range and longitude ranges that contain a circle.
+
+    Args:
+        lat, lng: Centre in degrees
+        radius_km: Radius in kilometres
+
+    Returns:
+        Tuple of (south, north, [(west, east), ...]); two longitude ranges
+        when the circle crosses the antimeridian
+    """
+    angular = math.degrees(radius_km / EARTH_RADIUS_KM)
+    south, north = lat - angular, lat + angular
+
+    # A circle over a pole spans every longitude
+    if south <= -90 or north >= 90:
+        return max(south, -90.0), min(north, 90.0), [(-180.0, 180.0)]
+
+    spread = math.degrees(math.asin(min(1.0, math.sin(math.radians(angular)) / math.cos(math.radians(lat)))))
+    west, east = lng - spread, lng + spread
+    if west < -180:
+        return south, north, [(west + 360, 180.0), (-180.0, east)]
+    if east > 180:
+        return south, north, [(west, 180.0), (-180.0, east - 360)]
+    return south, north, [(west, east)]
+
+
+def bounding_box_filter(lat_col, lng_col, lat, lng, radius_km):
+    """SQL predicate selecting rows whose coordinates fall in bounding_box(lat, lng, radius_km)"""
+    south, north, ranges = bounding_box(lat, lng, radius_km)
+    return and_(
+        lat_col.between(south, north),
+        or_(*[lng_col.between(west, east) for west, east in ranges])
+    )
+
+
+def distance_matrix_km(lats, lngs):
+    """
+    Great-circle distances between every pair of points.
+
+    Args:
+        lats, lngs: NumPy arrays of coordinates in degrees
+
+    Returns:
+        Square NumPy array of distances in kilometres
+    """
+    lat = np.radians(lats)[:, None]
+    lng = np.radians(lngs)[:, None]
+    a = (np.sin((lat - lat.T) / 2) ** 2 +
+         np.cos(lat) * np.cos(lat.T) * np.sin((lng - lng.T) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
@@ -9,6 +9,7 @@ from flask import render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
 import infrastructure_service
+import map_tiles
 from models import InfrastructureReport
 
 def register_infrastructure_routes(app):
@@ -173,11 +174,8 @@ def register_infrastructure_routes(app):
         """
         Display a map of all reported infrastructure issues
         """
-        # Get all reports with coordinates
-        reports = InfrastructureReport.query.filter(
-            InfrastructureReport.latitude.isnot(None),
-            InfrastructureReport.longitude.isnot(None)
-        ).all()
+        # Markers are loaded per tile by the page; only the totals are rendered here
+        stats = infrastructure_service.get_report_stats()
         
         categories = infrastructure_service.get_infrastructure_categories()
         severity_levels = infrastructure_service.get_severity_levels()
@@ -185,12 +183,68 @@ def register_infrastructure_routes(app):
         
         return render_template(
             'infrastructure_map.html',
-            reports=reports,
+            stats=stats,
             categories=categories,
             severity_levels=severity_levels,
             status_types=status_types
         )
     
+    @app.route('/infrastructure/reports/tiles/<int:z>/<int:x>/<int:y>.json')
+    def infrastructure_report_tiles(z, x, y):
+        """
+        Clustered GeoJSON markers for one map tile
+        (optional filters: category, severity, status)
+        """
+        return map_tiles.tile_response(map_tiles.REPORTS, z, x, y)
+    
+    @app.route('/infrastructure/reports/near')
+    def infrastructure_reports_near():
+        """
+        Reports near a point, nearest first
+        (lat, lng; radius_km with limit/offset paging, or k for the k nearest;
+        optional filters: category, status)
+        """
+        try:
+            latitude = float(request.args['lat'])
+            longitude = float(request.args['lng'])
+            radius_km = min(float(request.args.get('radius_km', 5)), 50.0)
+            limit = max(1, min(int(request.args.get('limit', 20)), 100))
+            offset = max(0, int(request.args.get('offset', 0)))
+            k = int(request.args['k']) if 'k' in request.args else None
+        except (KeyError, ValueError):
+            return jsonify({'success': False, 'error': 'lat and lng are required; numeric arguments must be numbers'}), 400
+        
+        category = request.args.get('category') or None
+        status = request.args.get('status') or None
+        if k is not None:
+            results = infrastructure_service.get_nearest_reports(
+                latitude, longitude, k=max(1, min(k, 100)), max_radius_km=radius_km, category=category, status=status
+            )
+            total = None
+        else:
+            results, total = infrastructure_service.search_reports_near(
+                latitude, longitude, radius_km, limit=limit, offset=offset, category=category, status=status
+            )
+        
+        return jsonify({
+            'success': True,
+            'reports': [
+                {
+                    'id': report.id,
+                    'title': report.title,
+                    'category': report.category,
+                    'severity': report.severity,
+                    'status': report.status,
+                    'latitude': report.latitude,
+                    'longitude': report.longitude,
+                    'distance_km': distance
+                }
+                for report, distance in results
+            ],
+            'total': total,
+            'has_more': total is not None and offset + len(results) < total
+        })
+    
     @app.route('/infrastructure/update-status/<int:report_id>', methods=['POST'])
     @login_required
     def update_infrastructure_status(report_id):
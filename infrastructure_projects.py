@@ -8,11 +8,22 @@ from flask_login import login_required, current_user
 from app import db
 from models import InfrastructureProject, WasteBatch, ProjectContributor, ProjectLedger
 from sqlalchemy import func, desc
-from blockchain_tracker import get_project_blockchain, get_user_contribution_chain
+from blockchain_tracker import get_project_blockchain, BLOCKCHAIN_PAGE_SIZE
+from contribution_chain import get_user_contribution_chain
+from project_contributions import get_project_contributions
 import uuid
 import logging
 from datetime import datetime
-from firestore_sync import write_ledger_entry
+from firestore_sync import request_sync
+from ledger_append import append_project_entry
+from top_contributors import record_batch_link, is_top_contributor
+import map_tiles
+
+# Blocks shown on a project's detail page; the full chain is paged on its blockchain page
+PROJECT_DETAIL_BLOCKS = 5
+
+# Projects listed under the projects map; the map itself loads markers by tile
+MAP_LISTING_PAGE_SIZE = 25
 
 def register_infrastructure_project_routes(app):
     """Register infrastructure project routes"""
@@ -36,39 +47,17 @@ def register_infrastructure_project_routes(app):
                 desc(InfrastructureProject.created_at)
             ).all()
             
-            # Calculate user contributions for each project
+            # User contributions for all projects in one grouped query
+            summaries = get_project_contributions([project.id for project in projects], current_user.id)
+            
             user_contributions = {}
             top_contributors = {}
-            
-            for project in projects:
-                # Get user's total contribution to this project
-                user_contrib = db.session.query(
-                    func.sum(ProjectContributor.contribution_weight_grams)
-                ).join(WasteBatch).filter(
-                    WasteBatch.linked_project_id == project.id,
-                    ProjectContributor.user_id == current_user.id
-                ).scalar() or 0.0
-                
-                # Check if user is top contributor
-                is_top = ProjectContributor.query.join(WasteBatch).filter(
-                    WasteBatch.linked_project_id == project.id,
-                    ProjectContributor.user_id == current_user.id,
-                    ProjectContributor.is_top_contributor == True
-                ).first() is not None
-                
-                user_contributions[project.id] = {
-                    'weight': float(user_contrib),
-                    'is_top': is_top
+            for project_id, summary in summaries.items():
+                user_contributions[project_id] = {
+                    'weight': summary['weight'],
+                    'is_top': summary['is_top']
                 }
-                
-                # Get top contributors for this project (top 10%)
-                total_contributors = db.session.query(
-                    func.count(func.distinct(ProjectContributor.user_id))
-                ).join(WasteBatch).filter(
-                    WasteBatch.linked_project_id == project.id
-                ).scalar() or 0
-                
-                top_contributors[project.id] = total_contributors > 0 and is_top
+                top_contributors[project_id] = summary['contributors'] > 0 and summary['is_top']
             
             return render_template(
                 'infrastructure_projects.html',
@@ -89,46 +78,75 @@ def register_infrastructure_project_routes(app):
         Display a map of all infrastructure projects using OpenLayers (same system as drop points)
         """
         try:
-            # Get all projects with locations
-            projects = InfrastructureProject.query.filter(
+            page = max(1, request.args.get('page', 1, type=int))
+            per_page = MAP_LISTING_PAGE_SIZE
+            search = request.args.get('q', '').strip()
+            
+            # One page of the projects with locations, optionally matching a search
+            query = InfrastructureProject.query.filter(
                 InfrastructureProject.location_lat.isnot(None),
                 InfrastructureProject.location_lng.isnot(None)
-            ).all()
+            )
+            if search:
+                pattern = f"%{search}%"
+                query = query.filter(
+                    InfrastructureProject.project_name.ilike(pattern) |
+                    InfrastructureProject.description.ilike(pattern)
+                )
             
-            # Calculate user contributions for each project
-            user_contributions = {}
-            for project in projects:
-                user_contrib = db.session.query(
-                    func.sum(ProjectContributor.contribution_weight_grams)
-                ).join(WasteBatch).filter(
-                    WasteBatch.linked_project_id == project.id,
-                    ProjectContributor.user_id == current_user.id
-                ).scalar() or 0.0
-                
-                user_contributions[project.id] = float(user_contrib)
+            # Ask for one extra project to know whether there is a next page
+            projects = query.order_by(InfrastructureProject.project_name, InfrastructureProject.id).offset(
+                (page - 1) * per_page
+            ).limit(per_page + 1).all()
+            has_next = len(projects) > per_page
+            projects = projects[:per_page]
+            
+            # User contributions for the listed projects in one grouped query
+            user_contributions = {
+                project_id: summary['weight']
+                for project_id, summary in get_project_contributions(
+                    [project.id for project in projects], current_user.id
+                ).items()
+            }
             
             return render_template(
                 'infrastructure_projects_map.html',
                 projects=projects,
-                user_contributions=user_contributions
+                user_contributions=user_contributions,
+                page=page,
+                has_next=has_next,
+                search=search
             )
         except Exception as e:
             logging.error(f"Error loading infrastructure projects map: {e}")
             flash("Error loading projects map. Please try again.", "danger")
             return redirect(url_for('infrastructure_projects'))
     
+    @app.route('/infrastructure-projects/tiles/<int:z>/<int:x>/<int:y>.json')
+    @login_required
+    def infrastructure_project_tiles(z, x, y):
+        """Clustered GeoJSON project markers for one map tile (optional filter: status)"""
+        return map_tiles.tile_response(map_tiles.PROJECTS, z, x, y)
+    
     @app.route('/infrastructure-projects/<int:project_id>/blockchain')
     @login_required
     def project_blockchain(project_id):
         """View blockchain for a specific project"""
         try:
             project = InfrastructureProject.query.get_or_404(project_id)
-            blockchain = get_project_blockchain(project.project_id)
+            page = max(1, request.args.get('page', 1, type=int))
+            per_page = BLOCKCHAIN_PAGE_SIZE
+            
+            # Ask for one extra block to know whether there is a later page
+            blockchain = get_project_blockchain(project.project_id, offset=(page - 1) * per_page, limit=per_page + 1)
+            has_next = len(blockchain) > per_page
             
             return render_template(
                 'project_blockchain.html',
                 project=project,
-                blockchain=blockchain
+                blockchain=blockchain[:per_page],
+                page=page,
+                has_next=has_next
             )
         except Exception as e:
             logging.error(f"Error loading project blockchain: {e}")
@@ -140,11 +158,20 @@ def register_infrastructure_project_routes(app):
     def my_contribution_blockchain():
         """View user's contribution blockchain"""
         try:
-            contribution_chains = get_user_contribution_chain(current_user.id)
+            page = max(1, request.args.get('page', 1, type=int))
+            per_page = 20
+            
+            # Ask for one extra entry to know whether there is an older page
+            contribution_chains = get_user_contribution_chain(
+                current_user.id, offset=(page - 1) * per_page, limit=per_page + 1
+            )
+            has_next = len(contribution_chains) > per_page
             
             return render_template(
                 'my_contribution_blockchain.html',
-                contribution_chains=contribution_chains
+                contribution_chains=contribution_chains[:per_page],
+                page=page,
+                has_next=has_next
             )
         except Exception as e:
             logging.error(f"Error loading contribution blockchain: {e}")
@@ -261,7 +288,9 @@ def register_infrastructure_project_routes(app):
                 if batch:
                     # Link batch to selected project
                     if not batch.linked_project_id:
-                        link_batch_to_project_auto(batch, project, current_user.id)
+                        if link_batch_to_project_auto(batch, project, current_user.id):
+                            db.session.commit()
+                            request_sync()
                         flash(f"Successfully contributed {waste_item.estimated_weight_grams or 25}g to {project.project_name}!", "success")
                     else:
                         flash(f"This material is already part of a batch linked to another project.", "info")
@@ -307,14 +336,10 @@ def register_infrastructure_project_routes(app):
         ).scalar() or 0.0
         
         # Check if user is top contributor
-        is_top = ProjectContributor.query.join(WasteBatch).filter(
-            WasteBatch.linked_project_id == project.id,
-            ProjectContributor.user_id == current_user.id,
-            ProjectContributor.is_top_contributor == True
-        ).first() is not None
+        is_top = is_top_contributor(project.id, current_user.id)
         
-        # Get blockchain for this project
-        blockchain = get_project_blockchain(project.project_id)
+        # First blocks of this project's blockchain (the rest are on its blockchain page)
+        blockchain = get_project_blockchain(project.project_id, limit=PROJECT_DETAIL_BLOCKS)
         
         return render_template(
             'infrastructure_project_detail.html',
@@ -357,25 +382,36 @@ def link_batch_to_project(batch_id: str, project_id: str, verified_by: str = Non
         
         # Update project allocated weight
         project.total_plastic_allocated_grams = (
-            (project.total_plastic_allocated_grams or 0) + float(batch.total_weight_grams)
+            float(project.total_plastic_allocated_grams or 0) + float(batch.total_weight_grams)
         )
         
-        db.session.commit()
-        
-        # Write to Firestore ledger
         if verified_by is None:
             verified_by = f'user_{current_user.id if current_user.is_authenticated else "system"}'
         
-        write_ledger_entry(
+        # Record the allocation on the project chain; the outbox worker
+        # copies it to the Firestore ledger
+        append_project_entry(
             project_id=project_id,
-            batch_id=batch_id,
-            weight=int(batch.total_weight_grams),
+            status='allocated',
             verified_by=verified_by,
-            status='allocated'
+            batch_reference=batch_id,
+            block_data={
+                'batch_id': batch_id,
+                'project_id': project_id,
+                'action': 'allocated',
+                'verified_by': verified_by,
+                'metadata': {
+                    'weight': float(batch.total_weight_grams),
+                    'material_type': batch.material_type
+                }
+            }
         )
         
         # Update top contributors
-        update_top_contributors(project.id)
+        record_batch_link(project.id, batch.id)
+        
+        db.session.commit()
+        request_sync()
         
         logging.info(f"Batch {batch_id} linked to project {project_id}")
         return True
@@ -384,46 +420,3 @@ def link_batch_to_project(batch_id: str, project_id: str, verified_by: str = Non
         logging.error(f"Error linking batch to project: {e}")
         db.session.rollback()
         return False
-
-def update_top_contributors(project_id: int):
-    """
-    Update top contributor flags for a project (top 10%)
-    
-    Args:
-        project_id: Project database ID
-    """
-    try:
-        # Get all contributors for this project
-        contributors = db.session.query(
-            ProjectContributor.user_id,
-            func.sum(ProjectContributor.contribution_weight_grams).label('total_contrib')
-        ).join(WasteBatch).filter(
-            WasteBatch.linked_project_id == project_id
-        ).group_by(ProjectContributor.user_id).order_by(
-            desc('total_contrib')
-        ).all()
-        
-        if not contributors:
-            return
-        
-        # Calculate top 10% threshold
-        total_contributors = len(contributors)
-        top_count = max(1, int(total_contributors * 0.1))  # Top 10%, at least 1
-        
-        # Get top contributors
-        top_contributors = contributors[:top_count]
-        top_user_ids = [c.user_id for c in top_contributors]
-        
-        # Update flags
-        ProjectContributor.query.join(WasteBatch).filter(
-            WasteBatch.linked_project_id == project_id
-        ).update({
-            ProjectContributor.is_top_contributor: ProjectContributor.user_id.in_(top_user_ids)
-        }, synchronize_session=False)
-        
-        db.session.commit()
-        
-    except Exception as e:
-        logging.error(f"Error updating top contributors: {e}")
-        db.session.rollback()
-
@@ -5,10 +5,17 @@ This module handles the creation and management of infrastructure reports.
 
 import os
 from datetime import datetime
-from models import InfrastructureReport, User
 from app import db
+from models import InfrastructureReport, User
+from sqlalchemy import func
+import numpy as np
+from geo import bounding_box_filter, haversine_km
+import points_ledger
 from werkzeug.utils import secure_filename
 
+# First radius tried by get_nearest_reports
+NEAREST_START_RADIUS_KM = 1.0
+
 # Define infrastructure categories
 INFRASTRUCTURE_CATEGORIES = {
     'road': 'Roads and Highways',
@@ -176,10 +183,8 @@ def create_infrastructure_report(user_id, title, description, category, severity
     db.session.commit()
     
     # Award points to the user for reporting (gamification)
-    user = User.query.get(user_id)
-    if user:
-        user.eco_points += 20  # Award points for civic engagement
-        db.session.commit()
+    points_ledger.credit(user_id, 20, f"Reported infrastructure issue: {title}",
+                         "infrastructure_report", commit=True)
     
     return new_report
 
@@ -210,10 +215,8 @@ def update_report_status(report_id, status, municipality_notes=None):
     
     # If resolved, award additional points to the reporter
     if status == 'resolved':
-        user = User.query.get(report.user_id)
-        if user:
-            user.eco_points += 30  # Bonus for resolved reports
-            db.session.commit()
+        points_ledger.credit(report.user_id, 30, f"Infrastructure report resolved: {report.title}",
+                             "infrastructure_resolved", commit=True)
     
     return report
 
@@ -259,6 +262,126 @@ def get_reports_by_status(status):
         InfrastructureReport.reported_at.desc()
     ).all()
 
+def get_report_stats():
+    """
+    Get report totals for the map summary with one grouped query.
+    
+    Returns:
+        Dictionary with total, pending, in_progress, resolved and high_severity counts
+    """
+    stats = {'total': 0, 'pending': 0, 'in_progress': 0, 'resolved': 0, 'high_severity': 0}
+    
+    rows = db.session.query(
+        InfrastructureReport.status, InfrastructureReport.severity, func.count(InfrastructureReport.id)
+    ).filter(
+        InfrastructureReport.latitude.isnot(None),
+        InfrastructureReport.longitude.isnot(None)
+    ).group_by(InfrastructureReport.status, InfrastructureReport.severity).all()
+    
+    for status, severity, count in rows:
+        stats['total'] += count
+        if status == 'pending':
+            stats['pending'] += count
+        elif status in ('under_review', 'in_progress'):
+            stats['in_progress'] += count
+        elif status == 'resolved':
+            stats['resolved'] += count
+        if severity in ('high', 'critical'):
+            stats['high_severity'] += count
+    
+    return stats
+
+def _reports_within(latitude, longitude, radius_km, category=None, status=None):
+    """
+    Ids and distances of the reports within radius_km, nearest first.
+
+    The bounding box predicate is answered from idx_report_location and only
+    (id, latitude, longitude) of the candidates is read; exact distances are
+    then computed in one vectorised haversine.
+
+    Returns:
+        Tuple of NumPy arrays (ids, distances_km)
+    """
+    query = db.session.query(
+        InfrastructureReport.id, InfrastructureReport.latitude, InfrastructureReport.longitude
+    ).filter(bounding_box_filter(InfrastructureReport.latitude, InfrastructureReport.longitude,
+                                 latitude, longitude, radius_km))
+    if category:
+        query = query.filter(InfrastructureReport.category == category)
+    if status:
+        query = query.filter(InfrastructureReport.status == status)
+
+    rows = query.all()
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+
+    candidates = np.array(rows, dtype=np.float64)
+    distances = haversine_km(latitude, longitude, candidates[:, 1], candidates[:, 2])
+    within = distances <= radius_km
+    ids, distances = candidates[within, 0].astype(np.int64), distances[within]
+
+    # Ties are broken by id so pages are stable
+    order = np.lexsort((ids, distances))
+    return ids[order], distances[order]
+
+
+def _load_reports(ids, distances):
+    """(report, distance_km) pairs for the given ids, in the given order"""
+    if len(ids) == 0:
+        return []
+    reports = {r.id: r for r in InfrastructureReport.query.filter(InfrastructureReport.id.in_(ids.tolist())).all()}
+    return [(reports[i], round(float(d), 3)) for i, d in zip(ids.tolist(), distances) if i in reports]
+
+
+def search_reports_near(latitude, longitude, radius_km=5, limit=None, offset=0, category=None, status=None):
+    """
+    Infrastructure reports within a radius, nearest first, one page at a time.
+
+    Args:
+        latitude: Center latitude
+        longitude: Center longitude
+        radius_km: Search radius in kilometers
+        limit: Page size (None for every match)
+        offset: Number of matches to skip
+        category: Only reports in this category
+        status: Only reports with this status
+
+    Returns:
+        Tuple of (list of (InfrastructureReport, distance_km), total matches)
+    """
+    ids, distances = _reports_within(float(latitude), float(longitude), float(radius_km), category, status)
+    end = None if limit is None else offset + limit
+    return _load_reports(ids[offset:end], distances[offset:end]), len(ids)
+
+
+def get_nearest_reports(latitude, longitude, k=10, max_radius_km=50, category=None, status=None):
+    """
+    The k infrastructure reports nearest to a location.
+
+    The search radius starts small and doubles until it holds k reports or
+    reaches max_radius_km. Every report within the radius is a candidate, so
+    the k nearest inside it are the k nearest overall.
+
+    Args:
+        latitude: Center latitude
+        longitude: Center longitude
+        k: Number of reports
+        max_radius_km: Reports further away than this are not returned
+        category: Only reports in this category
+        status: Only reports with this status
+
+    Returns:
+        List of (InfrastructureReport, distance_km), nearest first
+    """
+    latitude, longitude = float(latitude), float(longitude)
+    radius_km = min(NEAREST_START_RADIUS_KM, max_radius_km)
+    while True:
+        ids, distances = _reports_within(latitude, longitude, radius_km, category, status)
+        if len(ids) >= k or radius_km >= max_radius_km:
+            return _load_reports(ids[:k], distances[:k])
+        radius_km = min(radius_km * 2, max_radius_km)
+
+
 def get_reports_near_location(latitude, longitude, radius_km=5):
     """
     Get infrastructure reports near a specific location.
@@ -269,27 +392,102 @@ def get_reports_near_location(latitude, longitude, radius_km=5):
         radius_km: Search radius in kilometers
         
     Returns:
-        List of InfrastructureReport objects
+        List of InfrastructureReport objects, nearest first
     """
-    # This is a simplified version - in production you would use
-    # proper geospatial queries with PostGIS or similar
-    reports = InfrastructureReport.query.filter(
-        InfrastructureReport.latitude.isnot(None),
-        InfrastructureReport.longitude.isnot(None)
-    ).all()
-    
-    # Filter reports within radius (simplified calculation)
-    # In production, use proper geospatial distance calculation
-    nearby_reports = []
-    for report in reports:
-        # Simple approximation: 1 degree ≈ 111km
-        lat_diff = abs(report.latitude - latitude)
-        lng_diff = abs(report.longitude - longitude)
-        
-        # Rough distance calculation (not accounting for earth's curvature)
-        approx_distance = ((lat_diff * 111) ** 2 + (lng_diff * 111) ** 2) ** 0.5
-        
-        if approx_distance <= radius_km:
-            nearby_reports.append(report)
-    
-    return nearby_reports
\ No newline at end of file
+    results, _ = search_reports_near(latitude, longitude, radius_km)
+    return [report for report, _ in results]
+
+
+def benchmark(n_reports=50000, n_queries=200):
+    """
+    Seed n_reports reports around Bangalore and compare the old scan of every
+    report with the bounding box search.
+    """
+    import time
+    import random
+    from app import app
+
+    def flat_earth_scan(latitude, longitude, radius_km):
+        nearby = []
+        for report in InfrastructureReport.query.filter(
+            InfrastructureReport.latitude.isnot(None),
+            InfrastructureReport.longitude.isnot(None)
+        ).all():
+            lat_diff = abs(report.latitude - latitude)
+            lng_diff = abs(report.longitude - longitude)
+            if ((lat_diff * 111) ** 2 + (lng_diff * 111) ** 2) ** 0.5 <= radius_km:
+                nearby.append(report)
+        return nearby
+
+    rng = random.Random(44)
+    stamp = datetime.utcnow().strftime('%Y%m%d%H%M%S%f')
+    points = [(12.97 + rng.uniform(-0.3, 0.3), 77.59 + rng.uniform(-0.3, 0.3)) for _ in range(n_queries)]
+
+    with app.app_context():
+        user = User(username=f'nearbench_{stamp}', email=f'nearbench_{stamp}@example.com')
+        db.session.add(user)
+        db.session.flush()
+        user_id = user.id
+        try:
+            db.session.bulk_insert_mappings(InfrastructureReport, [
+                {
+                    'user_id': user_id, 'title': f'Report {i}', 'description': 'bench', 'category': 'road',
+                    'severity': 'low', 'location_description': 'bench', 'image_path': '', 'status': 'pending',
+                    'latitude': 12.97 + rng.gauss(0, 0.15), 'longitude': 77.59 + rng.gauss(0, 0.15)
+                }
+                for i in range(n_reports)
+            ])
+            db.session.commit()
+
+            scan_queries = max(1, n_queries // 20)
+            started = time.perf_counter()
+            for latitude, longitude in points[:scan_queries]:
+                flat_earth_scan(latitude, longitude, 2)
+                db.session.expunge_all()
+            scan_time = (time.perf_counter() - started) / scan_queries
+
+            started = time.perf_counter()
+            for latitude, longitude in points:
+                search_reports_near(latitude, longitude, 2, limit=20)
+                db.session.expunge_all()
+            search_time = (time.perf_counter() - started) / n_queries
+
+            started = time.perf_counter()
+            for latitude, longitude in points:
+                get_nearest_reports(latitude, longitude, k=10)
+                db.session.expunge_all()
+            nearest_time = (time.perf_counter() - started) / n_queries
+
+            # Exact check against a haversine over every report
+            everything = np.array(db.session.query(
+                InfrastructureReport.id, InfrastructureReport.latitude, InfrastructureReport.longitude
+            ).filter(InfrastructureReport.latitude.isnot(None)).all(), dtype=np.float64)
+            ok = True
+            for latitude, longitude in points[:20]:
+                distances = haversine_km(latitude, longitude, everything[:, 1], everything[:, 2])
+                ids = everything[:, 0].astype(np.int64)
+                order = np.lexsort((ids, distances))
+                expected_within = ids[order][distances[order] <= 2].tolist()
+                found, total = search_reports_near(latitude, longitude, 2)
+                nearest = [report.id for report, _ in get_nearest_reports(latitude, longitude, k=10)]
+                ok = ok and [r.id for r, _ in found] == expected_within and total == len(expected_within)
+                ok = ok and nearest == ids[order][:10].tolist()
+                db.session.expunge_all()
+
+            print(f"{n_reports} reports")
+            print(f"flat-earth scan of every report: {scan_time * 1e3:.1f} ms per query")
+            print(f"bounding box + haversine, 2 km page of 20: {search_time * 1e3:.2f} ms per query")
+            print(f"10 nearest: {nearest_time * 1e3:.2f} ms per query")
+            print("OK: matches an exact haversine over every report" if ok else "FAIL: results differ")
+            return ok
+        finally:
+            # Remove the seeded rows so they never reach the real report listings
+            db.session.rollback()
+            InfrastructureReport.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+            User.query.filter_by(id=user_id).delete(synchronize_session=False)
+            db.session.commit()
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(0 if benchmark() else 1)
@@ -2,38 +2,13 @@
 JSON-based localization system
 Loads translations from JSON files instead of database
 """
-import json
-import os
 from pathlib import Path
-from flask import session, g
-
-# Cache for loaded translations
-_translation_cache = {}
+from flask import session
+from translation_catalog import get_catalog, MISSING
 
 def load_translations(language='en'):
-    """Load translations for a language from JSON file"""
-    if language in _translation_cache:
-        return _translation_cache[language]
-    
-    locales_dir = Path('locales')
-    translation_file = locales_dir / f'{language}.json'
-    
-    if not translation_file.exists():
-        # Fallback to English
-        if language != 'en':
-            return load_translations('en')
-        return {}
-    
-    try:
-        with open(translation_file, 'r', encoding='utf-8') as f:
-            translations = json.load(f)
-            _translation_cache[language] = translations
-            return translations
-    except Exception as e:
-        print(f"Error loading translations for {language}: {e}")
-        if language != 'en':
-            return load_translations('en')
-        return {}
+    """Translations for a language from the compiled catalog (English for missing keys)"""
+    return get_catalog().lookup(language)
 
 def get_translation(key, language=None, default=None):
     """
@@ -59,21 +34,11 @@ def get_translation(key, language=None, default=None):
         else:
             language = 'en'
     
-    # Load translations
-    translations = load_translations(language)
-    
-    # Get translation
-    if key in translations:
-        return translations[key]
-    
-    # Fallback to English if not current language
-    if language != 'en':
-        en_translations = load_translations('en')
-        if key in en_translations:
-            return en_translations[key]
-    
-    # Return default or key
-    return default or key
+    # English is already filled in for keys the language lacks
+    value = load_translations(language).get(key, MISSING)
+    if value is MISSING:
+        return default or key
+    return value
 
 def get_current_language():
     """Get current language from session or user preference"""
@@ -0,0 +1,497 @@
+"""
+Leaderboard engine for ReGenWorks.
+Keeps an ordered in-memory index of users by eco-points (all-time, weekly and
+monthly) so top-K pages and "my rank" lookups don't re-sort the user table.
+
+The database stays the source of truth: all-time scores come from
+User.eco_points and the weekly/monthly windows sum the points earned (positive
+Reward rows) by Reward.created_at.
+Each board is rebuilt from one aggregate query on first use (and after a
+restart or window rollover), then kept current by record_points().
+
+A rebuild reads the database and builds its new index without holding the
+board lock, so rankings keep being served from the old index meanwhile. An
+award whose transaction commits while the aggregate query runs may or may not
+be in its result. The users of such awards are re-read once no award commit is
+in flight in this process (commits wait in begin_commit() for that moment),
+and the new index is swapped in before those commits proceed. Every award that
+record_points() applies to the new index therefore committed after the rebuild
+read its user, and is counted exactly once.
+"""
+
+import os
+import time
+import random
+import logging
+import itertools
+import threading
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from app import db
+from models import User, Reward, WasteItem
+
+PERIODS = ('weekly', 'monthly', 'all-time')
+
+# Boards are re-read from the database after this many seconds so that points
+# awarded by other worker processes show up without a restart.
+REFRESH_SECONDS = int(os.environ.get('LEADERBOARD_REFRESH_SECONDS', 300))
+
+# Longest a rebuild waits for in-flight award commits before swapping anyway
+COMMIT_WAIT_SECONDS = 10
+
+
+class RankIndex:
+    """
+    Order-statistic index of (user_id, score) pairs.
+
+    Keys are stored as (-score, user_id) in sorted chunks with a Fenwick tree
+    over the chunk sizes, so locating a key or a rank offset is O(log n) and an
+    update only shifts one bounded chunk.
+    """
+
+    _LOAD = 512
+
+    def __init__(self):
+        self._lists = []
+        self._maxes = []
+        self._tree = [0]
+        self._scores = {}
+
+    def __len__(self):
+        return len(self._scores)
+
+    def load(self, scores):
+        """Bulk-load a {user_id: score} mapping, replacing the current contents"""
+        self._scores = dict(scores)
+        keys = sorted((-score, user_id) for user_id, score in self._scores.items())
+        self._lists = [keys[i:i + self._LOAD] for i in range(0, len(keys), self._LOAD)]
+        self._maxes = [chunk[-1] for chunk in self._lists]
+        self._build_tree()
+
+    def score(self, user_id):
+        return self._scores.get(user_id)
+
+    def set(self, user_id, score):
+        """Set a user's score, moving them to their new position"""
+        old = self._scores.get(user_id)
+        if old == score:
+            return
+        if old is not None:
+            self._remove((-old, user_id))
+        self._scores[user_id] = score
+        self._insert((-score, user_id))
+
+    def add(self, user_id, points):
+        """Increment a user's score by points"""
+        self.set(user_id, (self._scores.get(user_id) or 0) + points)
+
+    def rank(self, user_id):
+        """1-based rank of a user, or None if they are not on the board"""
+        score = self._scores.get(user_id)
+        if score is None:
+            return None
+        key = (-score, user_id)
+        pos = bisect_left(self._maxes, key)
+        return self._prefix(pos) + bisect_left(self._lists[pos], key) + 1
+
+    def page(self, offset, limit):
+        """Return [(rank, user_id, score), ...] starting at a 0-based offset"""
+        offset = max(0, offset)
+        if limit <= 0 or offset >= len(self._scores):
+            return []
+
+        pos, idx = self._locate(offset)
+        rank = offset + 1
+        result = []
+        while pos < len(self._lists) and len(result) < limit:
+            chunk = self._lists[pos]
+            for neg_score, user_id in chunk[idx:idx + limit - len(result)]:
+                result.append((rank, user_id, -neg_score))
+                rank += 1
+            pos += 1
+            idx = 0
+        return result
+
+    def around(self, user_id, radius=2):
+        """Return the page centred on a user (their neighbours above and below)"""
+        rank = self.rank(user_id)
+        if rank is None:
+            return []
+        start = max(0, rank - 1 - radius)
+        return self.page(start, rank - 1 - start + radius + 1)
+
+    def _insert(self, key):
+        if not self._lists:
+            self._lists.append([key])
+            self._maxes.append(key)
+            self._build_tree()
+            return
+
+        pos = bisect_left(self._maxes, key)
+        if pos == len(self._maxes):
+            pos -= 1
+            self._lists[pos].append(key)
+            self._maxes[pos] = key
+        else:
+            insort(self._lists[pos], key)
+
+        chunk = self._lists[pos]
+        if len(chunk) > 2 * self._LOAD:
+            # Split oversized chunks so in-chunk shifts stay bounded
+            half = chunk[self._LOAD:]
+            del chunk[self._LOAD:]
+            self._maxes[pos] = chunk[-1]
+            self._lists.insert(pos + 1, half)
+            self._maxes.insert(pos + 1, half[-1])
+            self._build_tree()
+        else:
+            self._tree_add(pos, 1)
+
+    def _remove(self, key):
+        pos = bisect_left(self._maxes, key)
+        chunk = self._lists[pos]
+        del chunk[bisect_left(chunk, key)]
+
+        if chunk:
+            self._maxes[pos] = chunk[-1]
+            self._tree_add(pos, -1)
+        else:
+            del self._lists[pos]
+            del self._maxes[pos]
+            self._build_tree()
+
+    def _build_tree(self):
+        n = len(self._lists)
+        tree = [0] * (n + 1)
+        for i, chunk in enumerate(self._lists, 1):
+            tree[i] += len(chunk)
+            parent = i + (i & -i)
+            if parent <= n:
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _tree_add(self, pos, delta):
+        i = pos + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, pos):
+        """Number of keys in chunks [0, pos)"""
+        total = 0
+        while pos > 0:
+            total += self._tree[pos]
+            pos -= pos & -pos
+        return total
+
+    def _locate(self, offset):
+        """Map a 0-based global offset to (chunk position, index in chunk)"""
+        n = len(self._tree) - 1
+        pos = 0
+        bit = 1 << n.bit_length()
+        while bit:
+            nxt = pos + bit
+            if nxt <= n and self._tree[nxt] <= offset:
+                pos = nxt
+                offset -= self._tree[nxt]
+            bit >>= 1
+        return pos, offset
+
+
+class _Board:
+    def __init__(self, period):
+        self.period = period
+        self.index = RankIndex()
+        self.window_start = None
+        self.loaded_at = 0.0
+        self.generation = 0  # Bumped by invalidate() so a running rebuild can't mark the board fresh
+        self.build_lock = threading.Lock()
+
+
+_boards = {period: _Board(period) for period in PERIODS}
+_lock = threading.RLock()
+
+# Award commits in flight in this process (token -> user ids), and the users
+# touched by award commits while each rebuild runs (token -> set of user ids)
+_gate = threading.Condition()
+_gate_closed = 0
+_in_flight = {}
+_rebuilds = {}
+_tokens = itertools.count(1)
+
+
+def get_window_start(period, now=None):
+    """
+    Get the first instant counted by a board (None for all-time).
+    Weeks start on Monday, matching the footprint tracker.
+    """
+    today = (now or datetime.utcnow()).date()
+    if period == 'weekly':
+        start = today - timedelta(days=today.weekday())
+    elif period == 'monthly':
+        start = today.replace(day=1)
+    else:
+        return None
+    return datetime(start.year, start.month, start.day)
+
+
+def _load_scores(period, window_start, user_ids=None):
+    """Read a board's scores (optionally only some users') with a single aggregate query"""
+    if period == 'all-time':
+        query = db.session.query(User.id, User.eco_points)
+        if user_ids is not None:
+            query = query.filter(User.id.in_(user_ids))
+    else:
+        query = db.session.query(
+            Reward.user_id,
+            func.sum(Reward.points)
+        ).filter(
+            Reward.created_at >= window_start,
+            Reward.points > 0
+        )
+        if user_ids is not None:
+            query = query.filter(Reward.user_id.in_(user_ids))
+        query = query.group_by(Reward.user_id)
+
+    return {user_id: int(points or 0) for user_id, points in query.all()}
+
+
+def begin_commit(user_ids):
+    """
+    Called before a transaction carrying awards commits (see points_ledger).
+    Waits while a rebuild swaps in its index and tells running rebuilds which
+    users are about to change.
+
+    Returns:
+        Token to pass to end_commit() once the transaction has ended
+    """
+    token = next(_tokens)
+    with _gate:
+        _gate.wait_for(lambda: not _gate_closed, timeout=COMMIT_WAIT_SECONDS)
+        _in_flight[token] = set(user_ids)
+        for touched in _rebuilds.values():
+            touched.update(user_ids)
+    return token
+
+
+def end_commit(token):
+    """Called once a transaction registered with begin_commit() has ended"""
+    with _gate:
+        if _in_flight.pop(token, None) is not None:
+            _gate.notify_all()
+
+
+def _rebuild(board, window_start):
+    """Read a board from the database outside _lock and swap the new index in"""
+    global _gate_closed
+
+    generation = board.generation
+    token = next(_tokens)
+    with _gate:
+        touched = set().union(*_in_flight.values())
+        _rebuilds[token] = touched
+
+    try:
+        scores = _load_scores(board.period, window_start)
+        index = RankIndex()
+        index.load(scores)
+
+        with _gate:
+            _gate_closed += 1
+            try:
+                if not _gate.wait_for(lambda: not _in_flight, timeout=COMMIT_WAIT_SECONDS):
+                    logging.warning(f"Leaderboard '{board.period}' swapped in with award commits still in flight")
+                # These users' awards may have committed during the aggregate query
+                if touched:
+                    for user_id, score in _load_scores(board.period, window_start, touched).items():
+                        index.set(user_id, score)
+
+                with _lock:
+                    board.index = index
+                    board.window_start = window_start
+                    board.loaded_at = time.monotonic() if board.generation == generation else 0.0
+            finally:
+                _gate_closed -= 1
+                _gate.notify_all()
+    finally:
+        with _gate:
+            del _rebuilds[token]
+
+    logging.info(f"Leaderboard '{board.period}' rebuilt with {len(scores)} users")
+
+
+def _needs_rebuild(board, window_start):
+    stale = time.monotonic() - board.loaded_at > REFRESH_SECONDS
+    return board.loaded_at == 0.0 or stale or board.window_start != window_start
+
+
+def _get_board(period):
+    """
+    Return a board, rebuilding it if it is cold, stale or its window rolled over.
+    Must not be called with _lock held.
+    """
+    if period not in _boards:
+        raise ValueError(f"Unknown leaderboard period: {period}")
+
+    board = _boards[period]
+    window_start = get_window_start(period)
+    if not _needs_rebuild(board, window_start):
+        return board
+
+    # One rebuild per board at a time; a stale board keeps serving meanwhile
+    wait = board.loaded_at == 0.0 or board.window_start != window_start
+    if board.build_lock.acquire(blocking=wait):
+        try:
+            if _needs_rebuild(board, window_start):
+                _rebuild(board, window_start)
+        finally:
+            board.build_lock.release()
+
+    return board
+
+
+def record_points(user_id, points, awarded_at=None):
+    """
+    Apply a points award to every loaded board it falls into.
+    Called after the Reward insert commits so rankings stay current without a rebuild.
+
+    Args:
+        user_id: ID of the user who earned the points
+        points: Number of points awarded
+        awarded_at: When the points were awarded (defaults to now)
+    """
+    if not user_id or not points:
+        return
+
+    awarded_at = awarded_at or datetime.utcnow()
+    with _lock:
+        for board in _boards.values():
+            if board.loaded_at == 0.0:
+                continue  # Cold boards pick the award up when they are built
+            if board.window_start is not None and (points < 0 or awarded_at < board.window_start):
+                continue  # Windowed boards rank points earned, not spent
+            board.index.add(user_id, points)
+
+
+def invalidate(period=None):
+    """Force a rebuild of one board (or all boards) on next access"""
+    with _lock:
+        for board in _boards.values():
+            if period is None or board.period == period:
+                board.loaded_at = 0.0
+                board.generation += 1
+
+
+def get_top(period='all-time', offset=0, limit=10):
+    """
+    Get a page of the leaderboard.
+
+    Returns:
+        List of entry dictionaries (rank, user_id, points, username, badge, items_recycled)
+    """
+    board = _get_board(period)
+    with _lock:
+        page = board.index.page(offset, limit)
+    return _decorate(page)
+
+
+def get_user_standing(user_id, period='all-time', radius=2):
+    """
+    Get a user's rank on a board and the entries immediately around them.
+
+    Returns:
+        Dictionary with rank, points, total ranked users and neighbours
+    """
+    board = _get_board(period)
+    with _lock:
+        index = board.index
+        rank = index.rank(user_id)
+        points = index.score(user_id)
+        total = len(index)
+        neighbours = index.around(user_id, radius)
+
+    return {
+        'rank': rank,
+        'points': points or 0,
+        'total': total,
+        'neighbours': _decorate(neighbours)
+    }
+
+
+def _decorate(page):
+    """Attach display fields to [(rank, user_id, points)] with two batched queries"""
+    if not page:
+        return []
+
+    user_ids = [user_id for _, user_id, _ in page]
+    users = {
+        u.id: u for u in User.query.filter(User.id.in_(user_ids)).all()
+    }
+    item_counts = dict(
+        db.session.query(WasteItem.user_id, func.count(WasteItem.id)).filter(
+            WasteItem.user_id.in_(user_ids),
+            WasteItem.is_recyclable == True
+        ).group_by(WasteItem.user_id).all()
+    )
+
+    entries = []
+    for rank, user_id, points in page:
+        user = users.get(user_id)
+        entries.append({
+            'rank': rank,
+            'user_id': user_id,
+            'username': user.username if user else f'user_{user_id}',
+            'points': points,
+            'badge': (user.badge_level if user else None) or 'Bronze',
+            'items_recycled': item_counts.get(user_id, 0)
+        })
+    return entries
+
+
+def benchmark(n_users=1_000_000, n_ops=100_000, seed=42):
+    """
+    Benchmark the rank index at leaderboard scale (no database involved).
+
+    Args:
+        n_users: Number of ranked users to load
+        n_ops: Number of updates and lookups to time
+        seed: Random seed for reproducible runs
+    """
+    rng = random.Random(seed)
+    scores = {user_id: rng.randint(0, 50_000) for user_id in range(1, n_users + 1)}
+    index = RankIndex()
+
+    started = time.perf_counter()
+    index.load(scores)
+    print(f"load {n_users:,} users: {time.perf_counter() - started:.2f}s")
+
+    user_ids = [rng.randint(1, n_users) for _ in range(n_ops)]
+
+    started = time.perf_counter()
+    for user_id in user_ids:
+        index.add(user_id, rng.randint(1, 150))
+    elapsed = time.perf_counter() - started
+    print(f"{n_ops:,} incremental awards: {elapsed:.2f}s ({elapsed / n_ops * 1e6:.1f} us/op)")
+
+    started = time.perf_counter()
+    for user_id in user_ids:
+        index.rank(user_id)
+    elapsed = time.perf_counter() - started
+    print(f"{n_ops:,} rank lookups: {elapsed:.2f}s ({elapsed / n_ops * 1e6:.1f} us/op)")
+
+    started = time.perf_counter()
+    for user_id in user_ids[:10_000]:
+        index.around(user_id, 2)
+    elapsed = time.perf_counter() - started
+    print(f"10,000 rank+neighbour lookups: {elapsed / 10_000 * 1e6:.1f} us/op")
+
+    started = time.perf_counter()
+    for offset in range(0, 10_000 * 20, 20):
+        index.page(offset, 20)
+    elapsed = time.perf_counter() - started
+    print(f"10,000 top-K pages (K=20): {elapsed / 10_000 * 1e6:.1f} us/op")
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,254 @@
+"""
+Fork-free appends to ReGenWorks hash chains (project ledgers and waste journeys).
+
+Every entry carries a per-chain sequence number and (chain, seq) is unique,
+so two appends can never both extend the same tip. On PostgreSQL appends to a
+chain are serialised with a transaction-scoped advisory lock; on any database
+an append that loses the race on the unique index is retried on the new tip.
+The tip is found through that index (ORDER BY seq DESC LIMIT 1).
+"""
+
+import sys
+import json
+import time
+import logging
+import threading
+from datetime import datetime
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError, OperationalError
+from app import db
+from models import ProjectLedger, WasteJourneyBlock
+
+MAX_ATTEMPTS = 5
+
+
+def _lock_chain(chain_key):
+    """Serialise appends to one chain until the transaction ends (PostgreSQL only)"""
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"), {'key': chain_key})
+
+
+def _append(chain_key, build_entry):
+    """
+    Insert the entry returned by build_entry() inside a savepoint, retrying
+    on a fresh tip if another append took the same sequence number.
+    The caller's pending changes are kept; the caller commits.
+    """
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        _lock_chain(chain_key)
+        try:
+            with db.session.begin_nested():
+                entry = build_entry()
+                db.session.add(entry)
+            return entry
+        except IntegrityError:
+            if attempt == MAX_ATTEMPTS:
+                raise
+            logging.info(f"Concurrent append to {chain_key}; retrying on the new tip (attempt {attempt})")
+
+
+def get_project_tip(project_id):
+    """Latest entry of a project ledger (indexed on project_id, seq)"""
+    return ProjectLedger.query.filter(
+        ProjectLedger.project_id == project_id,
+        ProjectLedger.seq.isnot(None)
+    ).order_by(ProjectLedger.seq.desc()).first()
+
+
+def get_journey_tip(waste_item_id):
+    """Latest block of a waste item's journey (indexed on waste_item_id, seq)"""
+    return WasteJourneyBlock.query.filter(
+        WasteJourneyBlock.waste_item_id == waste_item_id,
+        WasteJourneyBlock.seq.isnot(None)
+    ).order_by(WasteJourneyBlock.seq.desc()).first()
+
+
+def append_project_entry(project_id, status, verified_by, batch_reference=None, block_data=None):
+    """
+    Append an entry to a project ledger.
+
+    Args:
+        project_id: Project UUID/ID
+        status: Entry status / action (allocated, anchor, ...)
+        verified_by: User/system that verified the entry
+        batch_reference: Batch ID the entry refers to
+        block_data: Hashed block payload; 'seq' is added to it
+
+    Returns:
+        The new ProjectLedger entry (flushed, not committed)
+    """
+    from blockchain_tracker import calculate_block_hash
+
+    def build_entry():
+        tip = get_project_tip(project_id)
+        previous_hash = tip.block_hash if tip else None
+
+        data = dict(block_data or {})
+        data['seq'] = tip.seq + 1 if tip else 1
+        data.setdefault('timestamp', datetime.utcnow().isoformat())
+
+        return ProjectLedger(
+            project_id=project_id,
+            seq=data['seq'],
+            status=status,
+            verified_by=verified_by,
+            batch_reference=batch_reference,
+            previous_hash=previous_hash,
+            block_hash=calculate_block_hash(data, previous_hash),
+            data=json.dumps(data),
+            timestamp=datetime.utcnow()
+        )
+
+    return _append(f"project_ledger:{project_id}", build_entry)
+
+
+def append_journey_block(waste_item_id, stage, location, details, verified_by, prepare=None):
+    """
+    Append a block to a waste item's journey.
+
+    Args:
+        waste_item_id: ID of the waste item
+        stage: Journey stage
+        location: Location where this stage occurred
+        details: Additional details about this stage
+        verified_by: Name or ID of entity verifying this stage
+        prepare: Optional callable(block) run before insert (e.g. mining)
+
+    Returns:
+        The new WasteJourneyBlock (flushed, not committed)
+    """
+    def build_entry():
+        tip = get_journey_tip(waste_item_id)
+        block = WasteJourneyBlock(
+            waste_item_id=waste_item_id,
+            stage=stage,
+            location=location,
+            details=details,
+            verified_by=verified_by,
+            previous_hash=tip.block_hash if tip else None
+        )
+        block.seq = tip.seq + 1 if tip else 1
+        if prepare:
+            prepare(block)
+        return block
+
+    return _append(f"waste_journey:{waste_item_id}", build_entry)
+
+
+def find_forks(entries):
+    """
+    Check a chain for forks and gaps.
+
+    Returns:
+        List of problem descriptions (empty if the chain is linear)
+    """
+    problems = []
+    seen_parents = {}
+    for i, entry in enumerate(entries):
+        if entry.seq != i + 1:
+            problems.append(f"entry {entry.id} has seq {entry.seq}, expected {i + 1}")
+        expected_parent = entries[i - 1].block_hash if i > 0 else None
+        if entry.previous_hash != expected_parent:
+            problems.append(f"entry {entry.id} does not extend the previous entry")
+        if entry.previous_hash in seen_parents:
+            problems.append(f"entries {seen_parents[entry.previous_hash]} and {entry.id} share a parent (fork)")
+        seen_parents[entry.previous_hash] = entry.id
+    return problems
+
+
+def stress_test(workers=8, appends_per_worker=25):
+    """
+    Append to one project ledger and one waste journey from parallel threads
+    and check that both chains come out linear, gap-free and fork-free.
+
+    Uses the configured database and deletes its rows afterwards; run against
+    PostgreSQL for a realistic result.
+    """
+    from app import app
+    from models import User, WasteItem, ChainCheckpoint
+
+    stamp = datetime.utcnow().strftime('%Y%m%d%H%M%S%f')
+    project_id = f'stress_{stamp}'
+
+    try:
+        with app.app_context():
+            user = User(username=project_id, email=f'{project_id}@example.com')
+            db.session.add(user)
+            db.session.flush()
+            item = WasteItem(user_id=user.id, image_path='stress-test.jpg', material='Plastic')
+            db.session.add(item)
+            db.session.commit()
+            waste_item_id = item.id
+
+        errors = []
+        barrier = threading.Barrier(workers)
+
+        def worker(worker_id):
+            with app.app_context():
+                barrier.wait()
+                for n in range(appends_per_worker):
+                    for append in (
+                        lambda: append_project_entry(project_id, 'allocated', f'worker_{worker_id}', f'batch_{worker_id}_{n}',
+                                                     {'project_id': project_id, 'action': 'allocated'}),
+                        lambda: append_journey_block(waste_item_id, 'collection', 'stress', f'{worker_id}/{n}', f'worker_{worker_id}')
+                    ):
+                        for attempt in range(20):
+                            try:
+                                append()
+                                db.session.commit()
+                                break
+                            except OperationalError:
+                                # SQLite allows one writer at a time; back off and retry
+                                db.session.rollback()
+                                time.sleep(0.02 * (attempt + 1))
+                            except Exception as e:
+                                db.session.rollback()
+                                errors.append(str(e))
+                                break
+                        else:
+                            errors.append('database stayed locked; append abandoned')
+                db.session.remove()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        with app.app_context():
+            ledger = ProjectLedger.query.filter_by(project_id=project_id).order_by(ProjectLedger.seq).all()
+            journey = WasteJourneyBlock.query.filter_by(waste_item_id=waste_item_id).order_by(WasteJourneyBlock.seq).all()
+            problems = find_forks(ledger) + find_forks(journey)
+    finally:
+        # Remove the test user, waste item and both chains from the store
+        with app.app_context():
+            db.session.rollback()
+            item_ids = [item_id for (item_id,) in db.session.query(WasteItem.id).join(
+                User, WasteItem.user_id == User.id
+            ).filter(User.username == project_id).all()]
+            WasteJourneyBlock.query.filter(WasteJourneyBlock.waste_item_id.in_(item_ids)).delete(synchronize_session=False)
+            ChainCheckpoint.query.filter(
+                ChainCheckpoint.chain_id.in_([project_id] + [str(item_id) for item_id in item_ids])
+            ).delete(synchronize_session=False)
+            WasteItem.query.filter(WasteItem.id.in_(item_ids)).delete(synchronize_session=False)
+            ProjectLedger.query.filter_by(project_id=project_id).delete(synchronize_session=False)
+            User.query.filter_by(username=project_id).delete(synchronize_session=False)
+            db.session.commit()
+
+    expected = workers * appends_per_worker
+    print(f"{workers} workers x {appends_per_worker} appends in {elapsed:.2f}s")
+    print(f"project ledger: {len(ledger)}/{expected} entries, waste journey: {len(journey)}/{expected} blocks")
+    for problem in problems[:10]:
+        print(f"  {problem}")
+    for error in errors[:5]:
+        print(f"  error: {error}")
+
+    ok = not problems and not errors and len(ledger) == expected and len(journey) == expected
+    print("OK: no forks" if ok else "FAIL")
+    return ok
+
+
+if __name__ == '__main__':
+    sys.exit(0 if stress_test() else 1)
@@ -0,0 +1,292 @@
+"""
+Whole-system audit of ReGenWorks hash chains (waste journeys and project ledgers).
+
+Every chain is streamed from the database with a server-side cursor in chain
+order, chains are verified across a process pool, and a JSON report lists each
+broken link, hash mismatch, invalid seal, sequence gap and fork found.
+Verification is pure hashing over plain row tuples, so workers never touch the
+database.
+
+Incremental runs only verify chains with an entry written or sealed since the
+previous run started (taken from the previous report); periodic full runs are
+still needed to catch in-place edits to old entries.
+"""
+
+import os
+import sys
+import json
+import logging
+import argparse
+import multiprocessing
+from types import SimpleNamespace
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from sqlalchemy import select, or_
+from app import db
+from models import WasteJourneyBlock, ProjectLedger
+from blockchain_tracker import calculate_block_hash
+
+WASTE_JOURNEY = 'waste_journey'
+PROJECT_LEDGER = 'project_ledger'
+
+# Kept in the app's instance folder (Flask's default instance_path), not the working directory
+DEFAULT_REPORT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'ledger_audit_report.json')
+
+# Rows fetched per round trip from the server-side cursor
+FETCH_SIZE = 2000
+
+# Chains sent to a worker per task
+CHAINS_PER_TASK = 200
+
+_JOURNEY_COLUMNS = (
+    WasteJourneyBlock.id, WasteJourneyBlock.seq, WasteJourneyBlock.waste_item_id,
+    WasteJourneyBlock.timestamp, WasteJourneyBlock.stage, WasteJourneyBlock.location,
+    WasteJourneyBlock.details, WasteJourneyBlock.verified_by, WasteJourneyBlock.previous_hash,
+    WasteJourneyBlock.block_hash, WasteJourneyBlock.nonce, WasteJourneyBlock.seal_nonce,
+    WasteJourneyBlock.seal_difficulty
+)
+
+_LEDGER_COLUMNS = (
+    ProjectLedger.id, ProjectLedger.seq, ProjectLedger.project_id, ProjectLedger.previous_hash,
+    ProjectLedger.block_hash, ProjectLedger.data
+)
+
+
+def _journey_entry_issues(row):
+    """Hash and seal problems of a single journey block row"""
+    block = SimpleNamespace(
+        waste_item_id=row[2], timestamp=row[3], stage=row[4], location=row[5], details=row[6],
+        verified_by=row[7], previous_hash=row[8], block_hash=row[9], nonce=row[10]
+    )
+    issues = []
+    if block.block_hash not in (WasteJourneyBlock.calculate_hash(block),
+                                WasteJourneyBlock.calculate_hash(block, legacy=True)):
+        issues.append(('hash_mismatch', 'stored hash does not match the block contents'))
+
+    seal_nonce, seal_difficulty = row[11], row[12] or 0
+    if seal_nonce is not None and \
+            WasteJourneyBlock.calculate_seal_hash(block, seal_nonce)[:seal_difficulty] != '0' * seal_difficulty:
+        issues.append(('bad_seal', f'seal nonce {seal_nonce} does not meet difficulty {seal_difficulty}'))
+    return issues
+
+
+def _ledger_entry_issues(row):
+    """Hash problems of a single project ledger row"""
+    try:
+        data = json.loads(row[5]) if row[5] else {}
+    except ValueError:
+        return [('hash_mismatch', 'entry data is not valid JSON')]
+
+    if calculate_block_hash(data, row[3]) != row[4]:
+        return [('hash_mismatch', 'stored hash does not match the entry data')]
+    return []
+
+
+def verify_chain(chain_type, chain_id, rows):
+    """
+    Verify one chain given its rows in chain order.
+
+    Rows start with (id, seq, ...) and carry previous_hash/block_hash at the
+    positions used by _JOURNEY_COLUMNS / _LEDGER_COLUMNS.
+
+    Returns:
+        List of issue dictionaries (empty if the chain is intact)
+    """
+    if chain_type == WASTE_JOURNEY:
+        entry_issues, prev_col, hash_col = _journey_entry_issues, 8, 9
+    else:
+        entry_issues, prev_col, hash_col = _ledger_entry_issues, 3, 4
+
+    issues = []
+
+    def report(row, kind, detail):
+        issues.append({
+            'chain_type': chain_type,
+            'chain_id': chain_id,
+            'entry_id': row[0],
+            'seq': row[1],
+            'kind': kind,
+            'detail': detail
+        })
+
+    children = {}
+    for i, row in enumerate(rows):
+        for kind, detail in entry_issues(row):
+            report(row, kind, detail)
+
+        expected_parent = rows[i - 1][hash_col] if i > 0 else None
+        if row[prev_col] != expected_parent:
+            report(row, 'broken_link', 'previous hash does not match the preceding entry')
+
+        if row[1] != i + 1:
+            report(row, 'sequence_gap', f'seq is {row[1]}, expected {i + 1}')
+
+        if row[prev_col] in children:
+            report(row, 'fork', f'shares its parent with entry {children[row[prev_col]]}')
+        else:
+            children[row[prev_col]] = row[0]
+
+    return issues
+
+
+def _init_worker():
+    # Drop the parent's pooled connections without closing them from this process
+    db.engine.dispose(close=False)
+
+
+def _verify_task(chain_type, chains):
+    """Worker entry point: verify a list of (chain_id, rows)"""
+    issues = []
+    entries = 0
+    for chain_id, rows in chains:
+        issues.extend(verify_chain(chain_type, chain_id, rows))
+        entries += len(rows)
+    return len(chains), entries, issues
+
+
+def _stream_chains(conn, chain_type, since=None):
+    """
+    Yield (chain_id, rows) for every chain, reading rows through a server-side
+    cursor ordered by chain, seq, id so only one chain is held at a time.
+    """
+    if chain_type == WASTE_JOURNEY:
+        model, key, columns = WasteJourneyBlock, WasteJourneyBlock.waste_item_id, _JOURNEY_COLUMNS
+    else:
+        model, key, columns = ProjectLedger, ProjectLedger.project_id, _LEDGER_COLUMNS
+
+    stmt = select(*columns).order_by(key, model.seq, model.id)
+    if since is not None:
+        touched = model.timestamp >= since
+        if model is WasteJourneyBlock:
+            touched = or_(touched, model.sealed_at >= since)
+        stmt = stmt.where(key.in_(select(key).where(touched).distinct()))
+
+    result = conn.execution_options(stream_results=True, yield_per=FETCH_SIZE).execute(stmt)
+
+    # The chain key is the third column of both row layouts
+    chain_id, rows = None, []
+    for row in result:
+        row = tuple(row)
+        if rows and row[2] != chain_id:
+            yield chain_id, rows
+            rows = []
+        chain_id = row[2]
+        rows.append(row)
+    if rows:
+        yield chain_id, rows
+
+
+def _tasks(chains):
+    task = []
+    for chain in chains:
+        task.append(chain)
+        if len(task) == CHAINS_PER_TASK:
+            yield task
+            task = []
+    if task:
+        yield task
+
+
+def run_audit(workers=None, since=None):
+    """
+    Verify every waste journey and project ledger (or only those touched since
+    a given time) across a process pool.
+
+    Args:
+        workers: Number of worker processes (defaults to the CPU count)
+        since: Only verify chains with an entry written or sealed at or after this datetime
+
+    Returns:
+        Report dictionary
+    """
+    workers = workers or os.cpu_count() or 1
+    started_at = datetime.utcnow()
+
+    report = {
+        'started_at': started_at.isoformat(),
+        'since': since.isoformat() if since else None,
+        'mode': 'incremental' if since else 'full',
+        'chains_checked': {WASTE_JOURNEY: 0, PROJECT_LEDGER: 0},
+        'entries_checked': {WASTE_JOURNEY: 0, PROJECT_LEDGER: 0},
+        'issues': []
+    }
+
+    # Forked workers inherit the loaded modules instead of re-importing the app
+    context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+
+    def collect(futures, chain_type):
+        for future in futures:
+            chains, entries, issues = future.result()
+            report['chains_checked'][chain_type] += chains
+            report['entries_checked'][chain_type] += entries
+            report['issues'].extend(issues)
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker) as executor:
+        for chain_type in (WASTE_JOURNEY, PROJECT_LEDGER):
+            with db.engine.connect() as conn:
+                pending = set()
+                for task in _tasks(_stream_chains(conn, chain_type, since)):
+                    # Bound the work in flight so memory stays flat on large tables
+                    if len(pending) >= workers * 2:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        collect(done, chain_type)
+                    pending.add(executor.submit(_verify_task, chain_type, task))
+                collect(pending, chain_type)
+
+    report['issues'].sort(key=lambda issue: (issue['chain_type'], str(issue['chain_id']), issue['seq'] or 0))
+    report['finished_at'] = datetime.utcnow().isoformat()
+    report['summary'] = {}
+    for issue in report['issues']:
+        report['summary'][issue['kind']] = report['summary'].get(issue['kind'], 0) + 1
+
+    logging.info(
+        f"Ledger audit ({report['mode']}): {report['chains_checked']} chains, "
+        f"{len(report['issues'])} issues"
+    )
+    return report
+
+
+def load_last_run(report_path):
+    """Start time of the audit that wrote report_path, or None if there is none"""
+    try:
+        with open(report_path) as f:
+            return datetime.fromisoformat(json.load(f)['started_at'])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def main(argv=None):
+    """Command line entry point for the ledger audit"""
+    parser = argparse.ArgumentParser(description='Verify every waste journey and project ledger chain')
+    parser.add_argument('--report', default=DEFAULT_REPORT_PATH, help='where to write the JSON report')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only verify chains touched since the run that wrote --report')
+    parser.add_argument('--since', help='only verify chains touched since this ISO timestamp')
+    args = parser.parse_args(argv)
+
+    since = datetime.fromisoformat(args.since) if args.since else None
+    if args.incremental and since is None:
+        since = load_last_run(args.report)
+        if since is None:
+            print(f"No previous report at {args.report}; running a full audit")
+
+    from app import app
+    with app.app_context():
+        report = run_audit(workers=args.workers, since=since)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.report)), exist_ok=True)
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+
+    for issue in report['issues'][:20]:
+        print(f"{issue['chain_type']} {issue['chain_id']} entry {issue['entry_id']}: {issue['kind']} ({issue['detail']})")
+    print(f"{report['mode']} audit: {report['chains_checked'][WASTE_JOURNEY]} waste journeys, "
+          f"{report['chains_checked'][PROJECT_LEDGER]} project ledgers, {len(report['issues'])} issues; "
+          f"report written to {args.report}")
+
+    return 1 if report['issues'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,423 @@
+"""
+Reconciliation of the SQL project ledger with its Firestore copy.
+
+Each project's entries are split into fixed ranges of sequence numbers and
+every range is summarised by a digest over its (seq, block_hash) pairs. The
+project's digest over all ranges is kept on the ledger/<project_id> document and
+the range digests under ledger/<project_id>/digests, written only once a range
+is known to match. A run compares the project digest and a server-side count of
+the project's documents first (a few reads when nothing changed). If either
+differs it compares the range digests and per-range counts. Only the
+entries of ranges that differ are fetched and diffed. Documents edited in
+place in Firestore keep their count, so periodic deep runs fetch every range.
+
+Repairs run in bulk:
+- Entries missing from Firestore, or whose hash differs, are rewritten from
+  SQL. SQL is the source of truth.
+- Entries only in Firestore are restored to SQL when their hash verifies and
+  their sequence slot is free.
+- Duplicate documents for a sequence number are removed.
+Documents without a seq (written before the outbox sync) are outside these
+ranges and are not reconciled.
+"""
+
+import sys
+import json
+import hashlib
+import logging
+import argparse
+from datetime import datetime
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from app import db
+from models import ProjectLedger
+from blockchain_tracker import calculate_block_hash
+import firestore_sync
+
+# Sequence numbers per digest range
+RANGE_SIZE = 256
+
+
+def _range_digest(pairs):
+    """Digest of an ordered list of (seq, block_hash)"""
+    digest = hashlib.sha256()
+    for seq, block_hash in pairs:
+        digest.update(f"{seq}:{block_hash}\n".encode())
+    return digest.hexdigest()
+
+
+def _project_digest(range_digests):
+    """Digest over all range digests, in range order"""
+    return _range_digest(sorted(range_digests.items()))
+
+
+def _sql_ranges(project_id):
+    """{range index: [(seq, block_hash, id), ...]} from the SQL ledger"""
+    ranges = {}
+    for entry_id, seq, block_hash in db.session.query(
+        ProjectLedger.id, ProjectLedger.seq, ProjectLedger.block_hash
+    ).filter(
+        ProjectLedger.project_id == project_id,
+        ProjectLedger.seq.isnot(None)
+    ).order_by(ProjectLedger.seq):
+        ranges.setdefault(seq // RANGE_SIZE, []).append((seq, block_hash, entry_id))
+    return ranges
+
+
+def _digests(ranges):
+    return {index: _range_digest((seq, block_hash) for seq, block_hash, _ in rows)
+            for index, rows in ranges.items()}
+
+
+def _restore_entry(project_id, doc):
+    """
+    Rebuild a SQL ledger entry from a Firestore document, if its hash verifies.
+
+    Returns:
+        True if the entry was added to the session
+    """
+    raw_data = doc.get('data')
+    try:
+        data = json.loads(raw_data) if raw_data else {}
+    except (TypeError, ValueError):
+        return False
+    if calculate_block_hash(data, doc.get('previous_hash')) != doc.get('block_hash'):
+        return False
+
+    timestamp = doc.get('timestamp')
+    if not isinstance(timestamp, datetime):
+        timestamp = None
+    elif timestamp.tzinfo is not None:
+        timestamp = timestamp.replace(tzinfo=None)  # Firestore returns aware UTC datetimes
+
+    try:
+        with db.session.begin_nested():
+            db.session.add(ProjectLedger(
+                project_id=project_id,
+                seq=doc['seq'],
+                status=doc.get('status') or 'restored',
+                verified_by=doc.get('verified_by'),
+                batch_reference=doc.get('batch_id') or None,
+                previous_hash=doc.get('previous_hash'),
+                block_hash=doc['block_hash'],
+                data=raw_data,
+                firestore_synced=True,
+                timestamp=timestamp or datetime.utcnow()
+            ))
+        return True
+    except IntegrityError:
+        return False  # The sequence slot was taken meanwhile
+
+
+def _count(query):
+    """Server-side count aggregation (billed per 1000 index entries, not per document)"""
+    return query.count().get()[0][0].value
+
+
+def reconcile_project(project_id, client=None, repair=True, deep=False):
+    """
+    Compare (and optionally repair) one project's SQL and Firestore ledgers.
+
+    Args:
+        project_id: Project UUID/ID
+        client: Firestore client (defaults to the configured one)
+        repair: Write the missing side; otherwise only report
+        deep: Fetch every range, ignoring stored digests (catches documents
+            edited in place in Firestore)
+
+    Returns:
+        Result dictionary with ranges_checked, ranges_fetched and lists of
+        missing_in_firestore, missing_in_sql, conflicts and unrecoverable seqs
+    """
+    if client is None:
+        if not firestore_sync.initialize_firestore():
+            raise RuntimeError("Firestore is not configured")
+        client = firestore_sync._firestore_client
+
+    result = {
+        'project_id': project_id,
+        'in_sync': False,
+        'ranges_checked': 0,
+        'ranges_fetched': 0,
+        'missing_in_firestore': [],
+        'missing_in_sql': [],
+        'conflicts': [],
+        'duplicates': 0,
+        'unrecoverable': []
+    }
+
+    ranges = _sql_ranges(project_id)
+    digests = _digests(ranges)
+    sql_total = sum(len(rows) for rows in ranges.values())
+    project_ref = client.collection('ledger').document(project_id)
+    entries_ref = project_ref.collection('entries')
+
+    stored = {}
+    if not deep:
+        snapshot = project_ref.get()
+        stored = snapshot.to_dict() if snapshot.exists else {}
+    same_layout = stored.get('range_size') == RANGE_SIZE
+
+    # Digests catch changes on the SQL side; counts catch missing or duplicate documents
+    firestore_total = _count(entries_ref.where('seq', '>=', 0))
+    if same_layout and stored.get('digest') == _project_digest(digests) and firestore_total == sql_total:
+        result['in_sync'] = True
+        return result
+
+    stored_digests = {}
+    if same_layout:
+        stored_digests = {int(doc.id): doc.to_dict().get('digest')
+                          for doc in project_ref.collection('digests').stream()}
+
+    candidates = set(digests) | set(stored_digests)
+    if firestore_total > sql_total:
+        # Documents may sit past the end of the SQL ledger
+        last = list(entries_ref.order_by('seq', direction='DESCENDING').limit(1).stream())
+        if last:
+            candidates |= set(range(last[0].to_dict()['seq'] // RANGE_SIZE + 1))
+
+    mismatched = []
+    for index in sorted(candidates):
+        if deep or digests.get(index) != stored_digests.get(index):
+            mismatched.append(index)
+        elif _count(entries_ref.where('seq', '>=', index * RANGE_SIZE)
+                    .where('seq', '<', (index + 1) * RANGE_SIZE)) != len(ranges.get(index, [])):
+            mismatched.append(index)
+    result['ranges_checked'] = len(candidates)
+
+    writes = []
+    entries_to_write = []
+    restored = False
+    settled = set()
+
+    for index in mismatched:
+        low, high = index * RANGE_SIZE, (index + 1) * RANGE_SIZE
+        docs = {}
+        duplicates = []
+        for doc in entries_ref.where('seq', '>=', low).where('seq', '<', high).stream():
+            data = doc.to_dict()
+            if data.get('seq') in docs:
+                duplicates.append((doc, data))
+            else:
+                docs[data.get('seq')] = (doc, data)
+        result['ranges_fetched'] += 1
+
+        sql_rows = {seq: (block_hash, entry_id) for seq, block_hash, entry_id in ranges.get(index, [])}
+        range_clean = True
+
+        for doc, data in duplicates:
+            seq = data.get('seq')
+            sql_hash = sql_rows.get(seq, (None,))[0]
+            if data.get('block_hash') == sql_hash and docs[seq][1].get('block_hash') != sql_hash:
+                docs[seq], doc = (doc, data), docs[seq][0]  # Keep the copy that matches SQL
+            result['duplicates'] += 1
+            writes.append((doc.reference, None))
+
+        for seq, (block_hash, entry_id) in sql_rows.items():
+            if seq not in docs:
+                result['missing_in_firestore'].append(seq)
+                entries_to_write.append((entry_id, None))
+            elif docs[seq][1].get('block_hash') != block_hash:
+                result['conflicts'].append(seq)
+                entries_to_write.append((entry_id, docs[seq][0].reference))
+
+        for seq, (doc, data) in docs.items():
+            if seq in sql_rows:
+                continue
+            result['missing_in_sql'].append(seq)
+            if not repair:
+                range_clean = False
+            elif _restore_entry(project_id, data):
+                restored = True
+            else:
+                result['unrecoverable'].append(seq)
+                range_clean = False
+
+        if range_clean:
+            settled.add(index)
+
+    if not repair:
+        return result
+
+    # Rewrite entries from SQL; conflicting documents under another ID are replaced
+    if entries_to_write:
+        entries = {e.id: e for e in ProjectLedger.query.filter(
+            ProjectLedger.id.in_([entry_id for entry_id, _ in entries_to_write])
+        )}
+        for entry_id, stale_ref in entries_to_write:
+            _, document_id, data = firestore_sync.ledger_document(entries[entry_id])
+            ref = firestore_sync.ledger_entry_ref(client, project_id, document_id)
+            if stale_ref is not None and stale_ref.id != document_id:
+                writes.append((stale_ref, None))
+            writes.append((ref, data))
+
+    if restored:
+        db.session.commit()
+        ranges = _sql_ranges(project_id)
+        digests = _digests(ranges)
+
+    if not firestore_sync.commit_writes(client, writes):
+        return result
+    if writes:
+        # Repairs can touch entries older than a cached page's tip
+        firestore_sync.invalidate_ledger_cache(project_id, full=True)
+
+    # Every entry of a settled range is now in Firestore
+    settled_ids = [entry_id for index in settled for _, _, entry_id in ranges.get(index, [])]
+    if settled_ids:
+        db.session.execute(
+            update(ProjectLedger.__table__).where(
+                ProjectLedger.__table__.c.id.in_(settled_ids),
+                ProjectLedger.__table__.c.firestore_synced.isnot(True)
+            ).values(firestore_synced=True)
+        )
+        db.session.commit()
+
+    digest_writes = []
+    for index in settled:
+        ref = project_ref.collection('digests').document(str(index))
+        if index in digests:
+            digest_writes.append((ref, {'start_seq': index * RANGE_SIZE, 'count': len(ranges[index]),
+                                        'digest': digests[index]}))
+        else:
+            digest_writes.append((ref, None))
+    if settled >= set(mismatched):
+        # Every range now matches, so the project digest can be stored
+        digest_writes.append((project_ref, {
+            'range_size': RANGE_SIZE,
+            'count': sum(len(rows) for rows in ranges.values()),
+            'digest': _project_digest(digests),
+            'reconciled_at': datetime.utcnow()
+        }))
+    firestore_sync.commit_writes(client, digest_writes)
+
+    result['in_sync'] = not result['unrecoverable']
+    return result
+
+
+def reconcile_all(client=None, repair=True, deep=False):
+    """
+    Reconcile every project that has SQL ledger entries.
+
+    Returns:
+        List of per-project results that were not already in sync
+    """
+    project_ids = [project_id for (project_id,) in db.session.query(ProjectLedger.project_id).distinct()]
+    results = []
+    for project_id in project_ids:
+        try:
+            result = reconcile_project(project_id, client=client, repair=repair, deep=deep)
+        except Exception as e:
+            logging.error(f"Error reconciling ledger for project {project_id}: {e}")
+            db.session.rollback()
+            continue
+        if result['ranges_fetched'] or not result['in_sync']:
+            results.append(result)
+    logging.info(f"Reconciled {len(project_ids)} project ledgers; {len(results)} had differences")
+    return results
+
+
+def self_test(n_entries=2000):
+    """
+    Diverge a generated ledger from an InMemoryFirestore copy, reconcile, and
+    check that only the affected ranges are fetched, both sides end up equal
+    and a clean run fetches no entries. The generated rows are deleted
+    afterwards.
+    """
+    from app import app
+    from models import ChainCheckpoint
+    from ledger_append import append_project_entry
+
+    if n_entries < 40:
+        raise ValueError("self_test needs at least 40 entries")
+
+    # Seq 10 goes missing in Firestore and the last seq in SQL; one entry is
+    # duplicated and another edited further along the chain
+    duplicated, edited = n_entries * 3 // 4, n_entries * 7 // 20
+    diverged_ranges = len({10 // RANGE_SIZE, duplicated // RANGE_SIZE, n_entries // RANGE_SIZE})
+
+    project_id = f"reconcile_{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}"
+    fake = firestore_sync.InMemoryFirestore()
+
+    def run(label, **kwargs):
+        fake.reads = 0
+        result = reconcile_project(project_id, client=fake, **kwargs)
+        print(f"{label}: fetched {result['ranges_fetched']}/{result['ranges_checked']} ranges in {fake.reads} reads; "
+              f"missing_in_firestore={result['missing_in_firestore']} missing_in_sql={result['missing_in_sql']} "
+              f"conflicts={result['conflicts']} duplicates={result['duplicates']}")
+        return result
+
+    try:
+        with app.app_context():
+            for n in range(n_entries):
+                append_project_entry(project_id, 'allocated', 'system', f'batch_{n}',
+                                     {'project_id': project_id, 'metadata': {'weight': n}})
+            db.session.commit()
+            firestore_sync.sync_pending_entries(client=fake, project_id=project_id)
+            run("initial")
+
+            entries = fake.collection('ledger').document(project_id).collection('entries')
+            docs = {snap.to_dict()['seq']: snap for snap in entries.stream()}
+            docs[10].reference.delete()                                    # missing in Firestore
+            entries.document('duplicate').set(docs[duplicated].to_dict())  # duplicate document
+            db.session.delete(ProjectLedger.query.filter_by(project_id=project_id, seq=n_entries).one())
+            db.session.commit()                                            # missing in SQL
+
+            diverged = run("diverged")
+            clean = run("clean")
+
+            docs[edited].reference.set(dict(docs[edited].to_dict(), block_hash='0' * 64))  # edited in place
+            missed = run("edited, quick")
+            deep = run("edited, deep", deep=True)
+
+            sql_count = ProjectLedger.query.filter_by(project_id=project_id).count()
+            fs_count = sum(1 for _ in entries.stream())
+            print(f"sql={sql_count} firestore={fs_count}")
+    finally:
+        # The rows are only synced to the fake; a real reconcile would push them to Firestore
+        with app.app_context():
+            db.session.rollback()
+            ProjectLedger.query.filter_by(project_id=project_id).delete(synchronize_session=False)
+            ChainCheckpoint.query.filter_by(chain_id=project_id).delete(synchronize_session=False)
+            db.session.commit()
+
+    ok = (diverged['missing_in_firestore'] == [10] and diverged['missing_in_sql'] == [n_entries]
+          and diverged['duplicates'] == 1 and diverged['ranges_fetched'] == diverged_ranges
+          and clean['in_sync'] and clean['ranges_fetched'] == 0
+          and missed['in_sync'] and deep['conflicts'] == [edited]
+          and sql_count == fs_count == n_entries)
+    print("OK" if ok else "FAIL")
+    return ok
+
+
+def main(argv=None):
+    """Command line entry point for ledger reconciliation"""
+    parser = argparse.ArgumentParser(description='Reconcile the SQL project ledger with Firestore')
+    parser.add_argument('project_ids', nargs='*', help='projects to reconcile (default: all)')
+    parser.add_argument('--dry-run', action='store_true', help='report differences without repairing')
+    parser.add_argument('--deep', action='store_true', help='fetch every range instead of trusting stored digests')
+    parser.add_argument('--self-test', action='store_true', help='run against an in-process Firestore fake')
+    args = parser.parse_args(argv)
+
+    if args.self_test:
+        return 0 if self_test() else 1
+
+    from app import app
+    with app.app_context():
+        if args.project_ids:
+            results = [reconcile_project(project_id, repair=not args.dry_run, deep=args.deep)
+                       for project_id in args.project_ids]
+        else:
+            results = reconcile_all(repair=not args.dry_run, deep=args.deep)
+
+    for result in results:
+        print(f"{result['project_id']}: fetched {result['ranges_fetched']}/{result['ranges_checked']} ranges, "
+              f"{len(result['missing_in_firestore'])} missing in Firestore, "
+              f"{len(result['missing_in_sql'])} missing in SQL, {len(result['conflicts'])} conflicts, "
+              f"{result['duplicates']} duplicates, {len(result['unrecoverable'])} unrecoverable")
+
+    return 1 if any(not r['in_sync'] for r in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,430 @@
+"""
+Binary locale catalog shared between worker processes.
+
+`python locale_catalog.py` compiles every locales/*.json file into one file
+(locales/catalog.bin by default, or LOCALE_CATALOG_PATH). Workers memory-map
+it read-only, so all gunicorn workers share one copy of the translations in
+the page cache, and starting a worker parses no JSON.
+
+Layout (little-endian uint32 unless noted):
+
+    header      magic, version, language count, source stamp digest (16 bytes),
+                key count, slot count, fallback language, section offsets
+    languages   (offset, length) of each language code
+    keys        (offset, length) of each key
+    slots       open-addressing hash index: key number + 1, or 0 for empty;
+                a key starts probing at crc32(key) & (slot count - 1)
+    values      (offset, length) per language and key, with the fallback
+                language already filled in; length NO_VALUE when neither has it
+    strings     UTF-8 string table; equal strings are stored once
+
+The header records a digest of the source files' names, sizes and mtimes, so
+a stale catalog is detected with a few stat() calls.
+
+Only this module's standard library imports are needed to build the catalog,
+so the build step runs without the app or a database.
+"""
+
+import os
+import sys
+import json
+import mmap
+import time
+import zlib
+import struct
+import hashlib
+import logging
+import argparse
+from array import array
+from pathlib import Path
+from collections.abc import Mapping
+
+logger = logging.getLogger(__name__)
+
+FALLBACK_LANGUAGE = 'en'
+
+MAGIC = b'RGWLOCS\x00'
+VERSION = 1
+
+HEADER = struct.Struct('<8sII16sIIIIIII')
+
+# Value length of a key with no translation
+NO_VALUE = 0xFFFFFFFF
+
+# Marks a key that has no translation
+MISSING = object()
+
+
+def locales_dir():
+    """Directory holding the <language>.json files (src/locales if present)"""
+    src_locales_dir = Path('src/locales')
+    return src_locales_dir if src_locales_dir.exists() else Path('locales')
+
+
+def catalog_path(directory=None):
+    """Where the compiled catalog for a locale directory is kept"""
+    path = os.environ.get('LOCALE_CATALOG_PATH')
+    if path:
+        return Path(path)
+    return (Path(directory) if directory is not None else locales_dir()) / 'catalog.bin'
+
+
+def _locale_files(directory):
+    return sorted(Path(directory).glob('*.json'))
+
+
+def source_stamp(directory):
+    """Names, sizes and modification times of the locale files"""
+    stamp = []
+    for path in _locale_files(directory):
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        stamp.append((path.name, stat.st_mtime_ns, stat.st_size))
+    return tuple(stamp)
+
+
+def stamp_digest(stamp):
+    return hashlib.blake2b(repr(stamp).encode('utf-8'), digest_size=16).digest()
+
+
+def _flatten(translations, prefix=''):
+    """Nested {"nav": {"scan": ...}} objects as dotted keys ("nav.scan")"""
+    flat = {}
+    for key, value in translations.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f'{prefix}{key}.'))
+        else:
+            flat[f'{prefix}{key}'] = value if isinstance(value, str) else str(value)
+    return flat
+
+
+def load_sources(directory=None):
+    """
+    Parse the locale files of a directory.
+
+    Args:
+        directory: Locale directory (locales_dir() if None)
+
+    Returns:
+        Dictionary of language code to flat {key: translation}; files that
+        cannot be parsed are left out
+    """
+    directory = Path(directory) if directory is not None else locales_dir()
+    sources = {}
+    for path in _locale_files(directory):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                sources[path.stem] = _flatten(json.load(f))
+        except Exception as e:
+            logger.error(f"Error loading translations from {path}: {e}")
+    return sources
+
+
+def _slot_count(n_keys):
+    slots = 8
+    while slots < 2 * n_keys:
+        slots *= 2
+    return slots
+
+
+def encode_catalog(sources, stamp=()):
+    """
+    Encode translations in the binary catalog format.
+
+    Args:
+        sources: Dictionary of language code to flat {key: translation}
+        stamp: source_stamp() of the files the translations came from
+
+    Returns:
+        bytes
+    """
+    languages = sorted(sources)
+    fallback = sources.get(FALLBACK_LANGUAGE, {})
+    keys = sorted({key for translations in sources.values() for key in translations})
+    n_slots = _slot_count(len(keys))
+
+    # Offsets are relative to the string table until the sections are sized
+    strings = bytearray()
+    string_offsets = {}
+
+    def intern(text):
+        encoded = text.encode('utf-8')
+        if encoded not in string_offsets:
+            string_offsets[encoded] = len(strings)
+            strings.extend(encoded)
+        return string_offsets[encoded], len(encoded)
+
+    language_entries = [intern(language) for language in languages]
+    key_entries = [intern(key) for key in keys]
+
+    slots = array('I', [0]) * n_slots
+    for number, key in enumerate(keys):
+        slot = zlib.crc32(key.encode('utf-8')) & (n_slots - 1)
+        while slots[slot]:
+            slot = (slot + 1) & (n_slots - 1)
+        slots[slot] = number + 1
+
+    value_entries = []
+    for language in languages:
+        translations = sources[language]
+        for key in keys:
+            value = translations.get(key, fallback.get(key))
+            value_entries.append(intern(value) if value is not None else None)
+
+    languages_offset = HEADER.size
+    keys_offset = languages_offset + 8 * len(languages)
+    slots_offset = keys_offset + 8 * len(keys)
+    values_offset = slots_offset + 4 * n_slots
+    strings_offset = values_offset + 8 * len(value_entries)
+
+    def pairs(entries):
+        flat = array('I')
+        for entry in entries:
+            if entry is None:
+                flat.extend((0, NO_VALUE))
+            else:
+                flat.extend((strings_offset + entry[0], entry[1]))
+        return flat
+
+    sections = [pairs(language_entries), pairs(key_entries), slots, pairs(value_entries)]
+    if sys.byteorder != 'little':
+        for section in sections:
+            section.byteswap()
+
+    header = HEADER.pack(
+        MAGIC, VERSION, len(languages), stamp_digest(stamp), len(keys), n_slots,
+        languages.index(FALLBACK_LANGUAGE) if FALLBACK_LANGUAGE in languages else NO_VALUE,
+        languages_offset, keys_offset, slots_offset, values_offset
+    )
+    return b''.join([header] + [section.tobytes() for section in sections] + [bytes(strings)])
+
+
+def build_catalog(directory=None, output=None):
+    """
+    Compile a locale directory into a catalog file, replacing it atomically.
+
+    Args:
+        directory: Locale directory (locales_dir() if None)
+        output: Catalog path (catalog_path() if None)
+
+    Returns:
+        Path of the catalog
+    """
+    directory = Path(directory) if directory is not None else locales_dir()
+    output = Path(output) if output is not None else catalog_path(directory)
+
+    stamp = source_stamp(directory)
+    data = encode_catalog(load_sources(directory), stamp)
+
+    temporary = output.with_name(f'{output.name}.{os.getpid()}.tmp')
+    try:
+        with open(temporary, 'wb') as f:
+            f.write(data)
+        os.replace(temporary, output)
+    finally:
+        if temporary.exists():
+            temporary.unlink()
+    return output
+
+
+def _u32_section(buffer, offset, count):
+    """uint32 array view of part of the file (a copy on big-endian machines)"""
+    view = memoryview(buffer)[offset:offset + 4 * count]
+    if sys.byteorder == 'little':
+        return view.cast('I')
+    values = array('I', view.tobytes())
+    values.byteswap()
+    return values
+
+
+class MappedLanguage(Mapping):
+    """Read-only translations of one language, read from the mapped catalog"""
+
+    def __init__(self, catalog, index):
+        self._catalog = catalog
+        self._index = index
+        # Decoded strings this process has used, so repeat lookups are one dict access
+        self._decoded = {}
+
+    def get(self, key, default=None):
+        value = self._decoded.get(key)
+        if value is None:
+            value = self._catalog._resolve(self._index, key)
+            if value is MISSING:
+                return default
+            self._decoded[key] = value
+        return value
+
+    def __getitem__(self, key):
+        value = self.get(key, MISSING)
+        if value is MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, MISSING) is not MISSING
+
+    def __iter__(self):
+        return (key for number, key in enumerate(self._catalog.keys())
+                if self._catalog._values[2 * (self._index * self._catalog.key_count + number) + 1] != NO_VALUE)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class MappedCatalog:
+    """A compiled catalog file, memory-mapped read-only"""
+
+    def __init__(self, path):
+        """
+        Args:
+            path: Catalog file written by build_catalog()
+
+        Raises:
+            OSError: The file cannot be opened
+            ValueError: The file is not a catalog of this version
+        """
+        with open(path, 'rb') as f:
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._buffer) < HEADER.size:
+            raise ValueError(f"{path} is not a locale catalog")
+
+        (magic, version, n_languages, self.stamp_digest, self.key_count, self._slot_count, fallback,
+         languages_offset, keys_offset, slots_offset, values_offset) = HEADER.unpack_from(self._buffer)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} locale catalog")
+
+        self._keys = _u32_section(self._buffer, keys_offset, 2 * self.key_count)
+        self._slots = _u32_section(self._buffer, slots_offset, self._slot_count)
+        self._values = _u32_section(self._buffer, values_offset, 2 * n_languages * self.key_count)
+
+        codes = _u32_section(self._buffer, languages_offset, 2 * n_languages)
+        self.languages = tuple(self._string(codes[2 * i], codes[2 * i + 1]) for i in range(n_languages))
+        self.strings = {language: MappedLanguage(self, i) for i, language in enumerate(self.languages)}
+        self.fallback = self.strings[self.languages[fallback]] if fallback != NO_VALUE else {}
+
+    def _string(self, offset, length):
+        return str(self._buffer[offset:offset + length], 'utf-8')
+
+    def keys(self):
+        """Every key in the catalog, in index order"""
+        return [self._string(self._keys[2 * i], self._keys[2 * i + 1]) for i in range(self.key_count)]
+
+    def _resolve(self, language_index, key):
+        encoded = key.encode('utf-8')
+        mask = self._slot_count - 1
+        slot = zlib.crc32(encoded) & mask
+        while True:
+            entry = self._slots[slot]
+            if not entry:
+                return MISSING
+            number = entry - 1
+            offset, length = self._keys[2 * number], self._keys[2 * number + 1]
+            if length == len(encoded) and self._buffer[offset:offset + length] == encoded:
+                break
+            slot = (slot + 1) & mask
+
+        position = 2 * (language_index * self.key_count + number)
+        length = self._values[position + 1]
+        if length == NO_VALUE:
+            return MISSING
+        return self._string(self._values[position], length)
+
+    def lookup(self, language):
+        """Translations for a language, the fallback language for an unknown one"""
+        return self.strings.get(language, self.fallback)
+
+
+def open_catalog(directory=None, stamp=None):
+    """
+    Map the compiled catalog of a locale directory, building it if it is
+    missing or older than the locale files.
+
+    Args:
+        directory: Locale directory (locales_dir() if None)
+        stamp: source_stamp() of the directory, if already taken
+
+    Returns:
+        MappedCatalog
+
+    Raises:
+        OSError: The catalog is stale and cannot be written
+    """
+    directory = Path(directory) if directory is not None else locales_dir()
+    path = catalog_path(directory)
+    digest = stamp_digest(stamp if stamp is not None else source_stamp(directory))
+    try:
+        catalog = MappedCatalog(path)
+        if catalog.stamp_digest == digest:
+            return catalog
+    except (OSError, ValueError):
+        pass
+
+    build_catalog(directory, path)
+    return MappedCatalog(path)
+
+
+# ============================================================================
+# BENCHMARK
+# ============================================================================
+
+def benchmark(rounds=200):
+    """Compare parsing the JSON files with mapping the catalog, and check every lookup agrees"""
+    directory = locales_dir()
+    path = build_catalog(directory)
+
+    started = time.perf_counter()
+    sources = load_sources(directory)
+    parse_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    catalog = MappedCatalog(path)
+    map_time = time.perf_counter() - started
+
+    fallback = sources.get(FALLBACK_LANGUAGE, {})
+    keys = sorted({key for translations in sources.values() for key in translations})
+    ok = catalog.languages == tuple(sorted(sources))
+    for language, translations in sources.items():
+        mapped = catalog.lookup(language)
+        ok = ok and all(mapped.get(key) == translations.get(key, fallback.get(key)) for key in keys)
+        ok = ok and mapped.get('missing.key') is None and dict(mapped) == {**fallback, **translations}
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for language in catalog.languages:
+            mapped = catalog.lookup(language)
+            for key in keys:
+                mapped.get(key)
+    lookups = rounds * len(catalog.languages) * len(keys)
+    lookup_time = time.perf_counter() - started
+
+    print(f"{len(sources)} languages, {len(keys)} keys, catalog {path.stat().st_size / 1024:.0f} KiB")
+    print(f"parse JSON files: {parse_time * 1e3:.1f} ms per worker")
+    print(f"map catalog:      {map_time * 1e3:.1f} ms per worker")
+    print(f"lookups: {lookups / lookup_time:,.0f}/s after first use")
+    print("OK: every lookup matches the JSON files" if ok else "FAIL: lookups differ")
+    return ok
+
+
+def main(argv=None):
+    """Command line entry point: compile the locale files into the binary catalog"""
+    parser = argparse.ArgumentParser(description='Compile locales/*.json into a memory-mappable catalog')
+    parser.add_argument('--locales', help='locale directory (default: src/locales or locales)')
+    parser.add_argument('--output', help='catalog path (default: LOCALE_CATALOG_PATH or <locales>/catalog.bin)')
+    parser.add_argument('--benchmark', action='store_true', help='compare with parsing the JSON files')
+    args = parser.parse_args(argv)
+
+    if args.benchmark:
+        return 0 if benchmark() else 1
+
+    path = build_catalog(args.locales, args.output)
+    catalog = MappedCatalog(path)
+    print(f"Wrote {path}: {len(catalog.languages)} languages, {catalog.key_count} keys, "
+          f"{path.stat().st_size / 1024:.0f} KiB")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
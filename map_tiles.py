@@ -0,0 +1,418 @@
+"""
+Map tile data service for ReGenWorks.
+
+The infrastructure report and project maps load their markers tile by tile,
+using the z/x/y web-mercator scheme that OpenLayers requests. Rows are no
+longer rendered into the page. Each tile is clustered on a grid inside the
+database: points fall into CELLS_PER_SIDE x CELLS_PER_SIDE cells, and a cell
+holding more than one point comes back as a single cluster feature with a
+count. A tile costs the same whether it covers ten reports or fifty thousand.
+From CLUSTER_MAX_ZOOM on, points are returned individually.
+
+Tiles are compact GeoJSON. They are cached per process, keyed by layer,
+z/x/y and filters. Committing a change to a report or project drops the tiles
+that contain it, at every zoom level. TILE_CACHE_TTL_SECONDS bounds how stale
+another worker process's copy can get.
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import threading
+from collections import OrderedDict
+from sqlalchemy import event, func, case, cast, Integer, inspect
+from sqlalchemy.orm import Session
+from app import db
+from models import InfrastructureReport, InfrastructureProject
+from infrastructure_service import SEVERITY_LEVELS
+
+REPORTS = 'reports'
+PROJECTS = 'projects'
+
+# Grid cells per tile side (64px cells on a 256px tile)
+CELLS_PER_SIDE = 4
+
+# From this zoom on, every point is its own feature
+CLUSTER_MAX_ZOOM = 16
+MAX_ZOOM = 22
+
+# Safety cap on individual points in one unclustered tile
+MAX_POINTS_PER_TILE = 2000
+
+TILE_CACHE_TTL_SECONDS = int(os.environ.get('MAP_TILE_CACHE_TTL_SECONDS', '300'))
+TILE_CACHE_SIZE = int(os.environ.get('MAP_TILE_CACHE_SIZE', '4096'))
+
+# Web mercator stops at about +/-85.05 degrees latitude
+MAX_LATITUDE = 85.05112878
+
+_SEVERITY_ORDER = list(SEVERITY_LEVELS)
+
+
+# ============================================================================
+# TILE GEOMETRY
+# ============================================================================
+
+def tile_bounds(z, x, y):
+    """(west, south, east, north) in degrees of web-mercator tile z/x/y"""
+    n = 2 ** z
+
+    def latitude(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return x / n * 360.0 - 180.0, latitude(y + 1), (x + 1) / n * 360.0 - 180.0, latitude(y)
+
+
+def tile_for(lat, lng, z):
+    """(x, y) of the tile at zoom z that contains a point"""
+    n = 2 ** z
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    x = int((lng + 180.0) / 360.0 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def is_valid_tile(z, x, y):
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def _cell_index(expr):
+    """Floor of a non-negative expression (CAST truncates on SQLite, rounds on PostgreSQL)"""
+    if db.engine.dialect.name == 'sqlite':
+        return cast(expr, Integer)
+    return cast(func.floor(expr), Integer)
+
+
+# ============================================================================
+# LAYERS
+# ============================================================================
+
+def _report_layer(filters):
+    """Query, coordinate columns and feature builder of the report layer"""
+    model = InfrastructureReport
+    query = model.query.filter(model.latitude.isnot(None), model.longitude.isnot(None))
+    for column in ('category', 'severity', 'status'):
+        values = filters.get(column)
+        if values:
+            query = query.filter(getattr(model, column).in_(values))
+
+    def properties(report):
+        return {
+            'id': report.id,
+            'title': report.title,
+            'category': report.category,
+            'severity': report.severity,
+            'status': report.status,
+            'date': report.reported_at.strftime('%Y-%m-%d') if report.reported_at else None,
+            'image': report.image_path,
+            'location': report.location_description
+        }
+
+    severity_rank = case(
+        {name: rank for rank, name in enumerate(_SEVERITY_ORDER)}, value=model.severity, else_=0
+    )
+
+    def cluster_properties(aggregates):
+        return {'max_severity': _SEVERITY_ORDER[int(aggregates[0] or 0)]}
+
+    return query, model.latitude, model.longitude, properties, [func.max(severity_rank)], cluster_properties
+
+
+def _project_layer(filters):
+    """Query, coordinate columns and feature builder of the project layer"""
+    model = InfrastructureProject
+    query = model.query.filter(model.location_lat.isnot(None), model.location_lng.isnot(None))
+    if filters.get('status'):
+        query = query.filter(model.status.in_(filters['status']))
+
+    def properties(project):
+        return {
+            'id': project.id,
+            'project_id': project.project_id,
+            'name': project.project_name,
+            'status': project.status,
+            'description': project.description[:100] if project.description else ''
+        }
+
+    return query, model.location_lat, model.location_lng, properties, [], lambda aggregates: {}
+
+
+_LAYERS = {
+    REPORTS: (_report_layer, ('category', 'severity', 'status')),
+    PROJECTS: (_project_layer, ('status',))
+}
+
+
+def layer_filters(layer, args):
+    """
+    Filters for a layer from request arguments ('all' or empty means no filter;
+    comma-separated values match any of them).
+
+    Returns:
+        Tuple of (name, values) pairs, usable as a cache key
+    """
+    filters = []
+    for name in _LAYERS[layer][1]:
+        raw = args.get(name)
+        if raw and raw != 'all':
+            filters.append((name, tuple(sorted(set(v for v in raw.split(',') if v)))))
+    return tuple(filters)
+
+
+# ============================================================================
+# TILE BUILDING
+# ============================================================================
+
+def _point(lng, lat, properties):
+    return {
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [round(float(lng), 6), round(float(lat), 6)]},
+        'properties': properties
+    }
+
+
+def build_tile(layer, z, x, y, filters=()):
+    """
+    GeoJSON FeatureCollection for one tile of a layer.
+
+    Args:
+        layer: REPORTS or PROJECTS
+        z, x, y: Tile coordinates
+        filters: Output of layer_filters
+
+    Returns:
+        Dictionary (GeoJSON FeatureCollection)
+    """
+    make_layer = _LAYERS[layer][0]
+    query, lat_col, lng_col, properties, aggregates, cluster_properties = make_layer(dict(filters))
+    model = query.column_descriptions[0]['entity']
+
+    west, south, east, north = tile_bounds(z, x, y)
+    # Half-open bounds so a point on a tile edge belongs to exactly one tile
+    query = query.filter(lng_col >= west, lng_col < east, lat_col > south, lat_col <= north)
+
+    features = []
+    if z >= CLUSTER_MAX_ZOOM:
+        for row in query.order_by(model.id).limit(MAX_POINTS_PER_TILE).all():
+            features.append(_point(getattr(row, lng_col.key), getattr(row, lat_col.key), properties(row)))
+    else:
+        # Cells are linear in latitude within a tile; close enough at tile scale
+        cell_w = (east - west) / CELLS_PER_SIDE
+        cell_h = (north - south) / CELLS_PER_SIDE
+        cx = _cell_index((lng_col - west) / cell_w).label('cx')
+        cy = _cell_index((north - lat_col) / cell_h).label('cy')
+
+        cells = query.with_entities(
+            cx, cy, func.count(model.id), func.avg(lat_col), func.avg(lng_col), func.min(model.id), *aggregates
+        ).group_by(cx, cy).all()
+
+        single_ids = [cell[5] for cell in cells if cell[2] == 1]
+        singles = {row.id: row for row in model.query.filter(model.id.in_(single_ids)).all()} if single_ids else {}
+
+        for cell in cells:
+            count, lat, lng = cell[2], cell[3], cell[4]
+            if count == 1 and cell[5] in singles:
+                row = singles[cell[5]]
+                features.append(_point(getattr(row, lng_col.key), getattr(row, lat_col.key), properties(row)))
+            else:
+                cluster = {'cluster': True, 'point_count': count}
+                cluster.update(cluster_properties(cell[6:]))
+                features.append(_point(lng, lat, cluster))
+
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+# ============================================================================
+# TILE CACHE
+# ============================================================================
+
+# (layer, z, x, y) -> {filters: (expires_at, body)}, least recently used first
+_tile_cache = OrderedDict()
+_tile_cache_lock = threading.Lock()
+
+
+def get_tile(layer, z, x, y, filters=()):
+    """
+    Serialized GeoJSON for a tile, from the cache when fresh.
+
+    Returns:
+        UTF-8 encoded JSON bytes
+    """
+    key = (layer, z, x, y)
+    now = time.monotonic()
+    with _tile_cache_lock:
+        variants = _tile_cache.get(key)
+        if variants is not None:
+            _tile_cache.move_to_end(key)
+            cached = variants.get(filters)
+            if cached and cached[0] > now:
+                return cached[1]
+
+    body = json.dumps(build_tile(layer, z, x, y, filters), separators=(',', ':')).encode()
+
+    with _tile_cache_lock:
+        _tile_cache.setdefault(key, {})[filters] = (now + TILE_CACHE_TTL_SECONDS, body)
+        _tile_cache.move_to_end(key)
+        while len(_tile_cache) > TILE_CACHE_SIZE:
+            _tile_cache.popitem(last=False)
+    return body
+
+
+def invalidate_point(layer, lat, lng):
+    """Drop every cached tile of a layer that contains a point"""
+    if lat is None or lng is None:
+        return
+    lat, lng = float(lat), float(lng)
+    with _tile_cache_lock:
+        for z in range(MAX_ZOOM + 1):
+            x, y = tile_for(lat, lng, z)
+            _tile_cache.pop((layer, z, x, y), None)
+
+
+def invalidate_tiles(layer=None):
+    """Drop all cached tiles (of one layer, or of every layer)"""
+    with _tile_cache_lock:
+        if layer is None:
+            _tile_cache.clear()
+        else:
+            for key in [key for key in _tile_cache if key[0] == layer]:
+                del _tile_cache[key]
+
+
+_TRACKED = {
+    InfrastructureReport: (REPORTS, 'latitude', 'longitude'),
+    InfrastructureProject: (PROJECTS, 'location_lat', 'location_lng')
+}
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_points(session, flush_context):
+    """Remember where reports and projects changed; their tiles are dropped on commit"""
+    points = session.info.setdefault('map_tile_points', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        tracked = _TRACKED.get(type(obj))
+        if not tracked:
+            continue
+        layer, lat_attr, lng_attr = tracked
+        state = inspect(obj)
+        lat_history, lng_history = state.attrs[lat_attr].history, state.attrs[lng_attr].history
+        # Old and new positions, so a moved marker leaves its old tiles too
+        for lat in set(lat_history.sum() or [getattr(obj, lat_attr)]):
+            for lng in set(lng_history.sum() or [getattr(obj, lng_attr)]):
+                if lat is not None and lng is not None:
+                    points.add((layer, float(lat), float(lng)))
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed_points(session):
+    for layer, lat, lng in session.info.pop('map_tile_points', ()):
+        invalidate_point(layer, lat, lng)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed_points(session):
+    session.info.pop('map_tile_points', None)
+
+
+def tile_response(layer, z, x, y):
+    """
+    Flask response for a tile request, with the layer's filters taken from the
+    query string. Sends an ETag so an unchanged tile revalidates with a 304.
+    """
+    from flask import request, jsonify, Response
+
+    if not is_valid_tile(z, x, y):
+        return jsonify({'success': False, 'error': 'Invalid tile'}), 404
+
+    body = get_tile(layer, z, x, y, layer_filters(layer, request.args))
+    response = Response(body, mimetype='application/geo+json')
+    response.add_etag()
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+
+# ============================================================================
+# BENCHMARK
+# ============================================================================
+
+def benchmark(n_reports=50000):
+    """
+    Seed n_reports reports around Bangalore and compare rendering every report
+    with fetching the tiles of a city-wide viewport.
+    """
+    import random
+    from datetime import datetime
+    from app import app
+    from models import User
+
+    rng = random.Random(42)
+    stamp = datetime.utcnow().strftime('%Y%m%d%H%M%S%f')
+    categories = ['road', 'street_light', 'garbage_bin', 'drainage']
+    statuses = ['pending', 'under_review', 'in_progress', 'resolved']
+
+    with app.app_context():
+        user = User(username=f'mapbench_{stamp}', email=f'mapbench_{stamp}@example.com')
+        db.session.add(user)
+        db.session.flush()
+        user_id = user.id
+        try:
+            db.session.bulk_insert_mappings(InfrastructureReport, [
+                {
+                    'user_id': user_id, 'title': f'Report {i}', 'description': 'bench', 'category': rng.choice(categories),
+                    'severity': rng.choice(_SEVERITY_ORDER), 'location_description': 'bench', 'image_path': '',
+                    'status': rng.choice(statuses), 'latitude': 12.97 + rng.gauss(0, 0.08),
+                    'longitude': 77.59 + rng.gauss(0, 0.08)
+                }
+                for i in range(n_reports)
+            ])
+            db.session.commit()
+
+            started = time.perf_counter()
+            everything = InfrastructureReport.query.filter(InfrastructureReport.latitude.isnot(None)).all()
+            full_time = time.perf_counter() - started
+            db.session.expunge_all()
+
+            # The 3x3 tiles around the city centre at zoom 12
+            z = 12
+            cx, cy = tile_for(12.97, 77.59, z)
+            tiles = [(x, y) for x in range(cx - 1, cx + 2) for y in range(cy - 1, cy + 2)]
+
+            invalidate_tiles()
+            started = time.perf_counter()
+            size = sum(len(get_tile(REPORTS, z, x, y)) for x, y in tiles)
+            cold_time = time.perf_counter() - started
+
+            started = time.perf_counter()
+            for x, y in tiles:
+                get_tile(REPORTS, z, x, y)
+            warm_time = time.perf_counter() - started
+
+            counted = sum(
+                feature['properties'].get('point_count', 1)
+                for x, y in tiles for feature in json.loads(get_tile(REPORTS, z, x, y))['features']
+            )
+            in_view = InfrastructureReport.query.filter(
+                InfrastructureReport.longitude >= tile_bounds(z, cx - 1, cy)[0],
+                InfrastructureReport.longitude < tile_bounds(z, cx + 1, cy)[2],
+                InfrastructureReport.latitude > tile_bounds(z, cx, cy + 1)[1],
+                InfrastructureReport.latitude <= tile_bounds(z, cx, cy - 1)[3]
+            ).count()
+        finally:
+            # Remove the seeded rows so they never show on the real map
+            db.session.rollback()
+            InfrastructureReport.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+            User.query.filter_by(id=user_id).delete(synchronize_session=False)
+            db.session.commit()
+            invalidate_tiles()
+
+    print(f"{len(everything)} reports loaded for the page in {full_time * 1e3:.0f} ms; "
+          f"9 clustered tiles ({size / 1024:.1f} KiB) in {cold_time * 1e3:.0f} ms cold, "
+          f"{warm_time * 1e3:.2f} ms cached")
+    ok = counted == in_view
+    print("OK: clusters account for every report in view" if ok else f"FAIL: {counted} clustered, {in_view} in view")
+    return ok
+
+
+if __name__ == '__main__':
+    sys.exit(0 if benchmark() else 1)
@@ -0,0 +1,112 @@
+"""
+Material vocabulary for ReGenWorks.
+
+Partners and drop locations list the materials they accept as free text
+("Plastic,Paper,E-Waste"). Each name is normalised to one canonical material,
+and the set becomes an integer bitmask with one bit per material. The
+accepted_materials_mask columns are kept in step with accepted_materials
+whenever the text is assigned. A material filter is then a single AND in
+SQL (accepts()) or over a NumPy array (matches()), instead of string
+matching.
+
+Bits are stored in the database: append new materials to MATERIALS, never
+reorder or remove them.
+"""
+
+from sqlalchemy import false
+
+# Canonical materials, in bit order
+MATERIALS = [
+    'Plastic',
+    'Paper',
+    'Cardboard',
+    'Glass',
+    'Metal',
+    'E-Waste',
+    'Batteries',
+    'Organic',
+    'Textile',
+    'Mixed',
+]
+
+MATERIAL_BITS = {name: 1 << i for i, name in enumerate(MATERIALS)}
+
+# Other spellings used by forms, partners and the image analysis
+_ALIASES = {
+    'plastics': 'Plastic',
+    'carton': 'Cardboard',
+    'cartons': 'Cardboard',
+    'metals': 'Metal',
+    'aluminium': 'Metal',
+    'aluminum': 'Metal',
+    'steel': 'Metal',
+    'ewaste': 'E-Waste',
+    'e waste': 'E-Waste',
+    'electronic': 'E-Waste',
+    'electronics': 'E-Waste',
+    'battery': 'Batteries',
+    'food': 'Organic',
+    'compost': 'Organic',
+    'textiles': 'Textile',
+    'clothing': 'Textile',
+    'fabric': 'Textile',
+    'mixed recyclables': 'Mixed',
+}
+
+_CANONICAL = {name.lower(): name for name in MATERIALS}
+_CANONICAL.update(_ALIASES)
+
+ANY = 'any'
+ALL = 'all'
+
+
+def normalize_material(name):
+    """Canonical material name, or None if the name is not in the vocabulary"""
+    return _CANONICAL.get(' '.join((name or '').replace('_', ' ').split()).lower())
+
+
+def split_materials(value):
+    """Names from a comma-separated string or an iterable of names"""
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+    return [name.strip() for name in value if name and name.strip()]
+
+
+def material_mask(value):
+    """
+    Bitmask of the known materials in a comma-separated string or iterable.
+    Unknown names contribute no bits.
+    """
+    mask = 0
+    for name in split_materials(value):
+        canonical = normalize_material(name)
+        if canonical:
+            mask |= MATERIAL_BITS[canonical]
+    return mask
+
+
+def mask_materials(mask):
+    """Canonical names of the materials in a bitmask"""
+    return [name for name in MATERIALS if mask & MATERIAL_BITS[name]]
+
+
+def accepts(column, materials, match=ANY):
+    """
+    SQL predicate on a mask column: accepts any (or all) of the materials.
+    No known material matches nothing.
+    """
+    bits = material_mask(materials)
+    if not bits:
+        return false()
+    if match == ALL:
+        return column.op('&')(bits) == bits
+    return column.op('&')(bits) != 0
+
+
+def matches(masks, bits, match=ANY):
+    """Boolean NumPy array: which of the masks accept any (or all) of bits"""
+    if match == ALL:
+        return (masks & bits) == bits
+    return (masks & bits) != 0
@@ -92,6 +92,139 @@ def migrate_waste_item_table():
             add_column_postgres(conn, 'waste_item', 'estimated_weight_grams', 'NUMERIC(10,2)', 'NULL')
             add_column_postgres(conn, 'waste_item', 'ml_confidence_score', 'NUMERIC(5,2)', 'NULL')
 
+def migrate_waste_journey_block_table():
+    """Add proof-of-work seal columns to waste_journey_block table"""
+    logger.info("Migrating waste_journey_block table...")
+    
+    with db.engine.begin() as conn:
+        if not table_exists(conn, 'waste_journey_block'):
+            return  # Created with the new columns by create_new_tables()
+        if is_sqlite():
+            add_column_sqlite(conn, 'waste_journey_block', 'seal_nonce', 'INTEGER', 'NULL')
+            add_column_sqlite(conn, 'waste_journey_block', 'seal_difficulty', 'INTEGER', 'NULL')
+            add_column_sqlite(conn, 'waste_journey_block', 'sealed_at', 'DATETIME', 'NULL')
+            add_column_sqlite(conn, 'waste_journey_block', 'seq', 'INTEGER', 'NULL')
+        else:
+            add_column_postgres(conn, 'waste_journey_block', 'seal_nonce', 'INTEGER', 'NULL')
+            add_column_postgres(conn, 'waste_journey_block', 'seal_difficulty', 'INTEGER', 'NULL')
+            add_column_postgres(conn, 'waste_journey_block', 'sealed_at', 'TIMESTAMP', 'NULL')
+            add_column_postgres(conn, 'waste_journey_block', 'seq', 'INTEGER', 'NULL')
+        
+        backfill_chain_sequences(conn, 'waste_journey_block', 'waste_item_id')
+
+def migrate_project_ledger_table():
+    """Add Merkle anchor reference to project_ledger table"""
+    logger.info("Migrating project_ledger table...")
+    
+    with db.engine.begin() as conn:
+        if not table_exists(conn, 'project_ledger'):
+            return  # Created with the new columns by create_new_tables()
+        if is_sqlite():
+            add_column_sqlite(conn, 'project_ledger', 'anchor_id', 'INTEGER', 'NULL')
+            add_column_sqlite(conn, 'project_ledger', 'seq', 'INTEGER', 'NULL')
+        else:
+            add_column_postgres(conn, 'project_ledger', 'anchor_id', 'INTEGER REFERENCES project_ledger(id)', 'NULL')
+            add_column_postgres(conn, 'project_ledger', 'seq', 'INTEGER', 'NULL')
+        
+        backfill_chain_sequences(conn, 'project_ledger', 'project_id')
+
+def migrate_pickup_time_slot_table():
+    """Add per-partner capacity to pickup_time_slot table"""
+    logger.info("Migrating pickup_time_slot table...")
+    
+    with db.engine.begin() as conn:
+        if not table_exists(conn, 'pickup_time_slot'):
+            return  # Created with the new column by create_new_tables()
+        if is_sqlite():
+            add_column_sqlite(conn, 'pickup_time_slot', 'partner_capacity', 'INTEGER', 'NULL')
+        else:
+            add_column_postgres(conn, 'pickup_time_slot', 'partner_capacity', 'INTEGER', 'NULL')
+
+def migrate_material_masks():
+    """Add accepted_materials_mask to pickup_partner and drop_location, and fill it from accepted_materials"""
+    from materials import material_mask
+    logger.info("Migrating accepted material masks...")
+    
+    with db.engine.begin() as conn:
+        for table_name in ('pickup_partner', 'drop_location'):
+            if not table_exists(conn, table_name):
+                continue  # Created with the new column by create_new_tables()
+            if is_sqlite():
+                add_column_sqlite(conn, table_name, 'accepted_materials_mask', 'INTEGER NOT NULL', '0')
+            else:
+                add_column_postgres(conn, table_name, 'accepted_materials_mask', 'INTEGER NOT NULL', '0')
+            
+            # Recompute every row so the migration is safe to re-run after vocabulary changes
+            rows = conn.execute(text(
+                f'SELECT id, accepted_materials, accepted_materials_mask FROM "{table_name}"'
+            )).fetchall()
+            updates = [
+                {'id': row_id, 'mask': material_mask(accepted)}
+                for row_id, accepted, mask in rows
+                if material_mask(accepted) != mask
+            ]
+            if updates:
+                conn.execute(text(f'UPDATE "{table_name}" SET accepted_materials_mask = :mask WHERE id = :id'), updates)
+            logger.info(f"[OK] Updated {len(updates)} material masks in '{table_name}'")
+
+def backfill_chain_sequences(conn, table_name, chain_column):
+    """Number existing chain entries (by timestamp, then id) after each chain's highest seq"""
+    rows = conn.execute(text(
+        f'SELECT id, {chain_column} FROM "{table_name}" WHERE seq IS NULL ORDER BY {chain_column}, timestamp, id'
+    )).fetchall()
+    if not rows:
+        return
+    
+    next_seq = {
+        chain_id: (max_seq or 0) + 1
+        for chain_id, max_seq in conn.execute(text(
+            f'SELECT {chain_column}, MAX(seq) FROM "{table_name}" GROUP BY {chain_column}'
+        )).fetchall()
+    }
+    
+    updates = []
+    for row_id, chain_id in rows:
+        updates.append({'id': row_id, 'seq': next_seq[chain_id]})
+        next_seq[chain_id] += 1
+    
+    conn.execute(text(f'UPDATE "{table_name}" SET seq = :seq WHERE id = :id'), updates)
+    logger.info(f"[OK] Numbered {len(updates)} existing '{table_name}' entries")
+
+def create_index(conn, index_name, table_name, columns, unique=False):
+    """Create an index if it doesn't exist (same syntax on SQLite and PostgreSQL)"""
+    try:
+        unique_clause = "UNIQUE " if unique else ""
+        conn.execute(text(
+            f'CREATE {unique_clause}INDEX IF NOT EXISTS {index_name} ON "{table_name}" ({columns})'
+        ))
+        logger.info(f"[OK] Index '{index_name}' on '{table_name}'")
+        return True
+    except Exception as e:
+        logger.error(f"[ERROR] Error creating index '{index_name}' on '{table_name}': {e}")
+        return False
+
+def create_performance_indexes():
+    """Add indexes used by the leaderboard and other read paths"""
+    logger.info("Creating performance indexes...")
+    
+    with db.engine.begin() as conn:
+        create_index(conn, 'idx_reward_created_user', 'reward', 'created_at, user_id')
+        create_index(conn, 'ix_project_ledger_anchor_id', 'project_ledger', 'anchor_id')
+        create_index(conn, 'idx_ledger_project', 'project_ledger', 'project_id, timestamp')
+        create_index(conn, 'idx_ledger_batch', 'project_ledger', 'project_id, batch_reference')
+        create_index(conn, 'idx_ledger_unsynced', 'project_ledger', 'firestore_synced, id')
+        create_index(conn, 'unique_project_ledger_seq', 'project_ledger', 'project_id, seq', unique=True)
+        create_index(conn, 'unique_journey_block_seq', 'waste_journey_block', 'waste_item_id, seq', unique=True)
+        create_index(conn, 'ix_waste_batch_linked_project_id', 'waste_batch', 'linked_project_id')
+        create_index(conn, 'idx_contributor_batch_user', 'project_contributor', 'batch_id, user_id')
+        create_index(conn, 'idx_project_created', 'infrastructure_project', 'created_at, id')
+        create_index(conn, 'idx_project_status_created', 'infrastructure_project', 'status, created_at, id')
+        create_index(conn, 'idx_contributor_total_order', 'project_contributor_total', 'project_id, total_grams, user_id')
+        create_index(conn, 'idx_report_location', 'infrastructure_report', 'longitude, latitude')
+        create_index(conn, 'idx_project_location', 'infrastructure_project', 'location_lng, location_lat')
+        create_index(conn, 'idx_pickup_status_date', 'pickup_request', 'status, preferred_date')
+        create_index(conn, 'idx_pickup_partner_date', 'pickup_request', 'assigned_partner_id, scheduled_date')
+
 def create_new_tables():
     """Create all new tables for the features"""
     logger.info("Creating new tables...")
@@ -106,7 +239,12 @@ def create_new_tables():
             InfrastructureProject,
             WasteBatch,
             ProjectContributor,
-            ProjectLedger
+            ProjectLedger,
+            RewardItem,
+            RewardReservation,
+            ChainCheckpoint,
+            BatchMembership,
+            ProjectContributorTotal
         )
         
         # Create all tables
@@ -115,6 +253,10 @@ def create_new_tables():
         
         # Seed initial data
         seed_initial_data()
+
+        import rewards_catalog
+        if rewards_catalog.seed_catalog():
+            logger.info("[OK] Seeded rewards catalog")
         
     except Exception as e:
         logger.error(f"[ERROR] Error creating tables: {e}")
@@ -279,10 +421,27 @@ def main():
             # Step 1: Migrate existing tables
             migrate_user_table()
             migrate_waste_item_table()
+            migrate_waste_journey_block_table()
+            migrate_project_ledger_table()
+            migrate_pickup_time_slot_table()
+            migrate_material_masks()
             
             # Step 2: Create new tables
             create_new_tables()
             
+            # Step 3: Indexes for existing tables
+            create_performance_indexes()
+            
+            # Step 4: Backfill data for new tables
+            from auto_batch_creator import backfill_batch_memberships
+            backfill_batch_memberships()
+            
+            from top_contributors import rebuild_all_projects
+            rebuild_all_projects()
+            
+            from drop_point_index import seed_default_drop_locations
+            seed_default_drop_locations()
+            
             logger.info("Migration completed successfully!")
             
     except Exception as e:
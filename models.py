@@ -3,6 +3,8 @@ import hashlib
 import json
 from app import db, bcrypt
 from flask_login import UserMixin
+from sqlalchemy.orm import validates
+from materials import material_mask
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -40,9 +42,9 @@ class User(UserMixin, db.Model):
     def check_password(self, password):
         return bcrypt.check_password_hash(self.password_hash, password)
     
-    def award_points(self, points):
-        self.eco_points += points
-        db.session.commit()
+    def award_points(self, points, description="Eco points awarded", reward_type="manual"):
+        from points_ledger import credit
+        credit(self.id, points, description, reward_type, commit=True)
     
     def __repr__(self):
         return f"<User {self.username}>"
@@ -121,10 +123,16 @@ class DropLocation(db.Model):
     latitude = db.Column(db.Float, nullable=False)
     longitude = db.Column(db.Float, nullable=False)
     accepted_materials = db.Column(db.String(255))  # Comma-separated list of materials
+    accepted_materials_mask = db.Column(db.Integer, nullable=False, default=0)  # Bits from materials.MATERIAL_BITS
     
     # Relationships
     waste_items = db.relationship('WasteItem', backref='drop_location', lazy=True)
     
+    @validates('accepted_materials')
+    def _update_materials_mask(self, key, value):
+        self.accepted_materials_mask = material_mask(value)
+        return value
+    
     def __repr__(self):
         return f"<DropLocation {self.name}>"
 
@@ -165,6 +173,9 @@ class Reward(db.Model):
     reward_type = db.Column(db.String(50), nullable=False)  # 'drop_off', 'listing', 'achievement'
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Weekly/monthly leaderboards sum points per user over a created_at window
+    __table_args__ = (db.Index('idx_reward_created_user', 'created_at', 'user_id'),)
+    
     def __repr__(self):
         return f"<Reward {self.id}: {self.points} points for {self.reward_type}>"
 
@@ -176,6 +187,7 @@ class WasteJourneyBlock(db.Model):
     """
     id = db.Column(db.Integer, primary_key=True)
     waste_item_id = db.Column(db.Integer, db.ForeignKey('waste_item.id'), nullable=False)
+    seq = db.Column(db.Integer, nullable=True)  # Position in the item's chain, from 1 (see ledger_append)
     
     # Block data
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
@@ -189,9 +201,17 @@ class WasteJourneyBlock(db.Model):
     block_hash = db.Column(db.String(64), nullable=False)  # Hash of this block
     nonce = db.Column(db.Integer, default=0)  # For proof of work simulation
     
+    # Proof of work done after the block is stored (see blockchain_service).
+    # The seal covers block_hash, so sealing never changes the chain links.
+    seal_nonce = db.Column(db.Integer, nullable=True)
+    seal_difficulty = db.Column(db.Integer, nullable=True)
+    sealed_at = db.Column(db.DateTime, nullable=True)
+    
     # Relationships
     waste_item = db.relationship('WasteItem', backref='journey_blocks', lazy=True)
     
+    __table_args__ = (db.Index('unique_journey_block_seq', 'waste_item_id', 'seq', unique=True),)
+    
     def __init__(self, waste_item_id, stage, location, details, verified_by, previous_hash=None):
         self.waste_item_id = waste_item_id
         self.stage = stage
@@ -200,15 +220,21 @@ class WasteJourneyBlock(db.Model):
         self.verified_by = verified_by
         self.previous_hash = previous_hash
         self.nonce = 0
+        # Set now (not at insert) so the hash covers the stored timestamp
+        self.timestamp = datetime.utcnow()
         
         # Calculate block hash on creation
         self.block_hash = self.calculate_hash()
     
-    def calculate_hash(self):
-        """Calculate the hash of this block based on its contents"""
+    def calculate_hash(self, legacy=False):
+        """
+        Calculate the hash of this block based on its contents.
+        Blocks created before the timestamp was set in __init__ were hashed
+        with an empty timestamp; legacy=True reproduces those hashes.
+        """
         block_data = {
             'waste_item_id': self.waste_item_id,
-            'timestamp': str(self.timestamp),
+            'timestamp': 'None' if legacy else str(self.timestamp),
             'stage': self.stage,
             'location': self.location,
             'details': self.details,
@@ -231,9 +257,32 @@ class WasteJourneyBlock(db.Model):
         
         return self.block_hash
     
+    def calculate_seal_hash(self, nonce):
+        """Hash used for the after-the-fact proof of work over this block"""
+        return hashlib.sha256(f"{self.block_hash}:{nonce}".encode()).hexdigest()
+    
+    def seal(self, difficulty=2):
+        """Find a seal nonce whose seal hash has the required leading zeros"""
+        target = '0' * difficulty
+        nonce = 0
+        
+        while self.calculate_seal_hash(nonce)[:difficulty] != target:
+            nonce += 1
+        
+        self.seal_nonce = nonce
+        self.seal_difficulty = difficulty
+        return nonce
+    
     def is_valid(self):
-        """Verify that the block's hash is valid"""
-        return self.block_hash == self.calculate_hash()
+        """Verify that the block's hash (and seal, if sealed) is valid"""
+        if self.block_hash != self.calculate_hash() and self.block_hash != self.calculate_hash(legacy=True):
+            return False
+        
+        if self.seal_nonce is not None:
+            difficulty = self.seal_difficulty or 0
+            return self.calculate_seal_hash(self.seal_nonce)[:difficulty] == '0' * difficulty
+        
+        return True
     
     def __repr__(self):
         return f"<WasteJourneyBlock {self.id}: {self.stage} for waste_item_id={self.waste_item_id}>"
@@ -266,6 +315,9 @@ class InfrastructureReport(db.Model):
     status_updated_at = db.Column(db.DateTime, default=datetime.utcnow)
     municipality_notes = db.Column(db.Text)
     
+    # Map tiles select reports by bounding box
+    __table_args__ = (db.Index('idx_report_location', 'longitude', 'latitude'),)
+    
     # Relationships
     user = db.relationship('User', backref=db.backref('infrastructure_reports', lazy=True))
     
@@ -367,6 +419,13 @@ class InfrastructureProject(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Keyset pagination of the project listing (newest first) and map tiles
+    __table_args__ = (
+        db.Index('idx_project_created', 'created_at', 'id'),
+        db.Index('idx_project_status_created', 'status', 'created_at', 'id'),
+        db.Index('idx_project_location', 'location_lng', 'location_lat'),
+    )
+    
     # Relationships
     batches = db.relationship('WasteBatch', backref='project', lazy=True)
     
@@ -380,7 +439,7 @@ class WasteBatch(db.Model):
     batch_id = db.Column(db.String(50), unique=True, nullable=False)
     total_weight_grams = db.Column(db.Numeric(12, 2), nullable=False)
     material_type = db.Column(db.String(50), nullable=False)
-    linked_project_id = db.Column(db.Integer, db.ForeignKey('infrastructure_project.id', ondelete='SET NULL'), nullable=True)
+    linked_project_id = db.Column(db.Integer, db.ForeignKey('infrastructure_project.id', ondelete='SET NULL'), nullable=True, index=True)
     collection_date = db.Column(db.DateTime, default=datetime.utcnow)
     processing_date = db.Column(db.DateTime, nullable=True)
     status = db.Column(db.String(20), default='collected')  # collected, processing, allocated, completed
@@ -404,14 +463,57 @@ class ProjectContributor(db.Model):
     is_top_contributor = db.Column(db.Boolean, default=False)  # Top 10% contributor
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (db.Index('idx_contributor_batch_user', 'batch_id', 'user_id'),)
+    
     def __repr__(self):
         return f"<ProjectContributor user_id={self.user_id} batch_id={self.batch_id}>"
 
 
+class ProjectContributorTotal(db.Model):
+    """Running contribution total of one user to one project (maintained by top_contributors)"""
+    __tablename__ = 'project_contributor_total'
+
+    id = db.Column(db.Integer, primary_key=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('infrastructure_project.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    total_grams = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    is_top = db.Column(db.Boolean, nullable=False, default=False)  # Top 10% contributor
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('project_id', 'user_id', name='unique_project_contributor_total'),
+        db.Index('idx_contributor_total_rank', 'project_id', 'is_top', 'total_grams'),
+        db.Index('idx_contributor_total_order', 'project_id', 'total_grams', 'user_id'),
+    )
+
+    def __repr__(self):
+        return f"<ProjectContributorTotal project_id={self.project_id} user_id={self.user_id} total={self.total_grams}>"
+
+
+class BatchMembership(db.Model):
+    """Which batch a waste item went into, and with what weight"""
+    __tablename__ = 'batch_membership'
+
+    id = db.Column(db.Integer, primary_key=True)
+    waste_item_id = db.Column(db.Integer, db.ForeignKey('waste_item.id', ondelete='CASCADE'), nullable=False, unique=True)
+    batch_id = db.Column(db.Integer, db.ForeignKey('waste_batch.id', ondelete='CASCADE'), nullable=False, index=True)
+    weight_grams = db.Column(db.Numeric(10, 2), nullable=False)
+    source = db.Column(db.String(20), default='auto')  # auto, manual, backfill
+    added_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Relationships
+    batch = db.relationship('WasteBatch', backref=db.backref('memberships', lazy=True))
+    waste_item = db.relationship('WasteItem', backref=db.backref('batch_membership', uselist=False, lazy=True))
+
+    def __repr__(self):
+        return f"<BatchMembership waste_item_id={self.waste_item_id} batch_id={self.batch_id}>"
+
+
 class ProjectLedger(db.Model):
     """Blockchain-like immutable ledger for project updates"""
     id = db.Column(db.Integer, primary_key=True)
     project_id = db.Column(db.String(50), nullable=False)
+    seq = db.Column(db.Integer, nullable=True)  # Position in the project's chain, from 1 (see ledger_append)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     status = db.Column(db.String(20), nullable=False)
     verified_by = db.Column(db.String(100), nullable=True)
@@ -421,6 +523,15 @@ class ProjectLedger(db.Model):
     data = db.Column(db.JSON, nullable=True)  # Additional metadata as JSON
     firestore_synced = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Anchor block whose Merkle root covers this entry (see blockchain_tracker)
+    anchor_id = db.Column(db.Integer, db.ForeignKey('project_ledger.id'), nullable=True, index=True)
+    
+    __table_args__ = (
+        db.Index('unique_project_ledger_seq', 'project_id', 'seq', unique=True),
+        db.Index('idx_ledger_project', 'project_id', 'timestamp'),
+        db.Index('idx_ledger_batch', 'project_id', 'batch_reference'),
+        db.Index('idx_ledger_unsynced', 'firestore_synced', 'id'),
+    )
     
     def __repr__(self):
         return f"<ProjectLedger project_id={self.project_id} block_hash={self.block_hash[:16]}...>"
@@ -449,6 +560,7 @@ class PickupPartner(db.Model):
 
     # Partner details
     accepted_materials = db.Column(db.String(255), nullable=False)  # Comma-separated: Plastic,Paper,Glass
+    accepted_materials_mask = db.Column(db.Integer, nullable=False, default=0)  # Bits from materials.MATERIAL_BITS
     operating_hours = db.Column(db.String(100), nullable=False)  # "9 AM - 6 PM"
     is_active = db.Column(db.Boolean, default=True)
 
@@ -458,6 +570,11 @@ class PickupPartner(db.Model):
     # Relationships
     pickup_requests = db.relationship('PickupRequest', backref='assigned_partner', lazy=True)
 
+    @validates('accepted_materials')
+    def _update_materials_mask(self, key, value):
+        self.accepted_materials_mask = material_mask(value)
+        return value
+
     def __repr__(self):
         return f"<PickupPartner partner_id={self.partner_id} name={self.name}>"
 
@@ -519,6 +636,12 @@ class PickupRequest(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     status_updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    # Batch assignment reads the open requests and each partner's booked slots
+    __table_args__ = (
+        db.Index('idx_pickup_status_date', 'status', 'preferred_date'),
+        db.Index('idx_pickup_partner_date', 'assigned_partner_id', 'scheduled_date'),
+    )
+
     # Relationships
     user = db.relationship('User', backref=db.backref('pickup_requests', lazy=True, cascade='all, delete-orphan'))
     linked_batch = db.relationship('WasteBatch', backref='pickup_requests', lazy=True)
@@ -554,9 +677,91 @@ class PickupTimeSlot(db.Model):
     slot_label = db.Column(db.String(50), nullable=False)  # "9 AM - 12 PM", "2 PM - 5 PM", "5 PM - 8 PM"
     start_hour = db.Column(db.Integer, nullable=False)  # 9, 14, 17
     end_hour = db.Column(db.Integer, nullable=False)  # 12, 17, 20
+    partner_capacity = db.Column(db.Integer, nullable=True)  # Pickups one partner can take in this slot (NULL: PICKUP_SLOT_CAPACITY)
     is_active = db.Column(db.Boolean, default=True)
     display_order = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def __repr__(self):
         return f"<PickupTimeSlot slot_label={self.slot_label}>"
+
+
+# ============================================================================
+# FEATURE 5: REWARDS CATALOG
+# ============================================================================
+
+class RewardItem(db.Model):
+    """Items in the rewards store that users can redeem eco points for"""
+    __tablename__ = 'reward_item'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False)
+    description = db.Column(db.String(255), nullable=True)
+    category = db.Column(db.String(50), nullable=False)  # vouchers, plants, eco, donations
+    points_cost = db.Column(db.Integer, nullable=False)
+    stock = db.Column(db.Integer, nullable=True)  # NULL = unlimited (e.g. donations)
+    icon = db.Column(db.String(50), default='fa-gift')  # Font Awesome icon class
+    badge = db.Column(db.String(20), nullable=True)  # Popular, New, Impact
+    is_active = db.Column(db.Boolean, default=True)
+    display_order = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Relationships
+    reservations = db.relationship('RewardReservation', backref='item', lazy=True)
+
+    def __repr__(self):
+        return f"<RewardItem {self.name} stock={self.stock}>"
+
+
+class RewardReservation(db.Model):
+    """A unit of stock held for a user while they confirm a redemption"""
+    __tablename__ = 'reward_reservation'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    item_id = db.Column(db.Integer, db.ForeignKey('reward_item.id', ondelete='CASCADE'), nullable=False)
+    points_cost = db.Column(db.Integer, nullable=False)  # Price at the time of reservation
+    status = db.Column(db.String(20), default='held')  # held, redeemed, cancelled, expired
+    expires_at = db.Column(db.DateTime, nullable=False)
+    redeemed_at = db.Column(db.DateTime, nullable=True)
+    reward_id = db.Column(db.Integer, db.ForeignKey('reward.id', ondelete='SET NULL'), nullable=True)  # Points ledger debit
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Expiry sweeps look up held reservations past their deadline
+    __table_args__ = (db.Index('idx_reward_reservation_status_expiry', 'status', 'expires_at'),)
+
+    user = db.relationship('User', backref=db.backref('reward_reservations', lazy=True))
+
+    def __repr__(self):
+        return f"<RewardReservation {self.id}: item_id={self.item_id} status={self.status}>"
+
+
+# ============================================================================
+# CHAIN VERIFICATION CHECKPOINTS
+# ============================================================================
+
+class ChainCheckpoint(db.Model):
+    """
+    How far a hash chain (a project ledger or a waste journey) has been verified.
+    Reads only re-hash entries after the checkpoint; chain_checkpoints.py
+    re-verifies whole chains periodically.
+    """
+    __tablename__ = 'chain_checkpoint'
+
+    id = db.Column(db.Integer, primary_key=True)
+    chain_type = db.Column(db.String(30), nullable=False)  # project_ledger, waste_journey
+    chain_id = db.Column(db.String(50), nullable=False)  # project_id or waste_item_id
+
+    # Verified prefix: entry_count entries, ending with last_entry_id / last_hash
+    entry_count = db.Column(db.Integer, nullable=False, default=0)
+    last_entry_id = db.Column(db.Integer, nullable=True)
+    last_hash = db.Column(db.String(64), nullable=True)
+
+    verified_at = db.Column(db.DateTime, default=datetime.utcnow)
+    full_verified_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (db.UniqueConstraint('chain_type', 'chain_id', name='unique_chain_checkpoint'),)
+
+    def __repr__(self):
+        return f"<ChainCheckpoint {self.chain_type}:{self.chain_id} verified={self.entry_count}>"
@@ -13,6 +13,7 @@ from models import (
     InfrastructureProject, WasteBatch, ProjectContributor, ProjectLedger,
     LocalizationString
 )
+from top_contributors import is_top_contributor as is_project_top_contributor
 from datetime import datetime, date
 from sqlalchemy import func, desc
 import logging
@@ -172,24 +173,12 @@ def register_new_feature_routes(app):
             # Get user contributions if logged in
             user_contributions = {}
             if current_user.is_authenticated:
-                for project in projects:
-                    contrib = db.session.query(
-                        func.sum(ProjectContributor.contribution_weight_grams)
-                    ).join(WasteBatch).filter(
-                        WasteBatch.linked_project_id == project.id,
-                        ProjectContributor.user_id == current_user.id
-                    ).scalar() or 0.0
-                    
-                    is_top = ProjectContributor.query.join(WasteBatch).filter(
-                        WasteBatch.linked_project_id == project.id,
-                        ProjectContributor.user_id == current_user.id,
-                        ProjectContributor.is_top_contributor == True
-                    ).first() is not None
-                    
-                    user_contributions[project.id] = {
-                        'weight': float(contrib),
-                        'is_top': is_top
-                    }
+                from project_contributions import get_project_contributions
+                summaries = get_project_contributions([project.id for project in projects], current_user.id)
+                user_contributions = {
+                    project_id: {'weight': summary['weight'], 'is_top': summary['is_top']}
+                    for project_id, summary in summaries.items()
+                }
             
             return render_template('projects_list.html',
                 projects=projects,
@@ -224,7 +213,7 @@ def register_new_feature_routes(app):
             # Calculate progress
             progress = 0.0
             if project.total_plastic_required_grams and project.total_plastic_required_grams > 0:
-                progress = (project.total_plastic_allocated_grams / project.total_plastic_required_grams) * 100.0
+                progress = (float(project.total_plastic_allocated_grams or 0) / float(project.total_plastic_required_grams)) * 100.0
             
             # Get user contribution if logged in
             user_contribution = None
@@ -239,11 +228,7 @@ def register_new_feature_routes(app):
                 
                 user_contribution = float(contrib)
                 
-                is_top_contributor = ProjectContributor.query.join(WasteBatch).filter(
-                    WasteBatch.linked_project_id == project.id,
-                    ProjectContributor.user_id == current_user.id,
-                    ProjectContributor.is_top_contributor == True
-                ).first() is not None
+                is_top_contributor = is_project_top_contributor(project.id, current_user.id)
             
             return render_template('project_detail.html',
                 project=project,
@@ -0,0 +1,273 @@
+"""
+In-memory spatial index of pickup partners.
+
+Matching a pickup to partners used to load every active partner, test
+accepted_materials with a substring match, and run a Python haversine per
+partner on every request. This index keeps a snapshot of the active partners:
+
+- Grid buckets of GRID_DEGREES cells. Each partner is listed in every cell its
+  service circle overlaps, so a point's cell holds exactly the partners that
+  might serve it.
+- Each partner's accepted_materials_mask, so a material filter is one
+  vectorised AND (see materials.py).
+- NumPy arrays of base coordinates and service radii. The haversine for the
+  surviving candidates is computed in one vectorised call.
+
+The snapshot is rebuilt after a commit that touches a partner in this
+process. Other processes notice the change within INDEX_CHECK_SECONDS,
+through a count / max(updated_at) fingerprint.
+"""
+
+import os
+import sys
+import math
+import time
+import threading
+import numpy as np
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+from app import db
+from models import PickupPartner
+from geo import haversine_km
+from materials import material_mask, matches, ANY
+
+# Grid cell size in degrees (about 11 km of latitude)
+GRID_DEGREES = 0.1
+
+# Kilometres per degree of latitude
+KM_PER_DEGREE = 111.32
+
+INDEX_CHECK_SECONDS = int(os.environ.get('PARTNER_INDEX_CHECK_SECONDS', '30'))
+
+
+def _cell(value):
+    return math.floor(value / GRID_DEGREES)
+
+
+class PartnerIndex:
+    """Immutable snapshot of the active partners, queried by location and material"""
+
+    def __init__(self, partners):
+        """
+        Args:
+            partners: Iterable of dictionaries with id, name, organization_type,
+                      contact_phone, lat, lng, radius_km and mask (accepted material bits)
+        """
+        self.partners = list(partners)
+        self.lats = np.array([p['lat'] for p in self.partners], dtype=np.float64)
+        self.lngs = np.array([p['lng'] for p in self.partners], dtype=np.float64)
+        self.radii = np.array([p['radius_km'] for p in self.partners], dtype=np.float64)
+
+        self.masks = np.array([p['mask'] for p in self.partners], dtype=np.int64)
+
+        cells = {}
+        for i, partner in enumerate(self.partners):
+            # Bounding box of the service circle, in cells
+            dlat = partner['radius_km'] / KM_PER_DEGREE
+            dlng = partner['radius_km'] / (KM_PER_DEGREE * max(math.cos(math.radians(partner['lat'])), 0.01))
+            for cy in range(_cell(partner['lat'] - dlat), _cell(partner['lat'] + dlat) + 1):
+                for cx in range(_cell(partner['lng'] - dlng), _cell(partner['lng'] + dlng) + 1):
+                    cells.setdefault((cy, cx), []).append(i)
+        self.cells = {key: np.array(members, dtype=np.int32) for key, members in cells.items()}
+
+    def __len__(self):
+        return len(self.partners)
+
+    def nearest(self, lat, lng, material=None, limit=5, match=ANY):
+        """
+        Partners whose service area covers a point, nearest first.
+
+        Args:
+            lat, lng: Pickup location in degrees
+            material: Only partners accepting this material, or any / all of
+                      several (comma-separated or a list); None for no filter
+            limit: Maximum number of partners (None for all)
+            match: materials.ANY or materials.ALL
+
+        Returns:
+            List of (partner dictionary, distance_km)
+        """
+        candidates = self.cells.get((_cell(lat), _cell(lng)))
+        if candidates is None:
+            return []
+
+        if material:
+            bits = material_mask(material)
+            if not bits:
+                return []
+            candidates = candidates[matches(self.masks[candidates], bits, match)]
+
+        distances = haversine_km(lat, lng, self.lats[candidates], self.lngs[candidates])
+        within = distances <= self.radii[candidates]
+        candidates, distances = candidates[within], distances[within]
+
+        order = np.argsort(distances, kind='stable')
+        if limit is not None:
+            order = order[:limit]
+        return [(self.partners[i], float(distances[j])) for i, j in zip(candidates[order], order)]
+
+
+# ============================================================================
+# SHARED INDEX
+# ============================================================================
+
+_index = None
+_fingerprint = None
+_checked_at = 0.0
+_stale = True
+_index_lock = threading.Lock()
+
+
+def _load_partners():
+    rows = db.session.query(
+        PickupPartner.id, PickupPartner.name, PickupPartner.organization_type, PickupPartner.contact_phone,
+        PickupPartner.base_location_lat, PickupPartner.base_location_lng, PickupPartner.service_radius_km,
+        PickupPartner.accepted_materials_mask
+    ).filter(PickupPartner.is_active == True).order_by(PickupPartner.id).all()
+
+    return [
+        {
+            'id': partner_id,
+            'name': name,
+            'organization_type': organization_type,
+            'contact_phone': contact_phone,
+            'lat': float(lat),
+            'lng': float(lng),
+            'radius_km': float(radius if radius is not None else 10.0),
+            'mask': mask or 0
+        }
+        for partner_id, name, organization_type, contact_phone, lat, lng, radius, mask in rows
+    ]
+
+
+def _partner_fingerprint():
+    count, last_updated = db.session.query(func.count(PickupPartner.id), func.max(PickupPartner.updated_at)).one()
+    return count, last_updated
+
+
+def get_partner_index():
+    """
+    The current partner index, rebuilding it if partners changed.
+
+    Returns:
+        PartnerIndex
+    """
+    global _index, _fingerprint, _checked_at, _stale
+
+    if _index is not None and not _stale and time.monotonic() - _checked_at < INDEX_CHECK_SECONDS:
+        return _index
+
+    with _index_lock:
+        if _index is not None and not _stale and time.monotonic() - _checked_at < INDEX_CHECK_SECONDS:
+            return _index
+
+        fingerprint = _partner_fingerprint()
+        if _index is None or _stale or fingerprint != _fingerprint:
+            _stale = False
+            _index = PartnerIndex(_load_partners())
+            _fingerprint = fingerprint
+        _checked_at = time.monotonic()
+        return _index
+
+
+def invalidate_partner_index():
+    """Rebuild the index on its next use"""
+    global _stale
+    _stale = True
+
+
+def find_nearest_partners(lat, lng, material=None, limit=5, match=ANY):
+    """
+    Active partners that serve a location, nearest first.
+
+    Args:
+        lat, lng: Pickup location in degrees
+        material: Waste type the partner must accept, or several (None for any)
+        limit: Maximum number of partners
+        match: materials.ANY or materials.ALL when several materials are given
+
+    Returns:
+        List of (partner dictionary, distance_km); the dictionary has id, name,
+        organization_type and contact_phone
+    """
+    return get_partner_index().nearest(float(lat), float(lng), material, limit, match)
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_partner_changes(session, flush_context):
+    if any(isinstance(obj, PickupPartner) for obj in list(session.new) + list(session.dirty) + list(session.deleted)):
+        session.info['partners_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _refresh_after_commit(session):
+    if session.info.pop('partners_changed', False):
+        invalidate_partner_index()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_partner_changes(session):
+    session.info.pop('partners_changed', None)
+
+
+# ============================================================================
+# BENCHMARK
+# ============================================================================
+
+def benchmark(n_partners=10000, n_requests=1000):
+    """
+    Match n_requests random pickups against n_partners synthetic partners around
+    Bangalore, with the old per-partner loop and with the index.
+    """
+    import random
+    from pickup_routes import _calculate_distance
+
+    rng = random.Random(43)
+    materials = ['Plastic', 'Paper', 'Glass', 'Metal', 'E-waste', 'Organic']
+    partners = []
+    for i in range(n_partners):
+        accepted = rng.sample(materials, rng.randint(1, 3))
+        partners.append({
+            'id': i + 1, 'name': f'Partner {i}', 'organization_type': 'NGO', 'contact_phone': '',
+            'lat': 12.97 + rng.uniform(-0.5, 0.5), 'lng': 77.59 + rng.uniform(-0.5, 0.5),
+            'radius_km': rng.choice([5.0, 10.0, 15.0]), 'mask': material_mask(accepted)
+        })
+    requests = [
+        (12.97 + rng.uniform(-0.5, 0.5), 77.59 + rng.uniform(-0.5, 0.5), rng.choice(materials))
+        for _ in range(n_requests)
+    ]
+
+    def linear(lat, lng, material):
+        matches = []
+        bits = material_mask(material)
+        for p in partners:
+            if p['mask'] & bits:
+                distance = _calculate_distance(lat, lng, p['lat'], p['lng'])
+                if distance <= p['radius_km']:
+                    matches.append((distance, p['id']))
+        matches.sort()
+        return [partner_id for _, partner_id in matches[:5]]
+
+    started = time.perf_counter()
+    index = PartnerIndex(partners)
+    build_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    expected = [linear(*r) for r in requests]
+    linear_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    found = [[p['id'] for p, _ in index.nearest(*r)] for r in requests]
+    index_time = time.perf_counter() - started
+
+    print(f"{n_partners} partners, index built in {build_time * 1e3:.0f} ms")
+    print(f"linear scan: {n_requests / linear_time:,.0f} req/s ({linear_time / n_requests * 1e3:.2f} ms each, "
+          f"excluding loading every partner from the database)")
+    print(f"index:       {n_requests / index_time:,.0f} req/s ({index_time / n_requests * 1e3:.3f} ms each)")
+    ok = found == expected
+    print("OK: same partners in the same order" if ok else "FAIL: results differ")
+    return ok
+
+
+if __name__ == '__main__':
+    sys.exit(0 if benchmark() else 1)
@@ -8,12 +8,34 @@ from flask_login import login_required, current_user
 from app import db
 from models import PickupRequest, PickupPartner, PickupTimeSlot, User
 from datetime import datetime, date, timedelta
+import os
 import logging
 import uuid
 import math
+from partner_index import find_nearest_partners
+import pickup_assignment
+import route_planner
+from materials import MATERIALS, ANY, ALL, accepts
 
 logger = logging.getLogger(__name__)
 
+# Comma-separated emails of the accounts allowed to run pickup admin actions
+PICKUP_ADMIN_EMAILS = {
+    email.strip().lower() for email in os.environ.get('PICKUP_ADMIN_EMAILS', '').split(',') if email.strip()
+}
+
+
+def is_pickup_admin(user):
+    """Whether a user is listed in PICKUP_ADMIN_EMAILS"""
+    email = (getattr(user, 'email', None) or '').strip().lower()
+    return bool(email) and email in PICKUP_ADMIN_EMAILS
+
+
+def is_partner_account(user, partner):
+    """Whether a user is the partner's own account (same email as the partner's contact email)"""
+    email = (getattr(user, 'email', None) or '').strip().lower()
+    return bool(email) and email == (partner.contact_email or '').strip().lower()
+
 
 def register_pickup_routes(app):
     """Register all pickup-related routes (isolated from existing features)"""
@@ -105,8 +127,10 @@ def register_pickup_routes(app):
                 db.session.add(pickup)
                 db.session.commit()
 
-                # Auto-assign to nearest partner (async/simplified)
-                assigned_partner = _find_and_assign_nearest_partner(pickup)
+                # Auto-assign to nearest partner, unless the periodic batch assignment is used
+                assigned_partner = None
+                if pickup_assignment.ASSIGNMENT_MODE == 'immediate':
+                    assigned_partner = _find_and_assign_nearest_partner(pickup)
 
                 if assigned_partner:
                     flash(f"Pickup request submitted! {assigned_partner.name} will contact you shortly.", "success")
@@ -217,8 +241,19 @@ def register_pickup_routes(app):
     def pickup_partners_admin():
         """Admin page to manage pickup partners"""
         # TODO: Add admin authentication check
-        partners = PickupPartner.query.filter_by(is_active=True).all()
-        return render_template('pickup_partners_admin.html', partners=partners)
+        selected = request.args.getlist('material')
+        match = ALL if request.args.get('match') == ALL else ANY
+
+        query = PickupPartner.query.filter_by(is_active=True)
+        if selected:
+            query = query.filter(accepts(PickupPartner.accepted_materials_mask, selected, match))
+        partners = query.all()
+        return render_template('pickup_partners_admin.html',
+            partners=partners,
+            materials=MATERIALS,
+            selected_materials=selected,
+            match=match
+        )
 
     @app.route('/pickup/admin/requests')
     @login_required
@@ -235,7 +270,8 @@ def register_pickup_routes(app):
 
         return render_template('pickup_requests_admin.html',
             requests=requests,
-            status_filter=status_filter
+            status_filter=status_filter,
+            can_assign_batch=is_pickup_admin(current_user)
         )
 
     @app.route('/pickup/admin/assign/<request_id>', methods=['POST'])
@@ -260,6 +296,22 @@ def register_pickup_routes(app):
             flash("Error assigning pickup.", "danger")
             return redirect(url_for('pickup_requests_admin'))
 
+    @app.route('/pickup/admin/assign-batch', methods=['POST'])
+    @login_required
+    def admin_assign_pickups_batch():
+        """Assign every open request at once, respecting partner slot capacity"""
+        if not is_pickup_admin(current_user):
+            flash("You do not have permission to assign pickups.", "danger")
+            return redirect(url_for('pickup_requests_admin'))
+
+        try:
+            summary = pickup_assignment.assign_requested_pickups()
+            flash(f"Assigned {summary['assigned']} of {summary['requested']} open pickup requests.", "success")
+        except Exception:
+            # Logged and rolled back by assign_requested_pickups
+            flash("Error assigning pickups.", "danger")
+        return redirect(url_for('pickup_requests_admin'))
+
     @app.route('/pickup/admin/update-status/<request_id>', methods=['POST'])
     @login_required
     def admin_update_pickup_status(request_id):
@@ -278,6 +330,10 @@ def register_pickup_routes(app):
                 pickup.collected_weight_kg = float(collected_weight)
 
             db.session.commit()
+
+            if new_status == 'Completed':
+                from rewards import award_pickup_rewards
+                award_pickup_rewards([pickup.id])
             flash("Pickup status updated.", "success")
             return redirect(url_for('pickup_requests_admin'))
         except Exception as e:
@@ -298,32 +354,24 @@ def register_pickup_routes(app):
             lat = float(request.args.get('lat'))
             lng = float(request.args.get('lng'))
             waste_type = request.args.get('waste_type', '')
-
-            partners = PickupPartner.query.filter_by(is_active=True).all()
-
-            # Filter by accepted materials
-            if waste_type:
-                partners = [p for p in partners if waste_type in p.accepted_materials]
-
-            # Calculate distance and filter by service radius
-            available_partners = []
-            for partner in partners:
-                distance = _calculate_distance(lat, lng, partner.base_location_lat, partner.base_location_lng)
-                if distance <= partner.service_radius_km:
-                    available_partners.append({
-                        'id': partner.id,
-                        'name': partner.name,
-                        'organization_type': partner.organization_type,
-                        'distance_km': round(distance, 2),
-                        'contact_phone': partner.contact_phone
-                    })
-
-            # Sort by distance
-            available_partners.sort(key=lambda x: x['distance_km'])
+            match = ALL if request.args.get('match') == ALL else ANY
+
+            # Nearest partners that accept the material (or any / all of a
+            # comma-separated list) and serve this location
+            available_partners = [
+                {
+                    'id': partner['id'],
+                    'name': partner['name'],
+                    'organization_type': partner['organization_type'],
+                    'distance_km': round(distance, 2),
+                    'contact_phone': partner['contact_phone']
+                }
+                for partner, distance in find_nearest_partners(lat, lng, waste_type or None, limit=5, match=match)
+            ]
 
             return jsonify({
                 'success': True,
-                'partners': available_partners[:5]  # Return top 5 nearest
+                'partners': available_partners  # Top 5 nearest
             })
         except Exception as e:
             logger.error(f"Error getting available partners: {e}")
@@ -356,8 +404,9 @@ def register_pickup_routes(app):
             db.session.add(pickup)
             db.session.commit()
 
-            # Auto-assign partner
-            _find_and_assign_nearest_partner(pickup)
+            # Auto-assign partner, unless the periodic batch assignment is used
+            if pickup_assignment.ASSIGNMENT_MODE == 'immediate':
+                _find_and_assign_nearest_partner(pickup)
 
             return jsonify({
                 'success': True,
@@ -370,6 +419,31 @@ def register_pickup_routes(app):
             db.session.rollback()
             return jsonify({'success': False, 'error': str(e)}), 500
 
+    @app.route('/api/pickup/partner/<int:partner_id>/route', methods=['GET'])
+    @login_required
+    def api_partner_route(partner_id):
+        """Ordered pickup route for a partner's day (date=YYYY-MM-DD, default today)"""
+        partner = PickupPartner.query.get(partner_id)
+        if partner is None:
+            return jsonify({'success': False, 'error': 'Partner not found'}), 404
+        # The route lists customers' names, phones and addresses
+        if not (is_pickup_admin(current_user) or is_partner_account(current_user, partner)):
+            return jsonify({'success': False, 'error': 'Not allowed to view this route'}), 403
+
+        try:
+            day = datetime.strptime(request.args['date'], '%Y-%m-%d').date() if request.args.get('date') else None
+        except ValueError:
+            return jsonify({'success': False, 'error': 'date must be YYYY-MM-DD'}), 400
+
+        try:
+            route = route_planner.plan_partner_day(partner_id, day)
+            if route is None:
+                return jsonify({'success': False, 'error': 'Partner not found'}), 404
+            return jsonify({'success': True, 'route': route})
+        except Exception as e:
+            logger.error(f"Error planning partner route: {e}")
+            return jsonify({'success': False, 'error': str(e)}), 500
+
     @app.route('/api/pickup/status/<request_id>', methods=['GET'])
     @login_required
     def api_pickup_status(request_id):
@@ -435,31 +509,12 @@ def _find_and_assign_nearest_partner(pickup):
     Simple assignment logic - can be enhanced later
     """
     try:
-        # Get all active partners
-        partners = PickupPartner.query.filter_by(is_active=True).all()
-
-        # Filter by accepted materials
-        matching_partners = [
-            p for p in partners
-            if pickup.waste_type in p.accepted_materials
-        ]
-
-        if not matching_partners:
+        # Nearest active partner that accepts the material and serves the address
+        matches = find_nearest_partners(pickup.pickup_lat, pickup.pickup_lng, pickup.waste_type, limit=1)
+        if not matches:
             return None
 
-        # Find nearest partner
-        nearest_partner = None
-        min_distance = float('inf')
-
-        for partner in matching_partners:
-            distance = _calculate_distance(
-                pickup.pickup_lat, pickup.pickup_lng,
-                partner.base_location_lat, partner.base_location_lng
-            )
-
-            if distance <= partner.service_radius_km and distance < min_distance:
-                min_distance = distance
-                nearest_partner = partner
+        nearest_partner = PickupPartner.query.get(matches[0][0]['id'])
 
         # Assign if found
         if nearest_partner:
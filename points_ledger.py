@@ -0,0 +1,307 @@
+"""
+Append-only eco-points ledger for ReGenWorks.
+
+Every award is a Reward row; User.eco_points is a running balance that is only
+ever changed with an atomic SQL increment (eco_points = eco_points + :points),
+never a read-modify-write on the ORM object, so concurrent awards can't drop
+points. The balance can always be recomputed from the ledger.
+"""
+
+import sys
+import logging
+import argparse
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import bindparam, event, func, insert, update
+from app import db
+from models import User, Reward
+
+# Ledger rows that carry balances from before the ledger existed
+OPENING_BALANCE_TYPE = 'opening_balance'
+
+
+def credit(user_id, points, description, reward_type, commit=False):
+    """
+    Append a single award to the ledger and increment the user's balance.
+
+    Args:
+        user_id: ID of the user to credit
+        points: Number of points (may be negative for redemptions)
+        description: Why the points were awarded
+        reward_type: Type of reward (drop_off, listing, achievement, ...)
+        commit: Commit the session before returning
+
+    Returns:
+        The new Reward row, or None if nothing was credited
+    """
+    if not user_id or not points:
+        return None
+
+    reward = Reward(
+        user_id=user_id,
+        points=int(points),
+        description=description,
+        reward_type=reward_type,
+        created_at=datetime.utcnow()
+    )
+    db.session.add(reward)
+    _increment_balances({user_id: int(points)})
+    _queue_for_leaderboard([(user_id, int(points), reward.created_at)])
+
+    if commit:
+        db.session.commit()
+    return reward
+
+
+def debit(user_id, points, description, reward_type, commit=False):
+    """
+    Spend points if (and only if) the user's balance covers them.
+    The balance check and the decrement are one conditional UPDATE, so two
+    concurrent redemptions can never take a balance below zero.
+
+    Args:
+        user_id: ID of the user to debit
+        points: Number of points to spend (positive)
+        description: What the points were spent on
+        reward_type: Type of ledger entry (e.g. redemption)
+        commit: Commit the session before returning
+
+    Returns:
+        The new (negative) Reward row, or None if the balance was insufficient
+    """
+    points = int(points)
+    if not user_id or points <= 0:
+        return None
+
+    user_table = User.__table__
+    balance = func.coalesce(user_table.c.eco_points, 0)
+    result = db.session.execute(
+        update(user_table).where(
+            user_table.c.id == user_id,
+            balance >= points
+        ).values(eco_points=balance - points)
+    )
+    if result.rowcount != 1:
+        return None
+
+    reward = Reward(
+        user_id=user_id,
+        points=-points,
+        description=description,
+        reward_type=reward_type,
+        created_at=datetime.utcnow()
+    )
+    db.session.add(reward)
+    _expire_balances({user_id})
+    _queue_for_leaderboard([(user_id, -points, reward.created_at)])
+
+    if commit:
+        db.session.commit()
+    return reward
+
+
+def credit_many(awards, commit=False):
+    """
+    Append a batch of awards with one INSERT and one balance UPDATE.
+    Used for bulk scans, pickup completions and achievement unlocks.
+
+    Args:
+        awards: Iterable of dicts with user_id, points, description and reward_type
+        commit: Commit the session before returning
+
+    Returns:
+        Number of ledger rows written
+    """
+    now = datetime.utcnow()
+    rows = [
+        {
+            'user_id': award['user_id'],
+            'points': int(award['points']),
+            'description': award['description'],
+            'reward_type': award['reward_type'],
+            'created_at': now
+        }
+        for award in awards
+        if award.get('user_id') and award.get('points')
+    ]
+    if not rows:
+        return 0
+
+    db.session.execute(insert(Reward.__table__), rows)
+
+    totals = defaultdict(int)
+    for row in rows:
+        totals[row['user_id']] += row['points']
+    _increment_balances(totals)
+    _queue_for_leaderboard([(row['user_id'], row['points'], now) for row in rows])
+
+    if commit:
+        db.session.commit()
+    return len(rows)
+
+
+def _increment_balances(totals):
+    """Atomically add {user_id: points} to balances in a single executemany"""
+    user_table = User.__table__
+    db.session.execute(
+        update(user_table).where(
+            user_table.c.id == bindparam('uid')
+        ).values(
+            eco_points=func.coalesce(user_table.c.eco_points, 0) + bindparam('delta')
+        ),
+        [{'uid': user_id, 'delta': delta} for user_id, delta in totals.items()]
+    )
+    _expire_balances(totals)
+
+
+def _expire_balances(user_ids):
+    """Loaded User objects now hold a stale balance; reload it on next access"""
+    for obj in list(db.session.identity_map.values()):
+        if isinstance(obj, User) and obj.id in user_ids:
+            db.session.expire(obj, ['eco_points'])
+
+
+def _queue_for_leaderboard(entries):
+    """Hold awards until the transaction commits, then move users on the leaderboards"""
+    db.session.info.setdefault('pending_points', []).extend(entries)
+
+
+@event.listens_for(db.session, 'before_commit')
+def _announce_committing_points(session):
+    pending = session.info.get('pending_points')
+    if pending and 'leaderboard_commit' not in session.info:
+        import leaderboard
+        session.info['leaderboard_commit'] = leaderboard.begin_commit({user_id for user_id, _, _ in pending})
+
+
+@event.listens_for(db.session, 'after_commit')
+def _publish_committed_points(session):
+    pending = session.info.pop('pending_points', None)
+    if not pending:
+        return
+
+    import leaderboard
+    for user_id, points, awarded_at in pending:
+        leaderboard.record_points(user_id, points, awarded_at)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_rolled_back_points(session):
+    session.info.pop('pending_points', None)
+
+
+@event.listens_for(db.session, 'after_transaction_end')
+def _end_points_commit(session, transaction):
+    # Runs after after_commit, and also when a failed commit is closed without a rollback
+    token = session.info.get('leaderboard_commit')
+    if token is not None and transaction.parent is None:
+        import leaderboard
+        session.info.pop('leaderboard_commit')
+        leaderboard.end_commit(token)
+
+
+def get_ledger_balances(user_ids=None):
+    """
+    Recompute balances from the ledger.
+
+    Args:
+        user_ids: Optional list of user IDs to restrict the computation to
+
+    Returns:
+        Dictionary of user_id -> sum of Reward.points
+    """
+    query = db.session.query(Reward.user_id, func.sum(Reward.points))
+    if user_ids is not None:
+        query = query.filter(Reward.user_id.in_(user_ids))
+    return {user_id: int(total or 0) for user_id, total in query.group_by(Reward.user_id).all()}
+
+
+def check_balances(repair=False):
+    """
+    Compare every User.eco_points with the sum of their ledger rows.
+
+    Args:
+        repair: Overwrite mismatched balances with the ledger total
+
+    Returns:
+        List of mismatches (user_id, balance, ledger_total, difference)
+    """
+    ledger = get_ledger_balances()
+    mismatches = []
+
+    for user_id, balance in db.session.query(User.id, User.eco_points).all():
+        balance = balance or 0
+        ledger_total = ledger.get(user_id, 0)
+        if balance != ledger_total:
+            mismatches.append({
+                'user_id': user_id,
+                'balance': balance,
+                'ledger_total': ledger_total,
+                'difference': balance - ledger_total
+            })
+
+    if repair and mismatches:
+        user_table = User.__table__
+        db.session.execute(
+            update(user_table).where(
+                user_table.c.id == bindparam('uid')
+            ).values(eco_points=bindparam('total')),
+            [{'uid': m['user_id'], 'total': m['ledger_total']} for m in mismatches]
+        )
+        db.session.commit()
+        logging.info(f"Repaired {len(mismatches)} balances from the points ledger")
+
+        import leaderboard
+        leaderboard.invalidate('all-time')
+
+    return mismatches
+
+
+def backfill_opening_balances():
+    """
+    One-off migration: record balances that predate the ledger (points added
+    directly to User.eco_points) as opening_balance rows, without touching the
+    balances themselves. Run once before relying on check_balances(repair=True).
+
+    Returns:
+        Number of opening balance rows written
+    """
+    now = datetime.utcnow()
+    rows = [
+        {
+            'user_id': m['user_id'],
+            'points': m['difference'],
+            'description': 'Opening balance carried over from before the points ledger',
+            'reward_type': OPENING_BALANCE_TYPE,
+            'created_at': now
+        }
+        for m in check_balances()
+    ]
+    if rows:
+        db.session.execute(insert(Reward.__table__), rows)
+        db.session.commit()
+    return len(rows)
+
+
+def main(argv=None):
+    """Command line entry point for the consistency checker"""
+    parser = argparse.ArgumentParser(description='Check eco-point balances against the points ledger')
+    parser.add_argument('--backfill', action='store_true', help='record pre-ledger balances as opening_balance rows')
+    parser.add_argument('--repair', action='store_true', help='overwrite mismatched balances with the ledger total')
+    args = parser.parse_args(argv)
+
+    from app import app
+    with app.app_context():
+        if args.backfill:
+            print(f"Wrote {backfill_opening_balances()} opening balance rows")
+
+        mismatches = check_balances(repair=args.repair)
+        for m in mismatches:
+            print(f"user {m['user_id']}: balance={m['balance']} ledger={m['ledger_total']} diff={m['difference']:+d}")
+        print(f"{len(mismatches)} mismatched balances" + (" (repaired)" if args.repair and mismatches else ""))
+
+    return 1 if mismatches and not args.repair else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""
+Per-project contribution read model for ReGenWorks.
+
+Project listings show, for every project, the signed-in user's contributed
+weight, whether they are one of its top contributors, and how many people have
+contributed. This is answered for all listed projects by a single grouped query
+over project_contributor joined to waste_batch. The cost of a page does not
+grow with the number of projects on it.
+"""
+
+import sys
+import time
+from sqlalchemy import func, case, and_, false
+from app import db
+from models import WasteBatch, ProjectContributor
+
+
+def empty_contribution():
+    """Summary for a project nobody has contributed to"""
+    return {'weight': 0.0, 'is_top': False, 'contributors': 0}
+
+
+def get_project_contributions(project_ids, user_id=None):
+    """
+    Get contribution summaries for a set of projects with one query.
+
+    Args:
+        project_ids: InfrastructureProject.id values (integer primary keys)
+        user_id: User whose contribution is reported (None for anonymous visitors)
+
+    Returns:
+        Dictionary of project id -> {'weight', 'is_top', 'contributors'};
+        every requested project is present
+    """
+    summaries = {project_id: empty_contribution() for project_id in project_ids}
+    if not summaries:
+        return summaries
+
+    is_user = ProjectContributor.user_id == user_id if user_id is not None else false()
+
+    rows = db.session.query(
+        WasteBatch.linked_project_id,
+        func.sum(case((is_user, ProjectContributor.contribution_weight_grams), else_=0)),
+        func.max(case((and_(is_user, ProjectContributor.is_top_contributor == True), 1), else_=0)),
+        func.count(func.distinct(ProjectContributor.user_id))
+    ).join(
+        WasteBatch, ProjectContributor.batch_id == WasteBatch.id
+    ).filter(
+        WasteBatch.linked_project_id.in_(list(summaries))
+    ).group_by(WasteBatch.linked_project_id).all()
+
+    for project_id, weight, is_top, contributors in rows:
+        summaries[project_id] = {
+            'weight': float(weight or 0),
+            'is_top': bool(is_top),
+            'contributors': int(contributors or 0)
+        }
+
+    return summaries
+
+
+def benchmark(n_projects=200, contributions_per_project=20):
+    """
+    Compare the per-project queries the listing pages used to run with the
+    grouped read model, on the configured database (the seeded rows are
+    deleted afterwards).
+    """
+    from datetime import datetime
+    from app import app
+    from models import User, InfrastructureProject
+    from contribution_chain import count_queries
+
+    stamp = datetime.utcnow().strftime('%Y%m%d%H%M%S%f')
+    prefix = f'pcbench_{stamp}'
+
+    try:
+        with app.app_context():
+            users = [User(username=f'{prefix}_{i}', email=f'{prefix}_{i}@example.com') for i in range(10)]
+            db.session.add_all(users)
+            projects = [
+                InfrastructureProject(
+                    project_id=f'{prefix}_{i}', project_name=f'Bench project {i}', project_type='bench',
+                    location_lat=12.97, location_lng=77.59, total_plastic_required_grams=100000
+                )
+                for i in range(n_projects)
+            ]
+            db.session.add_all(projects)
+            db.session.flush()
+
+            for i, project in enumerate(projects):
+                batch = WasteBatch(batch_id=f'{prefix}_{i}', material_type='Plastic',
+                                   total_weight_grams=1000, status='allocated', linked_project_id=project.id)
+                db.session.add(batch)
+                db.session.flush()
+                for n in range(contributions_per_project):
+                    db.session.add(ProjectContributor(user_id=users[n % len(users)].id, batch_id=batch.id,
+                                                      contribution_weight_grams=50, is_top_contributor=(n == 0)))
+            db.session.commit()
+
+            user_id = users[0].id
+            project_ids = [project.id for project in projects]
+
+            with count_queries() as per_project_queries:
+                started = time.perf_counter()
+                expected = {}
+                for project_id in project_ids:
+                    weight = db.session.query(func.sum(ProjectContributor.contribution_weight_grams)).join(WasteBatch).filter(
+                        WasteBatch.linked_project_id == project_id, ProjectContributor.user_id == user_id
+                    ).scalar() or 0.0
+                    is_top = ProjectContributor.query.join(WasteBatch).filter(
+                        WasteBatch.linked_project_id == project_id, ProjectContributor.user_id == user_id,
+                        ProjectContributor.is_top_contributor == True
+                    ).first() is not None
+                    contributors = db.session.query(func.count(func.distinct(ProjectContributor.user_id))).join(WasteBatch).filter(
+                        WasteBatch.linked_project_id == project_id
+                    ).scalar() or 0
+                    expected[project_id] = {'weight': float(weight), 'is_top': is_top, 'contributors': contributors}
+                per_project_time = time.perf_counter() - started
+
+            with count_queries() as grouped_queries:
+                started = time.perf_counter()
+                summaries = get_project_contributions(project_ids, user_id)
+                grouped_time = time.perf_counter() - started
+    finally:
+        # Remove the bench users, projects, batches and contributions from the store
+        with app.app_context():
+            db.session.rollback()
+            user_ids = [user_id for (user_id,) in db.session.query(User.id).filter(
+                User.username.like(f'{prefix}_%')
+            ).all()]
+            project_ids = [project_id for (project_id,) in db.session.query(InfrastructureProject.id).filter(
+                InfrastructureProject.project_id.like(f'{prefix}_%')
+            ).all()]
+            ProjectContributor.query.filter(ProjectContributor.user_id.in_(user_ids)).delete(synchronize_session=False)
+            WasteBatch.query.filter(WasteBatch.linked_project_id.in_(project_ids)).delete(synchronize_session=False)
+            InfrastructureProject.query.filter(InfrastructureProject.id.in_(project_ids)).delete(synchronize_session=False)
+            User.query.filter(User.id.in_(user_ids)).delete(synchronize_session=False)
+            db.session.commit()
+
+    print(f"{n_projects} projects: per-project {per_project_queries[0]} queries in {per_project_time * 1e3:.1f} ms, "
+          f"read model {grouped_queries[0]} query in {grouped_time * 1e3:.1f} ms")
+    ok = summaries == expected and grouped_queries[0] == 1
+    print("OK: same results" if ok else "FAIL: results differ")
+    return ok
+
+
+if __name__ == '__main__':
+    sys.exit(0 if benchmark() else 1)
@@ -4,8 +4,14 @@ Rewards and gamification system for ReGenWorks.
 
 from datetime import datetime, timedelta
 from flask_login import current_user
+from sqlalchemy import case, func
 from app import db
-from models import User, WasteItem, Achievement, UserAchievement, Reward, DropLocation
+from models import User, WasteItem, Achievement, UserAchievement, Reward, DropLocation, PickupRequest
+import points_ledger
+
+# Doorstep pickups earn points per kilogram collected
+PICKUP_POINTS_PER_KG = 10
+PICKUP_MIN_POINTS = 10
 
 def award_points(user_id, points, description, reward_type):
     """
@@ -24,22 +30,13 @@ def award_points(user_id, points, description, reward_type):
     if not user:
         return None
         
-    # Create a reward record
-    reward = Reward(
-        user_id=user_id,
-        points=points,
-        description=description,
-        reward_type=reward_type
-    )
-    
-    # Add points to user
-    user.eco_points += points
+    # Append to the points ledger (atomic balance increment)
+    reward = points_ledger.credit(user_id, points, description, reward_type)
     
     # Update streak if applicable
     _update_recycling_streak(user)
     
     # Save changes
-    db.session.add(reward)
     db.session.commit()
     
     # Check for new achievements
@@ -105,6 +102,47 @@ def award_points_for_listing(user_id, waste_item_id):
     
     return award_points(user_id, points, description, "listing")
 
+def award_pickup_rewards(pickup_ids=None):
+    """
+    Award points for completed pickups that haven't been rewarded yet.
+    All eligible pickups are credited in one ledger batch.
+    
+    Args:
+        pickup_ids: Optional list of PickupRequest IDs to restrict to
+        
+    Returns:
+        Number of pickups rewarded
+    """
+    query = PickupRequest.query.filter(
+        PickupRequest.rewards_eligible == True,
+        PickupRequest.rewards_awarded == False
+    )
+    if pickup_ids is not None:
+        query = query.filter(PickupRequest.id.in_(pickup_ids))
+    
+    # Lock the rows so two workers can't reward the same pickup
+    pickups = query.with_for_update(skip_locked=True).all()
+    if not pickups:
+        return 0
+    
+    awards = []
+    for pickup in pickups:
+        weight_kg = float(pickup.collected_weight_kg or pickup.estimated_quantity or 0)
+        points = max(PICKUP_MIN_POINTS, int(weight_kg * PICKUP_POINTS_PER_KG))
+        
+        pickup.rewards_awarded = True
+        pickup.rewards_points = points
+        awards.append({
+            'user_id': pickup.user_id,
+            'points': points,
+            'description': f"Doorstep pickup {pickup.request_id} completed ({pickup.waste_type})",
+            'reward_type': "pickup"
+        })
+    
+    points_ledger.credit_many(awards)
+    db.session.commit()
+    return len(pickups)
+
 def check_achievements(user_id):
     """
     Check and award any achievements the user has earned
@@ -119,58 +157,46 @@ def check_achievements(user_id):
     if not user:
         return None
     
-    # Get all available achievements
-    achievements = Achievement.query.all()
+    # Get achievements the user doesn't have yet
+    earned_ids = {
+        achievement_id for (achievement_id,) in db.session.query(
+            UserAchievement.achievement_id
+        ).filter_by(user_id=user_id).all()
+    }
+    achievements = [a for a in Achievement.query.all() if a.id not in earned_ids]
+    if not achievements:
+        return []
+    
+    # Count the user's items for every criterion in a single query
+    recyclable_count, plastic_count, ewaste_count, listed_count = db.session.query(
+        func.count(case((WasteItem.is_recyclable == True, 1))),
+        func.count(case((WasteItem.material == "Plastic", 1))),
+        func.count(case((WasteItem.is_ewaste == True, 1))),
+        func.count(case((WasteItem.is_listed == True, 1)))
+    ).filter(WasteItem.user_id == user_id).one()
+    
     earned_achievements = []
+    awards = []
     
     for achievement in achievements:
-        # Skip if user already has this achievement
-        existing = UserAchievement.query.filter_by(
-            user_id=user_id, 
-            achievement_id=achievement.id
-        ).first()
-        
-        if existing:
-            continue
-        
         # Check if user meets criteria for achievement
         is_earned = False
         
         # Achievement: Recycle Rookie (first recycled item)
         if achievement.name == "Recycle Rookie" and achievement.required_items == 1:
-            item_count = WasteItem.query.filter_by(
-                user_id=user_id,
-                is_recyclable=True
-            ).count()
-            
-            is_earned = item_count >= 1
+            is_earned = recyclable_count >= 1
         
         # Achievement: Plastic Hero (5 plastic items)
         elif achievement.name == "Plastic Hero" and achievement.required_material == "Plastic":
-            plastic_items = WasteItem.query.filter_by(
-                user_id=user_id,
-                material="Plastic"
-            ).count()
-            
-            is_earned = plastic_items >= achievement.required_items
+            is_earned = plastic_count >= achievement.required_items
         
         # Achievement: E-Waste Warrior (3 e-waste items)
         elif achievement.name == "E-Waste Warrior" and achievement.required_material == "Electronic":
-            ewaste_items = WasteItem.query.filter_by(
-                user_id=user_id,
-                is_ewaste=True
-            ).count()
-            
-            is_earned = ewaste_items >= achievement.required_items
+            is_earned = ewaste_count >= achievement.required_items
         
         # Achievement: Marketplace Maven (3 listings)
         elif achievement.name == "Marketplace Maven":
-            listings = WasteItem.query.filter_by(
-                user_id=user_id,
-                is_listed=True
-            ).count()
-            
-            is_earned = listings >= achievement.required_items
+            is_earned = listed_count >= achievement.required_items
         
         # Achievement: Community Champion (7-day streak)
         elif achievement.name == "Community Champion":
@@ -185,14 +211,15 @@ def check_achievements(user_id):
             
             db.session.add(user_achievement)
             earned_achievements.append(achievement)
-            
-            # Award points for the achievement
-            award_points(
-                user_id,
-                achievement.points_awarded,
-                f"Earned achievement: {achievement.name}",
-                "achievement"
-            )
+            awards.append({
+                'user_id': user_id,
+                'points': achievement.points_awarded,
+                'description': f"Earned achievement: {achievement.name}",
+                'reward_type': "achievement"
+            })
+    
+    # Award points for all new achievements in one ledger batch
+    points_ledger.credit_many(awards)
     
     db.session.commit()
     return earned_achievements
@@ -0,0 +1,376 @@
+"""
+Rewards catalog and redemption for ReGenWorks.
+
+Stock is only ever changed with conditional UPDATEs
+(stock = stock - 1 WHERE stock > 0), so concurrent redemptions of the last
+unit can't oversell. A redemption debits points in the same transaction as the
+stock decrement; if either side fails the whole transaction rolls back.
+
+Users can also place a short-lived reservation (a held unit) while they
+confirm; reservations that aren't redeemed in time give their unit back.
+"""
+
+import os
+import sys
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import update, or_
+from app import db
+from models import User, Reward, RewardItem, RewardReservation
+import points_ledger
+
+# How long a reserved unit is held before it returns to stock
+RESERVATION_TTL_SECONDS = int(os.environ.get('REWARD_RESERVATION_TTL_SECONDS', 300))
+
+# Initial catalog, seeded the first time the store is opened
+DEFAULT_CATALOG = [
+    {'name': 'Amazon Gift Card', 'points_cost': 2000, 'category': 'vouchers', 'stock': 15,
+     'description': '$20 gift card for eco-friendly purchases', 'icon': 'fa-shopping-bag', 'badge': 'Popular'},
+    {'name': 'Tree Sapling Kit', 'points_cost': 500, 'category': 'plants', 'stock': 50,
+     'description': 'Grow your own tree with our complete sapling kit', 'icon': 'fa-seedling', 'badge': 'New'},
+    {'name': 'Bamboo Coffee Cup', 'points_cost': 750, 'category': 'eco', 'stock': 30,
+     'description': 'Reusable bamboo coffee cup with ReGenWorks logo', 'icon': 'fa-mug-hot', 'badge': None},
+    {'name': 'Restaurant Voucher', 'points_cost': 1500, 'category': 'vouchers', 'stock': 10,
+     'description': '$15 voucher at participating eco-restaurants', 'icon': 'fa-utensils', 'badge': None},
+    {'name': 'Plant a Tree', 'points_cost': 300, 'category': 'donations', 'stock': None,
+     'description': 'Donate to plant trees in deforested areas', 'icon': 'fa-hand-holding-heart', 'badge': 'Impact'},
+    {'name': 'Eco Shopping Bag', 'points_cost': 400, 'category': 'eco', 'stock': 100,
+     'description': 'Reusable shopping bag made from recycled materials', 'icon': 'fa-shopping-tote', 'badge': None},
+    {'name': 'Herb Garden Starter', 'points_cost': 800, 'category': 'plants', 'stock': 25,
+     'description': 'Complete kit to start your indoor herb garden', 'icon': 'fa-leaf', 'badge': None},
+    {'name': 'Clean Water Initiative', 'points_cost': 1000, 'category': 'donations', 'stock': None,
+     'description': 'Provide clean water for a family for a month', 'icon': 'fa-water', 'badge': 'Impact'},
+]
+
+
+class RedemptionError(Exception):
+    """A reservation or redemption could not be completed (message is user-facing)"""
+
+
+def seed_catalog():
+    """Create the default catalog if the store is empty"""
+    if RewardItem.query.first() is not None:
+        return 0
+
+    for order, entry in enumerate(DEFAULT_CATALOG):
+        db.session.add(RewardItem(display_order=order, **entry))
+    db.session.commit()
+    logging.info(f"Seeded rewards catalog with {len(DEFAULT_CATALOG)} items")
+    return len(DEFAULT_CATALOG)
+
+
+def get_catalog():
+    """
+    Get the active rewards, returning expired holds to stock first.
+
+    Returns:
+        List of RewardItem objects in display order
+    """
+    seed_catalog()
+    release_expired_reservations()
+    return RewardItem.query.filter_by(is_active=True).order_by(
+        RewardItem.display_order, RewardItem.id
+    ).all()
+
+
+def _take_unit(item_id):
+    """Conditionally decrement stock by one; returns False if the item is sold out"""
+    item_table = RewardItem.__table__
+    result = db.session.execute(
+        update(item_table).where(
+            item_table.c.id == item_id,
+            item_table.c.is_active == True,
+            or_(item_table.c.stock.is_(None), item_table.c.stock > 0)
+        ).values(stock=item_table.c.stock - 1)  # NULL (unlimited) stays NULL
+    )
+    return result.rowcount == 1
+
+
+def _return_units(item_id, count=1):
+    item_table = RewardItem.__table__
+    db.session.execute(
+        update(item_table).where(
+            item_table.c.id == item_id
+        ).values(stock=item_table.c.stock + count)
+    )
+
+
+def _transition(reservation_id, user_id, from_status, to_status, **values):
+    """
+    Move a reservation between states with a conditional UPDATE.
+    Only one concurrent caller can win a given transition.
+    """
+    table = RewardReservation.__table__
+    conditions = [table.c.id == reservation_id, table.c.status == from_status]
+    if user_id is not None:
+        conditions.append(table.c.user_id == user_id)
+    if from_status == 'held' and to_status == 'redeemed':
+        conditions.append(table.c.expires_at > datetime.utcnow())
+
+    result = db.session.execute(
+        update(table).where(*conditions).values(status=to_status, **values)
+    )
+    return result.rowcount == 1
+
+
+def reserve_item(user_id, item_id):
+    """
+    Hold one unit of an item for a user for RESERVATION_TTL_SECONDS.
+
+    Args:
+        user_id: ID of the user
+        item_id: ID of the RewardItem
+
+    Returns:
+        RewardReservation (an existing live hold is returned as-is)
+
+    Raises:
+        RedemptionError: If the item is unknown, sold out or unaffordable
+    """
+    item = RewardItem.query.get(item_id)
+    if not item or not item.is_active:
+        raise RedemptionError("This reward is no longer available.")
+
+    release_expired_reservations(item_id)
+
+    existing = RewardReservation.query.filter(
+        RewardReservation.user_id == user_id,
+        RewardReservation.item_id == item_id,
+        RewardReservation.status == 'held',
+        RewardReservation.expires_at > datetime.utcnow()
+    ).first()
+    if existing:
+        return existing
+
+    # Early, non-binding check; the binding one happens at redemption
+    user = User.query.get(user_id)
+    if not user or (user.eco_points or 0) < item.points_cost:
+        raise RedemptionError("You don't have enough eco points for this reward.")
+
+    try:
+        if not _take_unit(item_id):
+            raise RedemptionError("Sorry, this reward is out of stock.")
+
+        reservation = RewardReservation(
+            user_id=user_id,
+            item_id=item_id,
+            points_cost=item.points_cost,
+            status='held',
+            expires_at=datetime.utcnow() + timedelta(seconds=RESERVATION_TTL_SECONDS)
+        )
+        db.session.add(reservation)
+        db.session.commit()
+        return reservation
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def redeem_reservation(user_id, reservation_id):
+    """
+    Complete a held reservation: claim it and debit the points in one transaction.
+
+    Raises:
+        RedemptionError: If the hold expired, was already used, or points are insufficient
+    """
+    reservation = RewardReservation.query.get(reservation_id)
+    if not reservation or reservation.user_id != user_id:
+        raise RedemptionError("Reservation not found.")
+
+    try:
+        if not _transition(reservation_id, user_id, 'held', 'redeemed', redeemed_at=datetime.utcnow()):
+            raise RedemptionError("This reservation has expired or was already used.")
+
+        reward = points_ledger.debit(
+            user_id, reservation.points_cost,
+            f"Redeemed reward: {reservation.item.name}", "redemption"
+        )
+        if reward is None:
+            raise RedemptionError("You don't have enough eco points for this reward.")
+
+        db.session.flush()
+        db.session.execute(
+            update(RewardReservation.__table__).where(
+                RewardReservation.__table__.c.id == reservation_id
+            ).values(reward_id=reward.id)
+        )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    db.session.refresh(reservation)
+    return reservation
+
+
+def redeem_item(user_id, item_id):
+    """
+    Redeem an item directly: stock decrement, points debit and the redemption
+    record are committed together or not at all.
+
+    Raises:
+        RedemptionError: If the item is unknown, sold out or unaffordable
+    """
+    item = RewardItem.query.get(item_id)
+    if not item or not item.is_active:
+        raise RedemptionError("This reward is no longer available.")
+
+    try:
+        if not _take_unit(item_id):
+            raise RedemptionError("Sorry, this reward is out of stock.")
+
+        reward = points_ledger.debit(user_id, item.points_cost, f"Redeemed reward: {item.name}", "redemption")
+        if reward is None:
+            raise RedemptionError("You don't have enough eco points for this reward.")
+
+        now = datetime.utcnow()
+        db.session.flush()  # Assigns reward.id
+        reservation = RewardReservation(
+            user_id=user_id,
+            item_id=item_id,
+            points_cost=item.points_cost,
+            status='redeemed',
+            expires_at=now,
+            redeemed_at=now,
+            reward_id=reward.id
+        )
+        db.session.add(reservation)
+        db.session.commit()
+        return reservation
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def cancel_reservation(user_id, reservation_id):
+    """Give a held unit back to stock. Returns True if the hold was released."""
+    reservation = RewardReservation.query.get(reservation_id)
+    if not reservation or reservation.user_id != user_id:
+        return False
+
+    try:
+        if not _transition(reservation_id, user_id, 'held', 'cancelled'):
+            return False
+        _return_units(reservation.item_id)
+        db.session.commit()
+        return True
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def release_expired_reservations(item_id=None):
+    """
+    Return the units of expired holds to stock.
+    Each hold is released with a conditional UPDATE, so a concurrent redemption
+    or a second sweeper can't release (or double-release) the same unit.
+
+    Returns:
+        Number of reservations released
+    """
+    query = db.session.query(RewardReservation.id, RewardReservation.item_id).filter(
+        RewardReservation.status == 'held',
+        RewardReservation.expires_at <= datetime.utcnow()
+    )
+    if item_id is not None:
+        query = query.filter(RewardReservation.item_id == item_id)
+
+    expired = query.all()
+    if not expired:
+        return 0
+
+    released = 0
+    try:
+        for reservation_id, reserved_item_id in expired:
+            if _transition(reservation_id, None, 'held', 'expired'):
+                _return_units(reserved_item_id)
+                released += 1
+        db.session.commit()
+    except Exception as e:
+        logging.error(f"Error releasing expired reward reservations: {e}")
+        db.session.rollback()
+        return 0
+
+    if released:
+        logging.info(f"Released {released} expired reward reservations")
+    return released
+
+
+def load_test(concurrency=50, points_cost=100):
+    """
+    Fire concurrent redemptions at the last unit of an item and check that
+    exactly one succeeds, stock ends at zero and only the winner is debited.
+
+    Uses the configured database; run against PostgreSQL for a realistic result
+    (SQLite serialises writers, so losers may fail with "database is locked").
+    """
+    from app import app
+
+    with app.app_context():
+        stamp = datetime.utcnow().strftime('%Y%m%d%H%M%S%f')
+        item = RewardItem(
+            name=f'Load test item {stamp}', category='eco',
+            points_cost=points_cost, stock=1, is_active=True
+        )
+        db.session.add(item)
+        users = [
+            User(username=f'loadtest_{stamp}_{i}', email=f'loadtest_{stamp}_{i}@example.com', eco_points=points_cost)
+            for i in range(concurrency)
+        ]
+        db.session.add_all(users)
+        db.session.commit()
+        item_id = item.id
+        user_ids = [u.id for u in users]
+
+    try:
+        results = []
+        barrier = threading.Barrier(concurrency)
+
+        def worker(user_id):
+            with app.app_context():
+                barrier.wait()
+                try:
+                    redeem_item(user_id, item_id)
+                    results.append(('ok', user_id))
+                except RedemptionError as e:
+                    results.append(('rejected', str(e)))
+                except Exception as e:
+                    results.append(('error', str(e)))
+                finally:
+                    db.session.remove()
+
+        threads = [threading.Thread(target=worker, args=(user_id,)) for user_id in user_ids]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        with app.app_context():
+            stock = RewardItem.query.get(item_id).stock
+            debited = User.query.filter(User.id.in_(user_ids), User.eco_points < points_cost).count()
+            redeemed = RewardReservation.query.filter_by(item_id=item_id, status='redeemed').count()
+    finally:
+        # Remove the test item, users and their points history from the store
+        with app.app_context():
+            RewardReservation.query.filter_by(item_id=item_id).delete(synchronize_session=False)
+            Reward.query.filter(Reward.user_id.in_(user_ids)).delete(synchronize_session=False)
+            RewardItem.query.filter_by(id=item_id).delete(synchronize_session=False)
+            User.query.filter(User.id.in_(user_ids)).delete(synchronize_session=False)
+            db.session.commit()
+        import leaderboard
+        leaderboard.invalidate()
+
+    successes = sum(1 for status, _ in results if status == 'ok')
+    errors = [detail for status, detail in results if status == 'error']
+    print(f"{concurrency} concurrent redemptions: {successes} succeeded, "
+          f"{len(results) - successes - len(errors)} rejected, {len(errors)} errored")
+    print(f"final stock={stock}, users debited={debited}, redemptions recorded={redeemed}")
+
+    oversold = successes > 1 or stock < 0 or debited != successes or redeemed != successes
+    print("FAIL: oversold or inconsistent" if oversold else "OK: no oversell")
+    return not oversold
+
+
+if __name__ == '__main__':
+    sys.exit(0 if load_test(int(sys.argv[1]) if len(sys.argv) > 1 else 50) else 1)
@@ -1,4 +1,5 @@
 import os
+import math
 import uuid
 import base64
 import re
@@ -201,7 +202,12 @@ def register_routes(app):
                 msg, _ = _get_localized_flash('errors.processing_error', 'Error processing image')
                 flash(f"{msg}: {str(e)}", "danger")
         
-        return render_template("index.html", result=result, image_path=image_path, waste_item=waste_item)
+        # Only link the drop point search to materials it can match
+        from materials import normalize_material
+        drop_point_material = normalize_material(result.get("material")) if result else None
+        
+        return render_template("index.html", result=result, image_path=image_path, waste_item=waste_item,
+                               drop_point_material=drop_point_material)
     
     @app.route("/marketplace")
     def marketplace():
@@ -288,19 +294,9 @@ def register_routes(app):
                     points = 50
                     reward_desc = "Sending waste for municipal recycling"
                 
-                # Create a reward record
-                from models import Reward
-                reward = Reward(
-                    user_id=current_user.id,
-                    points=points,
-                    description=reward_desc,
-                    reward_type="municipality"
-                )
-                db.session.add(reward)
-                
-                # Update user's eco points
-                current_user.eco_points += points
-                db.session.commit()
+                # Append to the points ledger (atomic balance increment)
+                import points_ledger
+                points_ledger.credit(current_user.id, points, reward_desc, "municipality", commit=True)
                 
                 # Check if the user has earned any achievements
                 check_achievements(current_user.id)
@@ -335,105 +331,178 @@ def register_routes(app):
     
     @app.route("/drop-points")
     def drop_points():
-        """Display map with waste drop points in Bangalore"""
-        # Predefined drop points in Bangalore
+        """Display map with waste drop points (material=... suggests the nearest that accept it)"""
+        from drop_point_index import get_drop_point_index
+        from materials import normalize_material
         drop_points = [
             {
-                "name": "Dry Waste Collection Center - Koramangala",
-                "lat": 12.9352,
-                "lon": 77.6245,
-                "address": "Koramangala 3rd Block, Bengaluru",
-                "types": ["Plastic", "Paper", "Glass"]
-            },
-            {
-                "name": "E-Waste Collection Center - Indiranagar",
-                "lat": 12.9784,
-                "lon": 77.6408,
-                "address": "100 Feet Road, Indiranagar, Bengaluru",
-                "types": ["E-Waste", "Batteries"]
-            },
-            {
-                "name": "Saahas Zero Waste - HSR Layout",
-                "lat": 12.9116,
-                "lon": 77.6473,
-                "address": "HSR Layout, Bengaluru",
-                "types": ["Plastic", "Paper", "Organic"]
-            },
-            {
-                "name": "ITC WOW Collection Point - Whitefield",
-                "lat": 12.9698,
-                "lon": 77.7500,
-                "address": "Whitefield, Bengaluru",
-                "types": ["Paper", "Cardboard"]
-            },
-            {
-                "name": "BBMP Recycling Center - Jayanagar",
-                "lat": 12.9250,
-                "lon": 77.5938,
-                "address": "Jayanagar 4th Block, Bengaluru",
-                "types": ["Plastic", "Metal", "Glass", "Paper"]
+                "id": point["id"],
+                "name": point["name"],
+                "lat": point["lat"],
+                "lon": point["lng"],
+                "address": point["address"],
+                "types": point["materials"]
             }
+            for point in get_drop_point_index().points
         ]
-        return render_template("drop_points.html", drop_points=drop_points)
+        # Unrecognised materials (e.g. "Unknown" from a scan) would match no drop point
+        return render_template("drop_points.html", drop_points=drop_points,
+                               material=normalize_material(request.args.get("material")) or "")
+
+    @app.route("/api/drop-points/nearest")
+    def api_nearest_drop_points():
+        """
+        Nearest drop points accepting a material (lat, lng; optional material,
+        a comma-separated list matched with match=any or match=all, and limit)
+        """
+        from drop_point_index import find_nearest_drop_points
+        from materials import ANY, ALL
+        try:
+            lat = float(request.args["lat"])
+            lng = float(request.args["lng"])
+            limit = max(1, min(int(request.args.get("limit", 5)), 20))
+            # float() accepts nan and inf, which no grid cell can hold
+            if not (math.isfinite(lat) and math.isfinite(lng) and -90 <= lat <= 90 and -180 <= lng <= 180):
+                raise ValueError("coordinates out of range")
+        except (KeyError, ValueError):
+            return jsonify({"success": False, "error": "lat and lng must be valid coordinates; limit must be a number"}), 400
+
+        material = request.args.get("material") or None
+        match = ALL if request.args.get("match") == ALL else ANY
+        return jsonify({
+            "success": True,
+            "material": material,
+            "drop_points": [
+                {
+                    "id": point["id"],
+                    "name": point["name"],
+                    "address": point["address"],
+                    "lat": point["lat"],
+                    "lng": point["lng"],
+                    "materials": point["materials"],
+                    "distance_km": round(distance, 2)
+                }
+                for point, distance in find_nearest_drop_points(lat, lng, material, limit, match)
+            ]
+        })
 
     @app.route("/leaderboards")
     @login_required
     def leaderboards():
         """Display eco-champion leaderboards"""
         from flask_login import current_user
+        import leaderboard
 
-        # Mock leaderboard data (in a real app, this would come from database)
-        leaderboard_data = [
-            {'username': 'Alex Johnson', 'points': 9875, 'items_recycled': 342, 'badge': 'Champion'},
-            {'username': 'Jane Smith', 'points': 8450, 'items_recycled': 298, 'badge': 'Gold'},
-            {'username': 'Mike Chen', 'points': 7230, 'items_recycled': 276, 'badge': 'Silver'},
-            {'username': 'Sarah Williams', 'points': 6890, 'items_recycled': 255, 'badge': 'Gold'},
-            {'username': 'David Martinez', 'points': 5760, 'items_recycled': 223, 'badge': 'Silver'},
-        ]
+        period = request.args.get("period", "all-time")
+        if period not in leaderboard.PERIODS:
+            period = "all-time"
 
-        # Find current user's rank
-        user_rank = 24  # Mock rank
+        leaderboard_data = leaderboard.get_top(period, 0, 10)
+        standing = leaderboard.get_user_standing(current_user.id, period)
 
         return render_template("leaderboards-eco.html",
                              leaderboard_data=leaderboard_data,
                              current_user=current_user,
-                             user_rank=user_rank)
+                             user_rank=standing['rank'],
+                             user_standing=standing,
+                             period=period)
+
+    @app.route("/api/leaderboards")
+    @login_required
+    def api_leaderboards():
+        """Leaderboard page plus the current user's rank and neighbours as JSON"""
+        import leaderboard
+
+        period = request.args.get("period", "all-time")
+        if period not in leaderboard.PERIODS:
+            return jsonify({'success': False, 'error': 'Invalid period'}), 400
+
+        offset = max(0, request.args.get("offset", 0, type=int))
+        limit = min(100, max(1, request.args.get("limit", 20, type=int)))
+
+        return jsonify({
+            'success': True,
+            'period': period,
+            'entries': leaderboard.get_top(period, offset, limit),
+            'me': leaderboard.get_user_standing(current_user.id, period),
+            'offset': offset,
+            'limit': limit
+        })
 
     @app.route("/rewards")
     @login_required
     def rewards():
         """Display rewards store"""
-        from flask_login import current_user
-
-        # Mock rewards data (in a real app, this would come from database)
-        rewards = [
-            {
-                'name': 'Amazon Gift Card',
-                'points': 2000,
-                'category': 'vouchers',
-                'description': '$20 gift card for eco-friendly purchases',
-                'stock': 15
-            },
-            {
-                'name': 'Tree Sapling Kit',
-                'points': 500,
-                'category': 'plants',
-                'description': 'Grow your own tree with our complete sapling kit',
-                'stock': 50
-            },
-            {
-                'name': 'Bamboo Coffee Cup',
-                'points': 750,
-                'category': 'eco',
-                'description': 'Reusable bamboo coffee cup with ReGenWorks logo',
-                'stock': 30
-            },
-        ]
+        import rewards_catalog
 
         return render_template("rewards-eco.html",
-                             rewards=rewards,
+                             rewards=rewards_catalog.get_catalog(),
                              current_user=current_user)
 
+    @app.route("/rewards/redeem/<int:item_id>", methods=["POST"])
+    @login_required
+    def redeem_reward(item_id):
+        """Redeem a reward straight from the store"""
+        import rewards_catalog
+
+        try:
+            reservation = rewards_catalog.redeem_item(current_user.id, item_id)
+            flash(f"You redeemed {reservation.item.name} for {reservation.points_cost} eco points!", "success")
+        except rewards_catalog.RedemptionError as e:
+            flash(str(e), "warning")
+        except Exception as e:
+            logging.error(f"Error redeeming reward {item_id}: {str(e)}")
+            flash("We couldn't complete your redemption. Please try again.", "danger")
+
+        return redirect(url_for("rewards"))
+
+    @app.route("/api/rewards/reserve/<int:item_id>", methods=["POST"])
+    @login_required
+    def api_reserve_reward(item_id):
+        """Hold one unit of a reward while the user confirms"""
+        import rewards_catalog
+
+        try:
+            reservation = rewards_catalog.reserve_item(current_user.id, item_id)
+        except rewards_catalog.RedemptionError as e:
+            return jsonify({'success': False, 'error': str(e)}), 409
+
+        return jsonify({
+            'success': True,
+            'reservation_id': reservation.id,
+            'item': reservation.item.name,
+            'points_cost': reservation.points_cost,
+            'expires_at': reservation.expires_at.isoformat()
+        })
+
+    @app.route("/api/rewards/reservations/<int:reservation_id>/redeem", methods=["POST"])
+    @login_required
+    def api_redeem_reservation(reservation_id):
+        """Complete a held reservation and spend the points"""
+        import rewards_catalog
+
+        try:
+            reservation = rewards_catalog.redeem_reservation(current_user.id, reservation_id)
+        except rewards_catalog.RedemptionError as e:
+            # Give the unit back straight away rather than waiting for the hold to expire
+            rewards_catalog.cancel_reservation(current_user.id, reservation_id)
+            return jsonify({'success': False, 'error': str(e)}), 409
+
+        return jsonify({
+            'success': True,
+            'item': reservation.item.name,
+            'points_cost': reservation.points_cost,
+            'eco_points': current_user.eco_points
+        })
+
+    @app.route("/api/rewards/reservations/<int:reservation_id>/cancel", methods=["POST"])
+    @login_required
+    def api_cancel_reservation(reservation_id):
+        """Release a held reservation back to stock"""
+        import rewards_catalog
+
+        return jsonify({'success': rewards_catalog.cancel_reservation(current_user.id, reservation_id)})
+
     @app.route("/check-in-drop-point", methods=["POST"])
     @login_required
     def check_in_drop_point():
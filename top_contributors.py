@@ -0,0 +1,382 @@
+"""
+Top-contributor engine for ReGenWorks infrastructure projects.
+
+A project's top contributors are the top 10% of its contributors (at least
+one) ranked by total contributed weight, ties broken by the lower user id.
+This module is the one place that definition lives; the write paths and the
+API read the same answer.
+
+Per-project totals are kept in project_contributor_total. When a batch is
+linked to a project its contributors' totals are bumped and the top set is
+rebalanced in place: the boundary between the top decile and the rest only
+moves by the rows on either side of it, so only users whose membership
+actually changes are touched, and only their ProjectContributor rows get
+their is_top_contributor flag rewritten.
+"""
+
+import sys
+import time
+import logging
+from decimal import Decimal
+from sqlalchemy import func, desc, select, case, or_, and_, update
+from sqlalchemy.exc import IntegrityError
+from app import db
+from models import User, WasteBatch, ProjectContributor, ProjectContributorTotal
+
+TOP_FRACTION = 0.1
+
+
+def top_count(contributors):
+    """Number of top contributors for a project with this many contributors"""
+    return max(1, int(contributors * TOP_FRACTION)) if contributors else 0
+
+
+def _outranks(a, b):
+    """Whether total row a ranks above total row b"""
+    return (a.total_grams, -a.user_id) > (b.total_grams, -b.user_id)
+
+
+def _strongest_outside(project_id):
+    return ProjectContributorTotal.query.filter_by(
+        project_id=project_id, is_top=False
+    ).order_by(desc(ProjectContributorTotal.total_grams), ProjectContributorTotal.user_id).first()
+
+
+def _weakest_inside(project_id):
+    return ProjectContributorTotal.query.filter_by(
+        project_id=project_id, is_top=True
+    ).order_by(ProjectContributorTotal.total_grams, desc(ProjectContributorTotal.user_id)).first()
+
+
+def _rebalance(project_id):
+    """
+    Move the top-decile boundary of a project to match its current totals.
+
+    Returns:
+        Dictionary of user_id -> new is_top for users whose membership changed
+    """
+    contributors, tops = db.session.query(
+        func.count(ProjectContributorTotal.id),
+        func.coalesce(func.sum(case((ProjectContributorTotal.is_top == True, 1), else_=0)), 0)
+    ).filter(ProjectContributorTotal.project_id == project_id).one()
+    wanted = top_count(contributors)
+
+    flipped = {}
+
+    def flip(row, is_top):
+        flipped.setdefault(row.user_id, (row, row.is_top))
+        row.is_top = is_top
+
+    while tops < wanted:
+        flip(_strongest_outside(project_id), True)
+        tops += 1
+    while tops > wanted:
+        flip(_weakest_inside(project_id), False)
+        tops -= 1
+
+    # Totals only grow, so the boundary settles after a swap per overtaking user
+    while wanted:
+        inside, outside = _weakest_inside(project_id), _strongest_outside(project_id)
+        if outside is None or not _outranks(outside, inside):
+            break
+        flip(inside, False)
+        flip(outside, True)
+
+    return {user_id: row.is_top for user_id, (row, was_top) in flipped.items() if row.is_top != was_top}
+
+
+def _mirror_flags(project_id, flags, batch_id=None):
+    """
+    Write is_top_contributor onto ProjectContributor rows of the given users,
+    across all of the project's batches (or only one batch).
+    """
+    if batch_id is not None:
+        batch_ids = [batch_id]
+    else:
+        batch_ids = select(WasteBatch.id).where(WasteBatch.linked_project_id == project_id)
+
+    for is_top in (True, False):
+        user_ids = [user_id for user_id, flag in flags.items() if flag == is_top]
+        if user_ids:
+            ProjectContributor.query.filter(
+                ProjectContributor.batch_id.in_(batch_ids),
+                ProjectContributor.user_id.in_(user_ids)
+            ).update({ProjectContributor.is_top_contributor: is_top}, synchronize_session=False)
+
+
+def _add_to_total(project_id, user_id, grams):
+    """
+    Add grams to a user's running total for a project in the database, so
+    concurrent links of the same user add up instead of overwriting each
+    other. The first contribution inserts the row inside a savepoint; if a
+    concurrent link inserted it first, the increment is applied to that row.
+    """
+    increment = update(ProjectContributorTotal).where(
+        ProjectContributorTotal.project_id == project_id,
+        ProjectContributorTotal.user_id == user_id
+    ).values(total_grams=ProjectContributorTotal.total_grams + grams).execution_options(
+        synchronize_session='fetch'
+    )
+
+    if db.session.execute(increment).rowcount:
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(ProjectContributorTotal(project_id=project_id, user_id=user_id,
+                                                   total_grams=grams, is_top=False))
+    except IntegrityError:
+        db.session.execute(increment)
+
+
+def record_batch_link(project_id, batch_id):
+    """
+    Add a newly linked batch's contributions to a project's totals and update
+    the top contributors. Runs in the caller's transaction (no commit).
+
+    Args:
+        project_id: Project database ID
+        batch_id: WasteBatch database ID of the batch just linked to the project
+
+    Returns:
+        Dictionary of user_id -> new is_top for users whose membership changed
+    """
+    contributions = db.session.query(
+        ProjectContributor.user_id,
+        func.sum(ProjectContributor.contribution_weight_grams)
+    ).filter(ProjectContributor.batch_id == batch_id).group_by(ProjectContributor.user_id).all()
+    if not contributions:
+        return {}
+
+    for user_id, grams in contributions:
+        _add_to_total(project_id, user_id, grams)
+
+    totals = {
+        row.user_id: row
+        for row in ProjectContributorTotal.query.filter(
+            ProjectContributorTotal.project_id == project_id,
+            ProjectContributorTotal.user_id.in_([user_id for user_id, _ in contributions])
+        ).all()
+    }
+
+    changed = _rebalance(project_id)
+    _mirror_flags(project_id, changed)
+
+    # The new batch's rows start unflagged; flag those of users already on top
+    _mirror_flags(project_id, {
+        user_id: True for user_id, row in totals.items() if row.is_top and user_id not in changed
+    }, batch_id=batch_id)
+
+    return changed
+
+
+def rebuild_project(project_id):
+    """
+    Recompute a project's totals and top contributors from ProjectContributor
+    (backfill and repair). Runs in the caller's transaction (no commit).
+
+    Args:
+        project_id: Project database ID
+
+    Returns:
+        Number of contributors
+    """
+    contributions = db.session.query(
+        ProjectContributor.user_id,
+        func.sum(ProjectContributor.contribution_weight_grams).label('total')
+    ).join(WasteBatch, ProjectContributor.batch_id == WasteBatch.id).filter(
+        WasteBatch.linked_project_id == project_id
+    ).group_by(ProjectContributor.user_id).order_by(desc('total'), ProjectContributor.user_id).all()
+
+    top_user_ids = {user_id for user_id, _ in contributions[:top_count(len(contributions))]}
+
+    ProjectContributorTotal.query.filter_by(project_id=project_id).delete(synchronize_session=False)
+    db.session.add_all([
+        ProjectContributorTotal(project_id=project_id, user_id=user_id, total_grams=total,
+                                is_top=user_id in top_user_ids)
+        for user_id, total in contributions
+    ])
+    _mirror_flags(project_id, {user_id: user_id in top_user_ids for user_id, _ in contributions})
+    return len(contributions)
+
+
+def rebuild_all_projects():
+    """
+    One-off migration: build contributor totals for every project with linked
+    batches.
+
+    Returns:
+        Number of projects rebuilt
+    """
+    try:
+        project_ids = [
+            project_id for (project_id,) in db.session.query(WasteBatch.linked_project_id).filter(
+                WasteBatch.linked_project_id.isnot(None)
+            ).distinct().all()
+        ]
+        for project_id in project_ids:
+            rebuild_project(project_id)
+        db.session.commit()
+        logging.info(f"Rebuilt contributor totals for {len(project_ids)} projects")
+        return len(project_ids)
+    except Exception as e:
+        logging.error(f"Error rebuilding contributor totals: {e}")
+        db.session.rollback()
+        return 0
+
+
+def get_project_contributors(project_id, limit=None, after=None):
+    """
+    Contributors of a project in rank order.
+
+    Args:
+        project_id: Project database ID
+        limit: Maximum number of contributors (None for all)
+        after: (contribution_grams, user_id) of the last contributor already
+               seen, to continue from it
+
+    Returns:
+        List of dictionaries with user_id, username, contribution_grams and is_top_contributor
+    """
+    query = db.session.query(
+        ProjectContributorTotal.user_id, User.username, ProjectContributorTotal.total_grams,
+        ProjectContributorTotal.is_top
+    ).join(User, ProjectContributorTotal.user_id == User.id).filter(
+        ProjectContributorTotal.project_id == project_id
+    )
+    if after is not None:
+        total, user_id = Decimal(str(after[0])), int(after[1])
+        query = query.filter(or_(
+            ProjectContributorTotal.total_grams < total,
+            and_(ProjectContributorTotal.total_grams == total, ProjectContributorTotal.user_id > user_id)
+        ))
+    query = query.order_by(desc(ProjectContributorTotal.total_grams), ProjectContributorTotal.user_id)
+    if limit is not None:
+        query = query.limit(limit)
+
+    return [
+        {
+            'user_id': user_id,
+            'username': username,
+            'contribution_grams': float(total),
+            'is_top_contributor': bool(is_top)
+        }
+        for user_id, username, total, is_top in query.all()
+    ]
+
+
+def is_top_contributor(project_id, user_id):
+    """Whether a user is one of a project's top contributors"""
+    return db.session.query(ProjectContributorTotal.is_top).filter_by(
+        project_id=project_id, user_id=user_id
+    ).scalar() or False
+
+
+def benchmark(n_users=2000, n_links=200):
+    """
+    Link n_links single-contributor batches to a project that already has
+    n_users contributors, maintaining the top set incrementally, and check the
+    result against a full rebuild. The seeded rows are deleted afterwards.
+    """
+    import random
+    from datetime import datetime
+    from app import app
+    from models import InfrastructureProject
+    from contribution_chain import count_queries
+
+    stamp = datetime.utcnow().strftime('%Y%m%d%H%M%S%f')
+    prefix = f'tcbench_{stamp}'
+    rng = random.Random(40)
+
+    try:
+        with app.app_context():
+            users = [User(username=f'{prefix}_{i}', email=f'{prefix}_{i}@example.com') for i in range(n_users)]
+            db.session.add_all(users)
+            project = InfrastructureProject(project_id=prefix, project_name='Top contributor bench',
+                                            project_type='bench', location_lat=12.97, location_lng=77.59)
+            db.session.add(project)
+            db.session.flush()
+
+            def link(user, grams, n):
+                batch = WasteBatch(batch_id=f'{prefix}_{n}', material_type='Plastic', total_weight_grams=grams,
+                                   status='allocated', linked_project_id=project.id)
+                db.session.add(batch)
+                db.session.flush()
+                db.session.add(ProjectContributor(user_id=user.id, batch_id=batch.id, contribution_weight_grams=grams))
+                db.session.flush()
+                return batch
+
+            for n, user in enumerate(users):
+                record_batch_link(project.id, link(user, rng.randint(10, 1000), n).id)
+            db.session.commit()
+
+            batch_ids = [link(rng.choice(users), rng.randint(10, 1000), n_users + n).id for n in range(n_links)]
+            db.session.commit()
+
+            flips = 0
+            with count_queries() as incremental_queries:
+                started = time.perf_counter()
+                for batch_id in batch_ids:
+                    flips += len(record_batch_link(project.id, batch_id))
+                db.session.commit()
+                incremental_time = time.perf_counter() - started
+
+            incremental = {row['user_id']: row['is_top_contributor'] for row in get_project_contributors(project.id)}
+            flags = dict(db.session.query(ProjectContributor.user_id, func.max(ProjectContributor.is_top_contributor)).join(
+                WasteBatch, ProjectContributor.batch_id == WasteBatch.id
+            ).filter(WasteBatch.linked_project_id == project.id).group_by(ProjectContributor.user_id).all())
+
+            # What every link used to cost: re-aggregate the project and rewrite
+            # every contributor row's flag
+            started = time.perf_counter()
+            for _ in range(n_links):
+                ranked = db.session.query(
+                    ProjectContributor.user_id,
+                    func.sum(ProjectContributor.contribution_weight_grams).label('total')
+                ).join(WasteBatch, ProjectContributor.batch_id == WasteBatch.id).filter(
+                    WasteBatch.linked_project_id == project.id
+                ).group_by(ProjectContributor.user_id).order_by(desc('total'), ProjectContributor.user_id).all()
+                top_user_ids = [user_id for user_id, _ in ranked[:top_count(len(ranked))]]
+                rewritten = ProjectContributor.query.filter(
+                    ProjectContributor.batch_id.in_(select(WasteBatch.id).where(WasteBatch.linked_project_id == project.id))
+                ).update({ProjectContributor.is_top_contributor: ProjectContributor.user_id.in_(top_user_ids)},
+                         synchronize_session=False)
+            db.session.commit()
+            recompute_time = time.perf_counter() - started
+
+            with count_queries() as rebuild_queries:
+                started = time.perf_counter()
+                rebuild_project(project.id)
+                db.session.commit()
+                rebuild_time = time.perf_counter() - started
+
+            rebuilt = {row['user_id']: row['is_top_contributor'] for row in get_project_contributors(project.id)}
+    finally:
+        # Remove the bench users, project, batches, contributions and totals from the store
+        with app.app_context():
+            db.session.rollback()
+            user_ids = [user_id for (user_id,) in db.session.query(User.id).filter(
+                User.username.like(f'{prefix}_%')
+            ).all()]
+            project_ids = [project_id for (project_id,) in db.session.query(InfrastructureProject.id).filter(
+                InfrastructureProject.project_id == prefix
+            ).all()]
+            ProjectContributorTotal.query.filter(
+                ProjectContributorTotal.project_id.in_(project_ids)
+            ).delete(synchronize_session=False)
+            ProjectContributor.query.filter(ProjectContributor.user_id.in_(user_ids)).delete(synchronize_session=False)
+            WasteBatch.query.filter(WasteBatch.linked_project_id.in_(project_ids)).delete(synchronize_session=False)
+            InfrastructureProject.query.filter(InfrastructureProject.id.in_(project_ids)).delete(synchronize_session=False)
+            User.query.filter(User.id.in_(user_ids)).delete(synchronize_session=False)
+            db.session.commit()
+
+    print(f"{n_links} links over {n_users} contributors: incremental {incremental_time * 1e3:.1f} ms, "
+          f"{incremental_queries[0]} queries, {flips} membership changes; full re-aggregate per link "
+          f"{recompute_time * 1e3:.1f} ms, {rewritten} rows rewritten per link; "
+          f"one rebuild {rebuild_queries[0]} queries in {rebuild_time * 1e3:.1f} ms")
+    ok = incremental == rebuilt and all(bool(flags[user_id]) == is_top for user_id, is_top in rebuilt.items())
+    print("OK: incremental top set matches a full rebuild" if ok else "FAIL: top sets differ")
+    return ok
+
+
+if __name__ == '__main__':
+    sys.exit(0 if benchmark() else 1)
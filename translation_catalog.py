@@ -0,0 +1,252 @@
+"""
+Compiled translation catalog for ReGenWorks.
+
+The locales/*.json files are compiled into one immutable catalog. Each
+language gets a flat, read-only mapping of every key to its translation, with
+English already filled in for the keys the language lacks. The catalog is
+the memory-mapped catalog.bin shared by every worker (see locale_catalog.py);
+strings a worker has used are kept decoded, so a repeat lookup is a single
+dict access. If catalog.bin is stale and cannot be rewritten, the JSON files
+are loaded into memory instead. The catalog is rebuilt when a locale file is
+added, removed or modified, which is checked at most every
+CATALOG_CHECK_SECONDS.
+
+Keys missing from every JSON file fall back to LocalizationString rows. Only
+the first lookup of each (language, key) queries the database. The answer,
+including "not found", is remembered until the catalog is rebuilt or a
+LocalizationString changes in this process. Untranslated keys then cost no
+database query on later renders.
+"""
+
+import os
+import sys
+import time
+import logging
+import threading
+from types import MappingProxyType
+from flask import has_app_context
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from locale_catalog import FALLBACK_LANGUAGE, MISSING, locales_dir, source_stamp, load_sources, open_catalog
+
+logger = logging.getLogger(__name__)
+
+CATALOG_CHECK_SECONDS = float(os.environ.get('LOCALE_CHECK_SECONDS', '2'))
+
+# Database fallback answers kept before the cache is cleared
+MAX_FALLBACK_ENTRIES = 10000
+
+
+class TranslationCatalog:
+    """Immutable snapshot of every language's translations"""
+
+    def __init__(self, sources):
+        """
+        Args:
+            sources: Dictionary of language code to {key: translation}
+        """
+        fallback = sources.get(FALLBACK_LANGUAGE, {})
+        self.strings = MappingProxyType({
+            language: MappingProxyType({**fallback, **translations})
+            for language, translations in sources.items()
+        })
+        self.fallback = self.strings.get(FALLBACK_LANGUAGE, MappingProxyType({}))
+        self.languages = tuple(sorted(self.strings))
+
+    def lookup(self, language):
+        """Translations for a language, English for an unknown language"""
+        return self.strings.get(language, self.fallback)
+
+
+def compile_catalog(directory=None):
+    """
+    Compile the locale files of a directory into an in-memory catalog.
+
+    Args:
+        directory: Locale directory (locales_dir() if None)
+
+    Returns:
+        TranslationCatalog; files that cannot be parsed are left out
+    """
+    return TranslationCatalog(load_sources(directory))
+
+
+# ============================================================================
+# SHARED CATALOG
+# ============================================================================
+
+_catalog = None
+_catalog_stamp = None
+_checked_at = 0.0
+_catalog_lock = threading.Lock()
+
+_fallback_strings = {}
+
+
+def get_catalog():
+    """
+    The current catalog, recompiling it if a locale file changed.
+
+    Returns:
+        MappedCatalog, or TranslationCatalog when catalog.bin cannot be written
+    """
+    global _catalog, _catalog_stamp, _checked_at
+
+    if _catalog is not None and time.monotonic() - _checked_at < CATALOG_CHECK_SECONDS:
+        return _catalog
+
+    with _catalog_lock:
+        if _catalog is not None and time.monotonic() - _checked_at < CATALOG_CHECK_SECONDS:
+            return _catalog
+
+        directory = locales_dir()
+        stamp = source_stamp(directory)
+        if _catalog is None or stamp != _catalog_stamp:
+            try:
+                _catalog = open_catalog(directory, stamp)
+            except OSError as e:
+                # Read-only deployment without a current catalog.bin
+                logger.warning(f"Locale catalog unavailable, loading JSON files instead: {e}")
+                _catalog = compile_catalog(directory)
+            _catalog_stamp = stamp
+            _fallback_strings.clear()
+        _checked_at = time.monotonic()
+        return _catalog
+
+
+def _query_fallback(key, language):
+    """Translation from LocalizationString in the language, then in English"""
+    from models import LocalizationString
+
+    languages = [language] if language == FALLBACK_LANGUAGE else [language, FALLBACK_LANGUAGE]
+    values = dict(
+        LocalizationString.query.with_entities(LocalizationString.language, LocalizationString.value).filter(
+            LocalizationString.key == key,
+            LocalizationString.language.in_(languages)
+        ).all()
+    )
+    for candidate in languages:
+        if candidate in values:
+            return values[candidate]
+    return MISSING
+
+
+def database_fallback(key, language):
+    """
+    Translation of a key that is not in the catalog, from the database.
+
+    Args:
+        key: String key
+        language: Language code
+
+    Returns:
+        Translation, or MISSING
+    """
+    cache_key = (language, key)
+    value = _fallback_strings.get(cache_key)
+    if value is not None:
+        return value
+
+    if not has_app_context():
+        return MISSING
+    try:
+        value = _query_fallback(key, language)
+    except SQLAlchemyError as e:
+        logger.warning(f"Localization fallback query failed for {key!r}: {e}")
+        value = MISSING
+
+    if len(_fallback_strings) >= MAX_FALLBACK_ENTRIES:
+        _fallback_strings.clear()
+    _fallback_strings[cache_key] = value
+    return value
+
+
+def translate(key, language, default=None):
+    """
+    Translate a key: catalog, then English, then the database.
+
+    Args:
+        key: String key (e.g., 'nav.scan')
+        language: Language code
+        default: Returned (or else the key itself) when no translation exists
+
+    Returns:
+        Localized string
+    """
+    value = get_catalog().lookup(language).get(key, MISSING)
+    if value is MISSING:
+        value = database_fallback(key, language)
+        if value is MISSING:
+            return default or key
+    return value
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_localization_changes(session, flush_context):
+    from models import LocalizationString
+    if any(isinstance(obj, LocalizationString) for obj in list(session.new) + list(session.dirty) + list(session.deleted)):
+        session.info['localization_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _clear_fallbacks_after_commit(session):
+    if session.info.pop('localization_changed', False):
+        _fallback_strings.clear()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_localization_changes(session):
+    session.info.pop('localization_changed', None)
+
+
+# ============================================================================
+# BENCHMARK
+# ============================================================================
+
+def benchmark(rounds=200):
+    """
+    Look up every English key plus untranslated keys in every language, and
+    check that repeat lookups of untranslated keys run no SQL.
+    """
+    from app import app, db
+
+    catalog = get_catalog()
+    keys = list(catalog.fallback) + [f'missing.key_{i}' for i in range(20)]
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            started = time.perf_counter()
+            for language in catalog.languages:
+                for key in keys:
+                    translate(key, language)
+            cold_time = time.perf_counter() - started
+            cold_queries = len(statements)
+
+            del statements[:]
+            started = time.perf_counter()
+            for _ in range(rounds):
+                for language in catalog.languages:
+                    for key in keys:
+                        translate(key, language)
+            warm_time = time.perf_counter() - started
+            lookups = rounds * len(catalog.languages) * len(keys)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+
+    print(f"{len(catalog.languages)} languages, {len(catalog.fallback)} keys, 20 untranslated keys")
+    print(f"first pass:  {cold_queries} queries, {cold_time * 1e3:.0f} ms")
+    print(f"later passes: {len(statements)} queries, {lookups / warm_time:,.0f} lookups/s "
+          f"({warm_time / lookups * 1e6:.2f} us each)")
+    ok = not statements and all(translate(key, language) for language in catalog.languages for key in keys)
+    print("OK: no database queries after the first lookup" if ok else "FAIL")
+    return ok
+
+
+if __name__ == '__main__':
+    sys.exit(0 if benchmark() else 1)